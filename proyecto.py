@@ -17,6 +17,14 @@ from src.indexer import main as build_index
 from src.cli import main as run_cli
 from src.evaluator import main as run_evaluation
 
+def find_index():
+    """Índice construido por la opción 1: data/index o, con --shards, data/shards"""
+    for path in ("data/index", "data/shards"):
+        # meta.json (segmento), segments.json (incremental) o shards.json (particionado)
+        if any(os.path.exists(os.path.join(path, name)) for name in ("meta.json", "segments.json", "shards.json")):
+            return path
+    return None
+
 def print_banner():
     """Muestra el logo del sistema en ASCII"""
     print(Fore.CYAN + figlet_format("TREC CAR", font="slant"))
@@ -58,17 +66,19 @@ def main():
                 
             elif choice == '2':
                 print(Fore.CYAN + "\n🔍 Iniciando interfaz de consultas...\n")
-                if not os.path.exists("data/index.pkl"):
+                index_path = find_index()
+                if index_path is None:
                     print(Fore.RED + "❌ Error: Índice no encontrado. Ejecuta primero la opción 1.")
                     continue
-                run_cli()
+                run_cli(["--index", index_path])
                 
             elif choice == '3':
                 print(Fore.MAGENTA + "\n📊 Ejecutando evaluación...\n")
-                if not os.path.exists("data/index.pkl"):
+                index_path = find_index()
+                if index_path is None:
                     print(Fore.RED + "❌ Error: Índice no encontrado. Ejecuta primero la opción 1.")
                     continue
-                run_evaluation()
+                run_evaluation(["--index", index_path])
                 
             elif choice == '4':
                 print(Fore.GREEN + "\n👋 ¡Hasta luego!")
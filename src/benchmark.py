@@ -0,0 +1,282 @@
+"""
+Benchmark de recuperación: reproduce las consultas de test200 (o un log
+sintético) contra RetrievalSystem y mide tiempo de carga del índice, RSS
+máximo, latencias p50/p95/p99 por consulta, postings puntuadas por consulta y
+QPS. Los resultados se guardan en JSON y pueden compararse con una línea base
+para detectar regresiones.
+
+Uso: python -m src.benchmark --synthetic 2000 --save-baseline
+     python -m src.benchmark --synthetic 2000 --baseline results/benchmark_baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from .retrieval import BATCH_QUERIES, RetrievalSystem
+from .segment_set import SegmentSet
+from .utils import save_results
+
+# (nombre, modelo, estrategia) de cada configuración medida; "batch" usa search_batch
+CONFIGS = (
+    ("tfidf", "tfidf", "exhaustive"),
+    ("bm25", "bm25", "exhaustive"),
+    ("bm25-wand", "bm25", "wand"),
+    ("tfidf-batch", "tfidf", "batch"),
+    ("bm25-batch", "bm25", "batch"),
+)
+# Fracción de los términos del diccionario (por df) considerados frecuentes
+FREQUENT_HEAD = 0.01
+PERCENTILES = (50, 95, 99)
+
+
+def peak_rss_mb() -> float:
+    """RSS máximo del proceso en MiB (ru_maxrss está en KiB en Linux y en bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def synthetic_queries(segment, count: int, min_terms: int = 1, max_terms: int = 5,
+                      frequent_ratio: float = 0.3, seed: int = 0) -> List[str]:
+    """
+    Log sintético de consultas sacadas del diccionario del índice.
+
+    Cada término es, con probabilidad `frequent_ratio`, uno de los términos
+    más frecuentes (el FREQUENT_HEAD superior por df, con listas largas) y si
+    no uno cualquiera del resto, lo que permite ajustar la mezcla de postings
+    largas y cortas.
+    """
+    if isinstance(segment, SegmentSet):
+        # El diccionario del segmento más grande representa bien a la colección
+        segment = max(segment.segments, key=lambda s: s.doc_count)
+    dfs = np.asarray(segment.term_dfs)
+    if len(dfs) == 0:
+        return []
+    by_df = np.argsort(-dfs, kind='stable')
+    head = max(1, int(len(by_df) * FREQUENT_HEAD))
+    frequent, rare = by_df[:head], by_df[head:] if len(by_df) > head else by_df
+    rng = np.random.default_rng(seed)
+    queries = []
+    for length in rng.integers(min_terms, max_terms + 1, size=count).tolist():
+        pools = np.where(rng.random(length) < frequent_ratio, 0, 1).tolist()
+        terms = [segment.terms[int(rng.choice(frequent if pool == 0 else rare))] for pool in pools]
+        queries.append(" ".join(terms))
+    return queries
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {f"p{p}": 0.0 for p in PERCENTILES}
+    array = np.asarray(values)
+    return {f"p{p}": float(np.percentile(array, p)) for p in PERCENTILES}
+
+
+def _postings_scored(system: RetrievalSystem, query_terms: List[str], strategy: str) -> int:
+    """Postings puntuadas por la última consulta (WAND lleva su propio contador)"""
+    if strategy == "wand":
+        return system.wand.postings_scored
+    # La búsqueda exhaustiva puntúa la lista completa de cada aparición de un término
+    return sum(system.segment.df(term) for term in query_terms)
+
+
+def run_config(system: RetrievalSystem, queries: List[str], model: str, strategy: str,
+               k: int = 100, warmup: int = 10) -> Dict:
+    """Ejecuta todas las consultas con una configuración y resume latencias y trabajo"""
+    if strategy == "batch":
+        return _run_batch_config(system, queries, model, k, warmup)
+    search = system.tfidf_search if model == "tfidf" else \
+        lambda query, k: system.bm25_search(query, k=k, strategy=strategy)
+    for query in queries[:warmup]:
+        search(query, k)
+
+    latencies, postings = [], []
+    start = time.perf_counter()
+    for query in queries:
+        query_start = time.perf_counter()
+        search(query, k)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+        postings.append(_postings_scored(system, system.query_terms(query), strategy))
+    elapsed = time.perf_counter() - start
+    return _summarize(queries, elapsed, latencies, postings)
+
+
+def _run_batch_config(system: RetrievalSystem, queries: List[str], model: str, k: int,
+                      warmup: int) -> Dict:
+    """
+    Como run_config con search_batch en lotes de BATCH_QUERIES consultas; la
+    latencia de cada consulta es la de su lote repartida entre sus consultas
+    """
+    system.search_batch(queries[:warmup], model, k)
+    latencies, postings = [], []
+    start = time.perf_counter()
+    for first in range(0, len(queries), BATCH_QUERIES):
+        batch = queries[first:first + BATCH_QUERIES]
+        batch_start = time.perf_counter()
+        system.search_batch(batch, model, k)
+        latencies.extend([(time.perf_counter() - batch_start) * 1000 / len(batch)] * len(batch))
+        postings.extend(_postings_scored(system, system.query_terms(query), "exhaustive") for query in batch)
+    elapsed = time.perf_counter() - start
+    return _summarize(queries, elapsed, latencies, postings)
+
+
+def _summarize(queries: List[str], elapsed: float, latencies: List[float], postings: List[int]) -> Dict:
+    return {
+        'queries': len(queries),
+        'seconds': elapsed,
+        'qps': len(queries) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {'mean': float(np.mean(latencies)) if latencies else 0.0,
+                       **_percentiles(latencies)},
+        'postings_scored': {'mean': float(np.mean(postings)) if postings else 0.0,
+                            **_percentiles(postings)},
+    }
+
+
+def run_benchmark(index_path: str = "data/index", queries: Optional[List[str]] = None,
+                  synthetic: int = 0, backend: str = "python", k: int = 100, warmup: int = 10,
+                  configs=CONFIGS, **synthetic_options) -> Dict:
+    """
+    Mide carga y búsqueda sobre un índice.
+
+    Args:
+        index_path: Directorio del índice
+        queries: Consultas a reproducir (None = las del dataset test200)
+        synthetic: Consultas sintéticas adicionales generadas del diccionario
+        backend: Motor de scoring de RetrievalSystem
+        k: Documentos recuperados por consulta
+        warmup: Consultas de calentamiento (no medidas) por configuración
+        configs: (nombre, modelo, estrategia) a medir
+
+    Returns:
+        Diccionario de resultados (se puede guardar en JSON)
+    """
+    start = time.perf_counter()
+    # Sin caché de resultados: cada consulta se puntúa de verdad
+    system = RetrievalSystem(index_path, backend=backend, cache_size=0)
+    load_seconds = time.perf_counter() - start
+    rss_after_load = peak_rss_mb()
+
+    workloads = {}
+    if queries is None:
+        from .loadgen import load_queries
+        queries = load_queries()
+    if queries:
+        workloads['test200'] = queries
+    if synthetic > 0:
+        workloads['synthetic'] = synthetic_queries(system.segment, synthetic, **synthetic_options)
+
+    results = {
+        'index_path': index_path,
+        'backend': backend,
+        'k': k,
+        'python': platform.python_version(),
+        'doc_count': system.doc_count,
+        'load_seconds': load_seconds,
+        'peak_rss_mb_after_load': rss_after_load,
+        'workloads': {},
+    }
+    for workload, workload_queries in workloads.items():
+        results['workloads'][workload] = {
+            name: run_config(system, workload_queries, model, strategy, k, warmup)
+            for name, model, strategy in configs
+        }
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.1) -> List[str]:
+    """
+    Regresiones respecto a la línea base: latencias que crecen o QPS que cae
+    más de `tolerance`, y postings puntuadas que aumentan (deberían ser deterministas).
+    """
+    regressions = []
+    if results['load_seconds'] > baseline['load_seconds'] * (1 + tolerance):
+        regressions.append(f"carga del índice: {baseline['load_seconds']:.3f}s -> {results['load_seconds']:.3f}s")
+    for workload, configs in results['workloads'].items():
+        for name, current in configs.items():
+            previous = baseline.get('workloads', {}).get(workload, {}).get(name)
+            if previous is None:
+                continue
+            label = f"{workload}/{name}"
+            for stat in ('p50', 'p95', 'p99'):
+                before, after = previous['latency_ms'][stat], current['latency_ms'][stat]
+                if after > before * (1 + tolerance):
+                    regressions.append(f"{label} latencia {stat}: {before:.3f}ms -> {after:.3f}ms")
+            if current['qps'] < previous['qps'] / (1 + tolerance):
+                regressions.append(f"{label} QPS: {previous['qps']:.1f} -> {current['qps']:.1f}")
+            if current['postings_scored']['mean'] > previous['postings_scored']['mean'] * (1 + tolerance):
+                regressions.append(f"{label} postings por consulta: {previous['postings_scored']['mean']:.0f} "
+                                   f"-> {current['postings_scored']['mean']:.0f}")
+    return regressions
+
+
+def display(results: Dict) -> None:
+    """Tabla resumen por carga de trabajo y configuración"""
+    print(f"\nÍndice: {results['index_path']} ({results['doc_count']} documentos, backend {results['backend']})")
+    print(f"Carga: {results['load_seconds']:.3f}s, RSS máximo {results['peak_rss_mb']:.1f} MiB "
+          f"({results['peak_rss_mb_after_load']:.1f} MiB tras la carga)")
+    for workload, configs in results['workloads'].items():
+        print(f"\n{workload}:")
+        print(f"  {'config':<12} {'QPS':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'postings':>10}")
+        for name, stats in configs.items():
+            latency = stats['latency_ms']
+            print(f"  {name:<12} {stats['qps']:>9.1f} {latency['p50']:>9.3f} {latency['p95']:>9.3f} "
+                  f"{latency['p99']:>9.3f} {stats['postings_scored']['mean']:>10.0f}")
+
+
+def main(argv=None):
+    """Ejecuta el benchmark, guarda los resultados y los compara con la línea base"""
+    parser = argparse.ArgumentParser(description="Benchmark de recuperación")
+    parser.add_argument("--index", default="data/index")
+    parser.add_argument("--backend", default="python", choices=RetrievalSystem.BACKENDS)
+    parser.add_argument("--queries", default=None, help="archivo con una consulta por línea (por defecto test200)")
+    parser.add_argument("--no-dataset", action="store_true", help="solo el log sintético")
+    parser.add_argument("--synthetic", type=int, default=0, help="consultas sintéticas a generar")
+    parser.add_argument("--min-terms", type=int, default=1)
+    parser.add_argument("--max-terms", type=int, default=5)
+    parser.add_argument("--frequent-ratio", type=float, default=0.3,
+                        help="probabilidad de que un término sintético sea frecuente")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-k", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--output", default="results/benchmark.json")
+    parser.add_argument("--baseline", default="results/benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="guarda estos resultados como línea base")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="margen relativo antes de avisar")
+    args = parser.parse_args(argv)
+
+    if args.no_dataset:
+        queries = []
+    else:
+        from .loadgen import load_queries
+        queries = load_queries(args.queries)
+    results = run_benchmark(args.index, queries, args.synthetic, args.backend, args.k, args.warmup,
+                            min_terms=args.min_terms, max_terms=args.max_terms,
+                            frequent_ratio=args.frequent_ratio, seed=args.seed)
+    display(results)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    save_results(results, args.output)
+    print(f"\nResultados guardados en: {args.output}")
+
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f"Línea base guardada en: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("Sin línea base para comparar (usa --save-baseline)")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f"\n⚠️  Regresiones respecto a {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nSin regresiones respecto a {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
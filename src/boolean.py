@@ -0,0 +1,223 @@
+"""
+Consultas booleanas (AND / OR / NOT) con intersección por tabla de saltos.
+
+La consulta se analiza en un árbol de operadores (NOT > AND > OR; las palabras
+contiguas sin operador se unen con AND) y se evalúa sobre ordinales ordenados.
+Una intersección parte del operando más selectivo (menor df) y comprueba el
+resto de operandos solo sobre sus candidatos: cada candidato se busca en la
+tabla de saltos (último ordinal de cada bloque) y solo se decodifican los
+bloques que pueden contenerlo, de modo que una consulta selectiva toca una
+fracción mínima de las postings. Los documentos que cumplen la consulta se
+puntúan con BM25 sobre sus términos no negados.
+"""
+import math
+import re
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from .segment import BLOCK_SIZE
+
+BOOLEAN_OPERATORS = {"AND", "OR", "NOT"}
+# Modos de RetrievalSystem.boolean_search: sintaxis booleana, conjuntiva
+# (todos los términos) y conjuntiva completada con la disyuntiva
+BOOLEAN_MODES = ("boolean", "and", "fallback")
+
+_TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+
+def parse_query(query: str, analyze: Callable[[str], List[str]]) -> Optional[tuple]:
+    """
+    Árbol de la consulta: ('term', t), ('and', hijos), ('or', hijos) o ('not', hijo).
+
+    Args:
+        query: Texto con operadores AND, OR y NOT en mayúsculas y paréntesis
+        analyze: Preprocesamiento de cada palabra (una palabra puede dar varios
+            términos, que se unen con AND, o ninguno, y entonces se ignora)
+
+    Returns:
+        El árbol, o None si la consulta no tiene términos
+    """
+    tokens = _TOKEN.findall(query)
+    position = 0
+
+    def peek() -> Optional[str]:
+        return tokens[position] if position < len(tokens) else None
+
+    def expect_operand():
+        if peek() is None or peek() in ("AND", "OR", ")"):
+            raise ValueError(f"Consulta booleana mal formada: falta un operando en {query!r}")
+
+    def or_expression():
+        nonlocal position
+        children = [and_expression()]
+        while peek() == "OR":
+            position += 1
+            children.append(and_expression())
+        return _combine('or', children)
+
+    def and_expression():
+        nonlocal position
+        children = [not_expression()]
+        while peek() not in (None, "OR", ")"):
+            if peek() == "AND":
+                position += 1
+            children.append(not_expression())
+        return _combine('and', children)
+
+    def not_expression():
+        nonlocal position
+        expect_operand()
+        if peek() == "NOT":
+            position += 1
+            child = not_expression()
+            return ('not', child) if child is not None else None
+        return atom()
+
+    def atom():
+        nonlocal position
+        token = peek()
+        position += 1
+        if token == "(":
+            node = or_expression()
+            if peek() != ")":
+                raise ValueError(f"Consulta booleana mal formada: falta ')' en {query!r}")
+            position += 1
+            return node
+        terms = analyze(token)
+        return _combine('and', [('term', term) for term in terms])
+
+    if not tokens:
+        return None
+    tree = or_expression()
+    if position < len(tokens):
+        raise ValueError(f"Consulta booleana mal formada: ')' sin abrir en {query!r}")
+    return tree
+
+
+def _combine(operator: str, children: List[Optional[tuple]]) -> Optional[tuple]:
+    """Nodo con los hijos no vacíos (el hijo único sustituye al nodo)"""
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return (operator, tuple(children))
+
+
+def conjunction(query_terms: List[str]) -> Optional[tuple]:
+    """Árbol AND de todos los términos de la consulta"""
+    return _combine('and', [('term', term) for term in query_terms])
+
+
+def positive_terms(node: Optional[tuple]) -> List[str]:
+    """Términos fuera de un NOT, en el orden de la consulta y con repeticiones"""
+    if node is None or node[0] == 'not':
+        return []
+    if node[0] == 'term':
+        return [node[1]]
+    return [term for child in node[1] for term in positive_terms(child)]
+
+
+class BooleanMatcher:
+    """Evalúa árboles booleanos sobre un Segment o SegmentSet"""
+
+    def __init__(self, segment):
+        self.segment = segment
+
+    def cost(self, node: tuple) -> float:
+        """Estimación del tamaño del resultado (para ordenar los operandos de un AND)"""
+        if node[0] == 'term':
+            return self.segment.df(node[1])
+        if node[0] == 'or':
+            return sum(self.cost(child) for child in node[1])
+        if node[0] == 'and':
+            return min([self.cost(child) for child in node[1] if child[0] != 'not'] + [math.inf])
+        return math.inf
+
+    def match(self, node: tuple, candidates: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Ordinales (ordenados) que cumplen el nodo.
+
+        Args:
+            candidates: Si se indica, solo se buscan estos ordinales (ordenados):
+                las postings se consultan por la tabla de saltos en lugar de
+                decodificarse enteras
+        """
+        kind = node[0]
+        if kind == 'term':
+            if candidates is None:
+                return self.segment.postings(node[1])[0]
+            return candidates[self.frequencies(node[1], candidates) > 0]
+        if kind == 'not':
+            if candidates is None:
+                raise ValueError("NOT necesita un término positivo con el que combinarse (p. ej. 'a NOT b')")
+            return self._exclude(candidates, node[1])
+        if kind == 'or':
+            parts = [self.match(child, candidates) for child in node[1]]
+            return np.unique(np.concatenate(parts + [np.zeros(0, dtype=np.int64)]))
+
+        # AND: operandos positivos del más selectivo al menos; los NOT, al final
+        positives = sorted((child for child in node[1] if child[0] != 'not'), key=self.cost)
+        negatives = [child[1] for child in node[1] if child[0] == 'not']
+        result = candidates
+        for child in positives:
+            result = self.match(child, result)
+            if len(result) == 0:
+                return result
+        if result is None:
+            raise ValueError("NOT necesita un término positivo con el que combinarse (p. ej. 'a NOT b')")
+        for child in negatives:
+            result = self._exclude(result, child)
+        return result
+
+    def frequencies(self, term: str, docs: np.ndarray) -> np.ndarray:
+        """
+        tf del término en cada documento de `docs` (ordenados; 0 si no aparece).
+        Con pocos candidatos frente a la lista se buscan por la tabla de saltos;
+        si cubrirían la mayoría de sus bloques, se decodifica la lista entera.
+        """
+        if len(docs) * BLOCK_SIZE < self.segment.df(term):
+            return self.segment.term_frequencies(term, docs)
+        postings, tfs = self.segment.postings(term)
+        if len(postings) == 0:
+            return np.zeros(len(docs), dtype=np.int64)
+        found = np.minimum(np.searchsorted(postings, docs), len(postings) - 1)
+        return np.where(postings[found] == docs, tfs[found], 0)
+
+    def bm25(self, query_terms: List[str], docs: np.ndarray, doc_count: int, avg_doc_length: float,
+             k1: float, b: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Scores BM25 de los documentos `docs` (ordenados) sumados término a
+        término en el orden de la consulta, como el motor exhaustivo en Python.
+
+        Returns:
+            (docs, scores) en el orden de primera aparición del motor exhaustivo:
+            por el primer término de la consulta que contiene cada documento y,
+            dentro de él, por ordinal
+        """
+        scores = np.zeros(len(docs), dtype=np.float64)
+        first = np.full(len(docs), len(query_terms), dtype=np.int64)
+        if len(docs) == 0:
+            return docs, scores
+        lengths = np.asarray(self.segment.doc_lengths[docs], dtype=np.float64)
+        norms = k1 * (1 - b + b * (lengths / avg_doc_length))
+        tfs = {}
+        for position, term in enumerate(query_terms):
+            if term not in tfs:
+                tfs[term] = self.frequencies(term, docs).astype(np.float64)
+            present = tfs[term] > 0
+            if not present.any():
+                continue
+            df = self.segment.df(term)
+            idf = math.log((doc_count - df + 0.5) / (df + 0.5))
+            contribution = idf * ((tfs[term] * (k1 + 1)) / (tfs[term] + norms))
+            scores[present] += contribution[present]
+            first[present & (first == len(query_terms))] = position
+        order = np.lexsort((docs, first))
+        return docs[order], scores[order]
+
+    def _exclude(self, candidates: np.ndarray, node: tuple) -> np.ndarray:
+        """Candidatos que no cumplen el nodo"""
+        if len(candidates) == 0:
+            return candidates
+        return candidates[~np.isin(candidates, self.match(node, candidates), assume_unique=True)]
+
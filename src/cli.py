@@ -1,15 +1,19 @@
+import argparse
 import sys
 from colorama import Fore, Style, init
-from .retrieval import RetrievalSystem
+from .boolean import BOOLEAN_OPERATORS
+from .retrieval import open_retrieval_system
+from .sharding import ShardedRetrievalSystem
 from .utils import get_doc_text_by_id # Importa la función para recuperar el texto
 
 # Inicializar colorama correctamente
 init(autoreset=True, convert=True)
 class SearchCLI:
     """Interfaz de línea de comandos para búsquedas"""
-    def __init__(self):
+    def __init__(self, index_path: str = "data/index"):
         try:
-            self.retrieval_system = RetrievalSystem()
+            # Un índice particionado (indexer --shards N) se consulta con scatter-gather
+            self.retrieval_system = open_retrieval_system(index_path)
             print(Fore.GREEN + "✔ Sistema de recuperación cargado correctamente")
         except FileNotFoundError as e:
             print(Fore.RED + f"✖ Error: {e}")
@@ -29,6 +33,7 @@ class SearchCLI:
         print(Fore.WHITE + "  • Escribe una consulta para buscar")
         print("  • 'quit' o 'exit' para salir")
         print("  • 'help' para mostrar esta ayuda")
+        print("  • 'stats' para ver aciertos de la caché de consultas")
         print(Fore.YELLOW + "═" * 65)
 
         while True:
@@ -46,6 +51,10 @@ class SearchCLI:
                     self._show_help()
                     continue
 
+                if query.lower() == 'stats':
+                    self._show_stats()
+                    continue
+
                 self._process_query(query)
 
             except KeyboardInterrupt:
@@ -59,6 +68,15 @@ class SearchCLI:
         print(Fore.MAGENTA + f"\n🔎 Buscando: '{query}'")
         print(Fore.LIGHTBLACK_EX + "─" * 50)
 
+        # Con operadores AND / OR / NOT la consulta es booleana
+        if BOOLEAN_OPERATORS & set(query.replace("(", " ").replace(")", " ").split()):
+            if isinstance(self.retrieval_system, ShardedRetrievalSystem):
+                print(Fore.RED + "  ⚠️  Las consultas booleanas requieren un índice sin particionar.")
+                return
+            print(Fore.CYAN + "\n🔣 RESULTADOS BOOLEANOS (BM25):")
+            self._display_results(self.retrieval_system.boolean_search(query, k=10))
+            return
+
         # TF-IDF
         print(Fore.CYAN + "\n📊 RESULTADOS TF-IDF:")
         tfidf_results = self.retrieval_system.tfidf_search(query, k=10)
@@ -78,8 +96,8 @@ class SearchCLI:
         print(Fore.YELLOW + f"\n{'#':>2}  {'DocID':<45} {'Texto':<53} {'Score':>8}")
         print(Fore.YELLOW + "-" * 110)
         for i, (doc_id, score) in enumerate(results, 1):
-            doc_text = get_doc_text_by_id(doc_id, self.retrieval_system.doc_texts)
-            resumen = doc_text[:50].replace('\n', ' ') if doc_text else "[Sin texto]"
+            doc_text = get_doc_text_by_id(doc_id, self.retrieval_system.doc_texts, max_chars=50)
+            resumen = doc_text.replace('\n', ' ') if doc_text else "[Sin texto]"
             print(
                 Fore.YELLOW + f"{i:2d}. " +
                 Fore.WHITE + f"{doc_id[:45]:<45} " +
@@ -87,6 +105,13 @@ class SearchCLI:
                 Fore.GREEN + f"{score:8.4f}"
             )
 
+    def _show_stats(self):
+        """Muestra los contadores de las cachés de consultas"""
+        for name, stats in self.retrieval_system.cache_stats().items():
+            print(Fore.CYAN + f"  Caché de {name}: " + Fore.WHITE +
+                  f"{stats['hits']} aciertos, {stats['misses']} fallos "
+                  f"({stats['hit_rate']:.1%}), {stats['size']}/{stats['maxsize']} entradas")
+
     def _show_help(self):
         """Muestra ayuda detallada"""
         print(Fore.YELLOW + "\n" + "═" * 65)
@@ -100,11 +125,16 @@ class SearchCLI:
         print(Fore.BLUE + "  • 'machine learning algorithms'")
         print("  • 'neural networks deep learning'")
         print("  • 'information retrieval systems'")
+        print("  • 'retrieval AND (neural OR deep) NOT image' (consulta booleana)")
         print(Fore.YELLOW + "═" * 65)
 
-def main():
+def main(argv=None):
     """Función principal de la CLI"""
-    cli = SearchCLI()
+    parser = argparse.ArgumentParser(description="Búsqueda interactiva")
+    parser.add_argument("--index", default="data/index",
+                        help="directorio del índice (un índice particionado, p. ej. data/shards, se detecta solo)")
+    args = parser.parse_args(argv)
+    cli = SearchCLI(args.index)
     cli.run()
 
 if __name__ == "__main__":
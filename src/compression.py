@@ -0,0 +1,99 @@
+"""
+Compresión de postings: codificación delta y varint vectorizada con NumPy
+"""
+import numpy as np
+
+# Un varint de 64 bits ocupa como máximo 10 bytes de 7 bits útiles
+MAX_VARINT_BYTES = 10
+
+
+def varint_sizes(values: np.ndarray) -> np.ndarray:
+    """Número de bytes que ocupa cada valor codificado como varint"""
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, MAX_VARINT_BYTES):
+        sizes += values >= np.uint64(1 << (7 * k))
+    return sizes
+
+
+def encode_varint(values: np.ndarray) -> np.ndarray:
+    """
+    Codifica enteros no negativos como varint (7 bits por byte, bit alto = continúa)
+
+    Args:
+        values: Arreglo de enteros no negativos
+
+    Returns:
+        Arreglo uint8 con los bytes codificados
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = varint_sizes(values)
+    out = np.zeros(int(sizes.sum()), dtype=np.uint8)
+    starts = np.cumsum(sizes) - sizes
+    for k in range(int(sizes.max()) if len(sizes) else 0):
+        mask = sizes > k
+        chunk = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (sizes[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + k] = (chunk | more).astype(np.uint8)
+    return out
+
+
+def decode_varint(buffer: np.ndarray) -> np.ndarray:
+    """Decodifica un buffer varint completo a un arreglo int64"""
+    buffer = np.asarray(buffer, dtype=np.uint8)
+    if len(buffer) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(buffer < 0x80)
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # Posición de cada byte dentro de su valor
+    position = np.arange(len(buffer), dtype=np.int64) - np.repeat(starts, ends - starts + 1)
+    payload = (buffer & 0x7F).astype(np.uint64) << (7 * position).astype(np.uint64)
+    return np.add.reduceat(payload, starts).astype(np.int64)
+
+
+def delta_encode(docs: np.ndarray, boundaries: np.ndarray) -> np.ndarray:
+    """
+    Convierte listas de ordinales ascendentes en gaps.
+
+    Args:
+        docs: Ordinales de todas las listas concatenadas
+        boundaries: Offsets de inicio/fin de cada lista (len = listas + 1)
+
+    Returns:
+        Gaps; el primer valor de cada lista se guarda absoluto
+    """
+    docs = np.asarray(docs, dtype=np.int64)
+    gaps = np.empty_like(docs)
+    if len(docs):
+        gaps[0] = docs[0]
+        gaps[1:] = docs[1:] - docs[:-1]
+        starts = np.asarray(boundaries[:-1], dtype=np.int64)
+        starts = starts[starts < len(docs)]
+        gaps[starts] = docs[starts]
+    return gaps
+
+
+def delta_decode(gaps: np.ndarray) -> np.ndarray:
+    """Reconstruye los ordinales de una lista a partir de sus gaps"""
+    return np.cumsum(gaps, dtype=np.int64)
+
+
+def delta_decode_lists(gaps: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Reconstruye varias listas concatenadas a partir de sus gaps; cada lista
+    empieza con un valor absoluto.
+
+    Args:
+        gaps: Gaps de todas las listas concatenadas
+        lengths: Elementos de cada lista
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    cumulative = np.cumsum(gaps, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    nonempty = lengths > 0
+    # Suma acumulada reiniciada al inicio de cada lista
+    bases = np.zeros(len(lengths), dtype=np.int64)
+    bases[nonempty] = cumulative[starts[nonempty]] - gaps[starts[nonempty]]
+    return cumulative - np.repeat(bases, lengths)
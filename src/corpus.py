@@ -0,0 +1,295 @@
+"""
+Caché de ingesta: corpus pre-tokenizado en disco para reconstruir el índice
+sin volver a leer el dataset ni a ejecutar NLTK.
+
+La ingesta recorre el dataset una sola vez, preprocesa cada documento y
+guarda en un directorio arreglos .npy que se abren con mmap: los ordinales de
+término de todos los documentos concatenados (con offsets por documento), el
+vocabulario en orden de primera aparición, la tabla de doc_ids y los textos
+en un almacén comprimido por bloques (ver docstore). corpus.json se escribe
+al final con la huella del preprocesamiento (código de preprocesamiento,
+versión de NLTK y tokenizador), el dataset de origen y un SHA-256 de cada
+archivo, de modo que una caché incompleta, corrupta o generada con otro
+preprocesamiento se detecta antes de indexar desde ella.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import ir_datasets
+import nltk
+import numpy as np
+from .docstore import DocStore, DocStoreWriter
+from .preprocesamiento import preprocess_texts
+from .segment import StringTable, _ArrayStream, _StringStream, _load_array
+
+CORPUS_FORMAT_VERSION = 1
+CORPUS_META = "corpus.json"
+# Documentos preprocesados por lote (y por tarea de cada worker)
+INGEST_BATCH = 2000
+# Bytes leídos por llamada al calcular los checksums
+CHECKSUM_CHUNK = 1 << 22
+
+
+def preprocessing_fingerprint(fast_tokenizer: bool = False) -> str:
+    """Huella del preprocesamiento: código de preprocesamiento.py, versión de NLTK y tokenizador"""
+    digest = hashlib.sha256()
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "preprocesamiento.py"), 'rb') as f:
+        digest.update(f.read())
+    digest.update(f"nltk={nltk.__version__};fast={bool(fast_tokenizer)}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def file_checksum(path: str) -> str:
+    """SHA-256 de un archivo leído por bloques"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _corpus_files(corpus_path: str) -> List[str]:
+    """Archivos de datos de la caché (todo salvo corpus.json y temporales)"""
+    return sorted(name for name in os.listdir(corpus_path)
+                  if name != CORPUS_META and not name.endswith(".tmp"))
+
+
+class CorpusWriter:
+    """Escritor secuencial de la caché de corpus"""
+
+    def __init__(self, corpus_path: str):
+        os.makedirs(corpus_path, exist_ok=True)
+        # Sin corpus.json la caché no es válida hasta que close() termine
+        meta_path = os.path.join(corpus_path, CORPUS_META)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        self.corpus_path = corpus_path
+        self.tokens = _ArrayStream(corpus_path, "tokens", np.int32)
+        self.offsets = _ArrayStream(corpus_path, "tokens.off", np.int64)
+        self.offsets.append([0])
+        self.doc_ids = _StringStream(corpus_path, "docids")
+        self.vocab = _StringStream(corpus_path, "vocab")
+        self.texts = DocStoreWriter(corpus_path)
+        self.term_ids = {}  # término -> ordinal (orden de primera aparición)
+        self.doc_count = 0
+
+    def add(self, doc_ids: Sequence[str], texts: Sequence[str], tokens: Sequence[List[str]]) -> None:
+        """Añade un lote de documentos con sus tokens ya preprocesados"""
+        term_ids, new_terms, ids, lengths = self.term_ids, [], [], []
+        for doc_tokens in tokens:
+            for term in doc_tokens:
+                t = term_ids.get(term)
+                if t is None:
+                    t = term_ids[term] = len(term_ids)
+                    new_terms.append(term)
+                ids.append(t)
+            lengths.append(len(doc_tokens))
+        self.vocab.append(new_terms)
+        self.tokens.append(ids)
+        self.offsets.append(self.tokens.count - sum(lengths) + np.cumsum(lengths, dtype=np.int64))
+        self.doc_ids.append(doc_ids)
+        for text in texts:
+            self.texts.add(text)
+        self.doc_count += len(doc_ids)
+
+    def close(self, meta: Dict) -> Dict:
+        """Publica los arreglos y escribe corpus.json con sus checksums"""
+        for stream in (self.tokens, self.offsets, self.doc_ids, self.vocab):
+            stream.close()
+        self.texts.close()
+        meta = dict(meta, format_version=CORPUS_FORMAT_VERSION, doc_count=self.doc_count,
+                    token_count=self.tokens.count, term_count=len(self.term_ids),
+                    checksums={name: file_checksum(os.path.join(self.corpus_path, name))
+                               for name in _corpus_files(self.corpus_path)})
+        path = os.path.join(self.corpus_path, CORPUS_META)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(path + ".tmp", path)
+        return meta
+
+
+class Corpus:
+    """Caché de corpus pre-tokenizado abierta con mmap"""
+
+    def __init__(self, corpus_path: str):
+        path = os.path.join(corpus_path, CORPUS_META)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No se encontró la caché de corpus en {corpus_path}. "
+                                    f"Ejecuta primero python -m src.corpus")
+        with open(path) as f:
+            self.meta = json.load(f)
+        if self.meta.get('format_version') != CORPUS_FORMAT_VERSION:
+            raise ValueError(f"Versión de caché de corpus no soportada en {corpus_path}: "
+                             f"{self.meta.get('format_version')} (se esperaba {CORPUS_FORMAT_VERSION})")
+        self.corpus_path = corpus_path
+        self.tokens = _load_array(corpus_path, "tokens")
+        self.offsets = _load_array(corpus_path, "tokens.off")
+        self.doc_ids = StringTable(corpus_path, "docids")
+        self.vocab = StringTable(corpus_path, "vocab")
+        self.texts = DocStore(corpus_path)
+        self._terms = None  # vocabulario decodificado (ver terms)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def terms(self) -> np.ndarray:
+        """Vocabulario como arreglo de cadenas indexable por ordinal (se decodifica una vez)"""
+        if self._terms is None:
+            blob, offsets = self.vocab.blob.tobytes(), self.vocab.offsets.tolist()
+            self._terms = np.array([blob[offsets[t]:offsets[t + 1]].decode('utf-8')
+                                    for t in range(len(self.vocab))], dtype=object)
+        return self._terms
+
+    def term_ids(self, i: int) -> np.ndarray:
+        """Ordinales de término del documento i en orden de aparición"""
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def iter_documents(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[str, str, List[str]]]:
+        """(doc_id, texto, tokens) de los documentos [start, stop) en orden"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        terms = self.terms
+        for i in range(start, stop):
+            yield self.doc_ids[i], self.texts.get(i), terms[self.term_ids(i)].tolist()
+
+    def check(self, dataset_name: str, fast_tokenizer: bool = False, max_docs: Optional[int] = None) -> None:
+        """
+        Comprueba que la caché corresponde al dataset y al preprocesamiento
+        actuales y que cubre max_docs documentos; ValueError si está obsoleta.
+        """
+        problems = []
+        if self.meta['dataset'] != dataset_name:
+            problems.append(f"dataset {self.meta['dataset']} (se pidió {dataset_name})")
+        if self.meta['preprocessing'] != preprocessing_fingerprint(fast_tokenizer):
+            problems.append("el preprocesamiento (código, versión de NLTK o tokenizador) cambió")
+        if max_docs is not None and not self.meta['complete'] and max_docs > self.meta['max_docs']:
+            problems.append(f"solo cubre los primeros {self.meta['max_docs']} documentos (se pidieron {max_docs})")
+        if problems:
+            raise ValueError(f"Caché de corpus obsoleta en {self.corpus_path}: {'; '.join(problems)}. "
+                             f"Regenérala con python -m src.corpus")
+
+    def verify(self) -> None:
+        """Recalcula el SHA-256 de cada archivo; ValueError si alguno no coincide con corpus.json"""
+        expected = self.meta['checksums']
+        found = _corpus_files(self.corpus_path)
+        problems = [f"falta {name}" for name in sorted(set(expected) - set(found))]
+        problems += [f"{name} modificado" for name in found
+                     if name in expected and file_checksum(os.path.join(self.corpus_path, name)) != expected[name]]
+        problems += [f"{name} no registrado" for name in found if name not in expected]
+        if problems:
+            raise ValueError(f"Caché de corpus corrupta en {self.corpus_path}: {', '.join(problems)}")
+
+
+def open_corpus(corpus_path: str, dataset_name: str, fast_tokenizer: bool = False,
+                max_docs: Optional[int] = None) -> Corpus:
+    """Abre la caché y comprueba que está al día y que sus checksums coinciden"""
+    corpus = Corpus(corpus_path)
+    corpus.check(dataset_name, fast_tokenizer, max_docs)
+    corpus.verify()
+    return corpus
+
+
+def _iter_batches(docs_iter, max_docs: int, batch_size: int):
+    """Lotes de (doc_ids, textos) hasta max_docs documentos leídos"""
+    doc_ids, texts = [], []
+    for read, doc in enumerate(docs_iter):
+        if read >= max_docs:
+            break
+        doc_ids.append(doc.doc_id)
+        texts.append(doc.text)
+        if len(doc_ids) >= batch_size:
+            yield doc_ids, texts
+            doc_ids, texts = [], []
+    if doc_ids:
+        yield doc_ids, texts
+
+
+def ingest_corpus(dataset_name: str = "car/v1.5/test200", corpus_path: str = "data/corpus",
+                  max_docs: int = 3500000, fast_tokenizer: bool = False, workers: int = 1,
+                  batch_size: int = INGEST_BATCH) -> Dict:
+    """
+    Lee el dataset una vez, preprocesa cada documento y escribe la caché de corpus.
+
+    Args:
+        dataset_name: Nombre del dataset
+        corpus_path: Directorio de la caché
+        max_docs: Documentos leídos del dataset como máximo
+        fast_tokenizer: Tokeniza con expresiones regulares en lugar de word_tokenize
+        workers: Procesos de preprocesamiento (los lotes se escriben en orden)
+
+    Returns:
+        Metadatos escritos en corpus.json
+    """
+    print(f"Cargando dataset {dataset_name}...")
+    dataset = ir_datasets.load(dataset_name)
+    start = time.perf_counter()
+    writer = CorpusWriter(corpus_path)
+    batches = _iter_batches(dataset.docs_iter(), max_docs, batch_size)
+
+    def write(doc_ids, texts, tokens):
+        writer.add(doc_ids, texts, tokens)
+        if writer.doc_count % (10 * batch_size) < len(doc_ids):
+            print(f"Ingeridos {writer.doc_count} documentos...")
+
+    if workers <= 1:
+        for doc_ids, texts in batches:
+            write(doc_ids, texts, preprocess_texts(texts, fast_tokenizer))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Ventana acotada de lotes en vuelo, escritos en el orden del dataset
+            pending = deque()
+            for doc_ids, texts in batches:
+                pending.append((doc_ids, texts, pool.submit(preprocess_texts, texts, fast_tokenizer)))
+                if len(pending) >= 2 * workers:
+                    doc_ids, texts, future = pending.popleft()
+                    write(doc_ids, texts, future.result())
+            while pending:
+                doc_ids, texts, future = pending.popleft()
+                write(doc_ids, texts, future.result())
+
+    meta = writer.close({
+        'dataset': dataset_name,
+        'max_docs': max_docs,
+        # Con menos documentos que max_docs se leyó el dataset entero
+        'complete': writer.doc_count < max_docs,
+        'fast_tokenizer': fast_tokenizer,
+        'preprocessing': preprocessing_fingerprint(fast_tokenizer),
+    })
+    print(f"Caché de corpus escrita en {corpus_path}: {meta['doc_count']} documentos, "
+          f"{meta['token_count']} tokens, {meta['term_count']} términos en {time.perf_counter() - start:.1f}s")
+    return meta
+
+
+def main(argv=None):
+    """
+    Ingesta con `python -m src.corpus [--output data/corpus]` y comprobación de
+    una caché existente con `python -m src.corpus --verify`
+    """
+    parser = argparse.ArgumentParser(description="Caché de corpus pre-tokenizado")
+    parser.add_argument("--dataset", default="car/v1.5/test200", help="dataset de ir_datasets")
+    parser.add_argument("--output", default="data/corpus", help="directorio de la caché")
+    parser.add_argument("--max-docs", type=int, default=3500000, help="número máximo de documentos leídos")
+    parser.add_argument("--workers", type=int, default=1, help="procesos de preprocesamiento")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH, help="documentos por lote")
+    parser.add_argument("--fast-tokenizer", action="store_true",
+                        help="tokenizador por expresiones regulares (verificar con python -m src.preprocesamiento)")
+    parser.add_argument("--verify", action="store_true",
+                        help="comprueba los checksums y la huella del preprocesamiento de la caché existente")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        corpus = Corpus(args.output)
+        corpus.verify()
+        corpus.check(args.dataset, corpus.meta['fast_tokenizer'])
+        print(f"Caché de corpus válida: {len(corpus)} documentos, {corpus.meta['token_count']} tokens")
+        return
+    ingest_corpus(args.dataset, args.output, args.max_docs, args.fast_tokenizer, args.workers, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Almacén de documentos comprimido con acceso por ordinal.
+
+Los textos se agrupan en bloques comprimidos con zlib dentro de un blob que se
+abre con mmap; una tabla de offsets localiza el bloque y la posición de cada
+documento, de modo que solo se descomprime lo que realmente se muestra.
+"""
+import mmap
+import os
+import zlib
+from array import array
+import numpy as np
+from .cache import LRUCache
+
+# Tamaño (sin comprimir) a partir del cual se cierra un bloque
+DOCSTORE_BLOCK_BYTES = 1 << 16
+DOCSTORE_COMPRESSION = 6
+# Bloques descomprimidos que se mantienen en memoria
+DOCSTORE_CACHE_BLOCKS = 64
+# Bytes del blob comprimido que se copian de una vez al concatenar almacenes
+DOCSTORE_COPY_BYTES = 1 << 24
+
+
+def _path(store_path: str, name: str) -> str:
+    return os.path.join(store_path, f"docstore.{name}")
+
+
+class DocStoreWriter:
+    """Escritor secuencial del almacén de documentos"""
+
+    def __init__(self, store_path: str):
+        os.makedirs(store_path, exist_ok=True)
+        self.store_path = store_path
+        self.blob = open(_path(store_path, "blob.tmp"), 'wb')
+        self.block_offsets = array('q', [0])  # offset en bytes de cada bloque comprimido
+        self.block_first = array('q', [0])  # primer ordinal de cada bloque
+        self.doc_positions = array('i')  # inicio de cada documento dentro de su bloque
+        self.doc_count = 0
+        self._buffer = []
+        self._buffer_size = 0
+
+    def add(self, text: str) -> None:
+        """Añade el texto del siguiente ordinal"""
+        data = text.encode('utf-8')
+        self.doc_positions.append(self._buffer_size)
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        self.doc_count += 1
+        if self._buffer_size >= DOCSTORE_BLOCK_BYTES:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        compressed = zlib.compress(b''.join(self._buffer), DOCSTORE_COMPRESSION)
+        self.blob.write(compressed)
+        self.block_offsets.append(self.block_offsets[-1] + len(compressed))
+        self.block_first.append(self.doc_count)
+        self._buffer, self._buffer_size = [], 0
+
+    def append_store(self, store: "DocStore") -> None:
+        """
+        Copia otro almacén a continuación sin recomprimir sus bloques; el blob
+        se copia por tramos de DOCSTORE_COPY_BYTES, sin cargarlo entero en memoria.
+        """
+        self._flush()
+        base_bytes, base_docs = self.block_offsets[-1], self.doc_count
+        for start in range(0, len(store.blob), DOCSTORE_COPY_BYTES):
+            self.blob.write(store.blob[start:start + DOCSTORE_COPY_BYTES])
+        self.block_offsets.frombytes((np.asarray(store.block_offsets[1:], dtype=np.int64) + base_bytes).tobytes())
+        self.block_first.frombytes((np.asarray(store.block_first[1:], dtype=np.int64) + base_docs).tobytes())
+        self.doc_positions.frombytes(np.asarray(store.doc_positions, dtype=np.int32).tobytes())
+        self.doc_count += len(store)
+
+    def close(self) -> None:
+        self._flush()
+        self.blob.close()
+        os.replace(_path(self.store_path, "blob.tmp"), _path(self.store_path, "blob"))
+        np.save(_path(self.store_path, "blocks.npy"), np.frombuffer(self.block_offsets, dtype=np.int64))
+        np.save(_path(self.store_path, "first.npy"), np.frombuffer(self.block_first, dtype=np.int64))
+        np.save(_path(self.store_path, "pos.npy"),
+                np.frombuffer(self.doc_positions, dtype=np.int32) if self.doc_positions
+                else np.zeros(0, dtype=np.int32))
+
+
+class DocStore:
+    """Lector del almacén de documentos abierto con mmap"""
+
+    def __init__(self, store_path: str):
+        with open(_path(store_path, "blob"), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.block_offsets = np.load(_path(store_path, "blocks.npy"), mmap_mode='r')
+        self.block_first = np.load(_path(store_path, "first.npy"), mmap_mode='r')
+        self.doc_positions = np.load(_path(store_path, "pos.npy"), mmap_mode='r')
+        self._blocks = LRUCache(DOCSTORE_CACHE_BLOCKS)
+
+    def __len__(self) -> int:
+        return len(self.doc_positions)
+
+    def _locate(self, ordinal: int):
+        """Bloque del documento y su rango [inicio, fin) dentro del bloque"""
+        block = int(np.searchsorted(self.block_first, ordinal, side='right')) - 1
+        start = int(self.doc_positions[ordinal])
+        last = ordinal + 1 >= int(self.block_first[block + 1])
+        end = None if last else int(self.doc_positions[ordinal + 1])
+        return block, start, end
+
+    def _compressed(self, block: int) -> bytes:
+        return self.blob[int(self.block_offsets[block]):int(self.block_offsets[block + 1])]
+
+    def _block(self, block: int) -> bytes:
+        """Bloque descomprimido (con caché de los usados recientemente)"""
+        data = self._blocks.get(block)
+        if data is None:
+            data = zlib.decompress(self._compressed(block))
+            self._blocks.put(block, data)
+        return data
+
+    def get(self, ordinal: int) -> str:
+        """Texto completo del documento"""
+        block, start, end = self._locate(ordinal)
+        return self._block(block)[start:end].decode('utf-8')
+
+    def snippet(self, ordinal: int, max_chars: int) -> str:
+        """Primeros max_chars caracteres; descomprime el bloque solo hasta donde hace falta"""
+        block, start, end = self._locate(ordinal)
+        data = self._blocks.get(block)
+        limit = start + 4 * max_chars  # un carácter UTF-8 ocupa como máximo 4 bytes
+        if end is not None:
+            limit = min(limit, end)
+        if data is None:
+            data = zlib.decompressobj().decompress(self._compressed(block), limit)
+        return data[start:limit].decode('utf-8', errors='ignore')[:max_chars]
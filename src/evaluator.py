@@ -1,18 +1,147 @@
 """
 Sistema de evaluación usando métricas estándar de IR
 """
+import argparse
+import time
 import ir_datasets
-from typing import Dict, List, Tuple
-from .retrieval import RetrievalSystem
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+from .impact import PRUNE_RATIOS
+from .instrumentation import PROFILERS, profiled
+from .rerank import RERANKERS
+from .retrieval import BATCH_QUERIES, RetrievalSystem, open_retrieval_system
+from .sharding import ShardedRetrievalSystem
+from .sweep import B_GRID, K1_GRID, sweep_bm25
+from .trec_eval import CUTOFFS, compare, evaluate_run, paired_t_test, summarize, write_qrels, write_run
 from .utils import save_results
 
+# Nombre de cada método en los resultados por pantalla
+METHOD_LABELS = {'tfidf': 'TF-IDF', 'bm25': 'BM25', 'rm3': 'BM25+RM3'}
+# Candidatos de la primera etapa del método en dos etapas
+RERANK_CANDIDATES = 1000
+# Documentos recuperados y evaluados por consulta
+EVAL_DEPTH = max(CUTOFFS)
+
+# Sistema de recuperación de cada proceso worker (abre el mismo índice con mmap)
+_worker_system = None
+
+def _init_worker(index_path: str, instrument: bool = False):
+    """Inicializa el worker abriendo el índice una sola vez"""
+    global _worker_system
+    _worker_system = open_retrieval_system(index_path, instrument=instrument)
+
+def _run_query(query: Tuple[str, str], retrieval_system: RetrievalSystem = None,
+               reranker: Optional[str] = None, rm3: bool = False):
+    """
+    Ejecuta TF-IDF y BM25 (y, con `reranker`, la búsqueda en dos etapas; con
+    `rm3`, BM25 con expansión RM3) para una consulta preprocesándola una sola vez
+    """
+    retrieval_system = retrieval_system or _worker_system
+    query_id, query_text = query
+    start = time.perf_counter()
+    retrieval_system.query_terms(query_text)  # queda en caché para todos los modelos
+    preprocessed = time.perf_counter()
+    runs = {'tfidf': retrieval_system.tfidf_search(query_text, k=EVAL_DEPTH)}
+    tfidf_done = time.perf_counter()
+    runs['bm25'] = retrieval_system.bm25_search(query_text, k=EVAL_DEPTH)
+    bm25_done = time.perf_counter()
+    timing = {
+        'preprocess': preprocessed - start,
+        'tfidf': tfidf_done - preprocessed,
+        'bm25': bm25_done - tfidf_done,
+    }
+    _run_extra_methods(retrieval_system, query_text, runs, timing, reranker, rm3)
+    # Métricas acumuladas por esta consulta (None sin instrumentación)
+    metrics = retrieval_system.metrics.drain() if retrieval_system.metrics.enabled else None
+    return query_id, runs, timing, metrics
+
+def _run_extra_methods(retrieval_system: RetrievalSystem, query_text: str, runs: Dict, timing: Dict,
+                       reranker: Optional[str], rm3: bool) -> None:
+    """Añade a `runs` y `timing` los métodos opcionales (dos etapas y RM3)"""
+    if reranker is not None:
+        rerank_start = time.perf_counter()
+        runs['rerank'] = retrieval_system.rerank_search(query_text, k=EVAL_DEPTH, candidates=RERANK_CANDIDATES,
+                                                        reranker=reranker)
+        timing['rerank'] = time.perf_counter() - rerank_start
+    if rm3:
+        rm3_start = time.perf_counter()
+        runs['rm3'] = retrieval_system.rm3_search(query_text, k=EVAL_DEPTH)
+        timing['rm3'] = time.perf_counter() - rm3_start
+
+def _run_batch(queries: List[Tuple[str, str]], retrieval_system: RetrievalSystem = None,
+               reranker: Optional[str] = None, rm3: bool = False) -> List[Tuple]:
+    """
+    Como _run_query para una lista de consultas, con TF-IDF y BM25 de todas
+    ellas en dos llamadas a search_batch (postings decodificadas una vez por
+    lote). Los tiempos por consulta son los del lote repartidos entre sus consultas.
+    """
+    retrieval_system = retrieval_system or _worker_system
+    texts = [text for _, text in queries]
+    start = time.perf_counter()
+    for text in texts:
+        retrieval_system.query_terms(text)
+    preprocessed = time.perf_counter()
+    tfidf_runs = retrieval_system.search_batch(texts, "tfidf", k=EVAL_DEPTH)
+    tfidf_done = time.perf_counter()
+    bm25_runs = retrieval_system.search_batch(texts, "bm25", k=EVAL_DEPTH)
+    bm25_done = time.perf_counter()
+    count = max(1, len(queries))
+    shared_timing = {
+        'preprocess': (preprocessed - start) / count,
+        'tfidf': (tfidf_done - preprocessed) / count,
+        'bm25': (bm25_done - tfidf_done) / count,
+    }
+    results = []
+    for (query_id, query_text), tfidf, bm25 in zip(queries, tfidf_runs, bm25_runs):
+        runs, timing = {'tfidf': tfidf, 'bm25': bm25}, dict(shared_timing)
+        _run_extra_methods(retrieval_system, query_text, runs, timing, reranker, rm3)
+        results.append((query_id, runs, timing, None))
+    # Las métricas del lote viajan con su primera consulta
+    if results and retrieval_system.metrics.enabled:
+        query_id, runs, timing, _ = results[0]
+        results[0] = (query_id, runs, timing, retrieval_system.metrics.drain())
+    return results
+
 class IREvaluator:
     """Evaluador del sistema de IR usando métricas estándar"""
 
-    def __init__(self, dataset_name: str = "car/v1.5/test200"):
+    def __init__(self, dataset_name: str = "car/v1.5/test200", index_path: str = "data/index",
+                 workers: int = 1, instrument: bool = False, reranker: Optional[str] = None,
+                 rm3: bool = False, batch: bool = False):
+        """
+        Args:
+            dataset_name: Nombre del dataset
+            index_path: Ruta al directorio del índice (o del índice particionado,
+                que se consulta con ShardedRetrievalSystem)
+            workers: Procesos que ejecutan las consultas (1 = en serie)
+            instrument: Acumula tiempos por etapa y contadores (también los de los workers)
+            reranker: Evalúa también la búsqueda en dos etapas (BM25 + "tfidf",
+                "rrf" o "combsum") como método "rerank"
+            rm3: Evalúa también BM25 con expansión RM3 como método "rm3"
+                (requiere un índice con índice directo)
+            batch: Ejecuta TF-IDF y BM25 por lotes de consultas con search_batch
+        """
         self.dataset_name = dataset_name
+        self.index_path = index_path
+        self.workers = workers
+        self.instrument = instrument
+        self.reranker = reranker
+        self.rm3 = rm3
+        self.batch = batch
+        self.methods = ['tfidf', 'bm25'] + (['rerank'] if reranker else []) + (['rm3'] if rm3 else [])
+        # Rankings de la última evaluación por método ({query_id: [(doc_id, score)]}), exportables como runs TREC
+        self.runs = {method: {} for method in self.methods}
         self.dataset = ir_datasets.load(dataset_name)
-        self.retrieval_system = RetrievalSystem()
+        self.retrieval_system = open_retrieval_system(index_path, instrument=instrument)
+        if reranker or rm3:
+            try:
+                self._require_single_index("--rerank y --rm3")
+            except ValueError:
+                self.retrieval_system.close()
+                raise
+        self.metrics = self.retrieval_system.metrics
 
         # Cargar consultas y qrels
         self.queries = {q.query_id: q.text for q in self.dataset.queries_iter()}
@@ -21,6 +150,12 @@ class IREvaluator:
         print(f"Cargadas {len(self.queries)} consultas")
         print(f"Cargados {len(self.qrels)} grupos de relevancia")
 
+    def _require_single_index(self, feature: str) -> None:
+        """Falla si el índice es particionado: el coordinador solo ofrece TF-IDF y BM25"""
+        if isinstance(self.retrieval_system, ShardedRetrievalSystem):
+            raise ValueError(f"{feature} no se admite con un índice particionado "
+                             f"({self.index_path}): usa el índice sin particionar")
+
     def _load_qrels(self) -> Dict[str, Dict[str, int]]:
         """Carga los juicios de relevancia del dataset"""
         qrels = {}
@@ -35,121 +170,197 @@ class IREvaluator:
         print("\nIniciando evaluación completa del sistema...")
         print("="*60)
 
-        results = {
-            'tfidf': {'precision': {}, 'recall': {}, 'map': 0},
-            'bm25': {'precision': {}, 'recall': {}, 'map': 0},
-            'summary': {}
+        results = {method: {'precision': {}, 'recall': {}, 'ndcg': {}, 'map': 0} for method in self.methods}
+
+        # Etapa 1: recuperación (en serie o repartida en un pool de procesos)
+        queries = [(query_id, text) for query_id, text in self.queries.items() if query_id in self.qrels]
+        start = time.perf_counter()
+        runs = self._run_queries(queries)
+        retrieval_seconds = time.perf_counter() - start
+
+        # Etapa 2: métricas de todas las consultas a la vez, en el orden original
+        start = time.perf_counter()
+        stage_seconds = defaultdict(float)
+        self.runs = {method: {} for method in self.methods}
+        for query_id, method_runs, timing, metrics in runs:
+            for stage, seconds in timing.items():
+                stage_seconds[stage] += seconds
+            if metrics is not None:
+                self.metrics.merge(metrics)
+            for method in self.methods:
+                self.runs[method][query_id] = method_runs[method]
+        query_ids = [query_id for query_id, _ in queries]
+        print(f"Evaluando {len(query_ids)} consultas...")
+
+        measures = {method: evaluate_run(self.runs[method], self.qrels, query_ids, depth=EVAL_DEPTH)[1]
+                    for method in self.methods}
+        for method in self.methods:
+            results[method]['precision'] = dict(zip(query_ids, measures[method]['P'].tolist()))
+            results[method]['recall'] = dict(zip(query_ids, measures[method]['recall'].tolist()))
+            results[method]['ndcg'] = dict(zip(query_ids, measures[method]['ndcg_cut'].tolist()))
+            results[method]['map'] = float(measures[method]['map'].mean()) if query_ids else 0
+
+        # Calcular métricas promedio y significancia de BM25 frente a TF-IDF
+        results['summary'] = self._calculate_summary(measures)
+        results['significance'] = compare(measures['bm25'], measures['tfidf'])
+        metrics_seconds = time.perf_counter() - start
+        evaluated_queries = len(query_ids)
+        results['timing'] = {
+            'workers': self.workers,
+            'queries': evaluated_queries,
+            'retrieval_seconds': retrieval_seconds,
+            'metrics_seconds': metrics_seconds,
+            'total_seconds': retrieval_seconds + metrics_seconds,
+            # Suma del tiempo de cada etapa en todas las consultas (todos los workers)
+            'stage_seconds': dict(stage_seconds),
         }
-
-        tfidf_aps = []  # Average Precisions para MAP
-        bm25_aps = []
-
-        evaluated_queries = 0
-
-        for query_id, query_text in self.queries.items():
-            if query_id not in self.qrels:
-                continue  # Skip queries sin qrels
-
-            print(f"Evaluando consulta {evaluated_queries + 1}/{len(self.qrels)}: {query_id}")
-
-            # Obtener resultados
-            tfidf_results = self.retrieval_system.tfidf_search(query_text, k=100)
-            bm25_results = self.retrieval_system.bm25_search(query_text, k=100)
-
-            # Evaluar TF-IDF
-            tfidf_metrics = self._evaluate_query(tfidf_results, self.qrels[query_id])
-            results['tfidf']['precision'][query_id] = tfidf_metrics['precision']
-            results['tfidf']['recall'][query_id] = tfidf_metrics['recall']
-            tfidf_aps.append(tfidf_metrics['average_precision'])
-
-            # Evaluar BM25
-            bm25_metrics = self._evaluate_query(bm25_results, self.qrels[query_id])
-            results['bm25']['precision'][query_id] = bm25_metrics['precision']
-            results['bm25']['recall'][query_id] = bm25_metrics['recall']
-            bm25_aps.append(bm25_metrics['average_precision'])
-
-            evaluated_queries += 1
-
-        # Calcular MAP
-        results['tfidf']['map'] = sum(tfidf_aps) / len(tfidf_aps) if tfidf_aps else 0
-        results['bm25']['map'] = sum(bm25_aps) / len(bm25_aps) if bm25_aps else 0
-
-        # Calcular métricas promedio
-        results['summary'] = self._calculate_summary(results, evaluated_queries)
+        if self.metrics.enabled:
+            self.metrics.add_time('evaluate.retrieval', retrieval_seconds)
+            self.metrics.add_time('evaluate.metrics', metrics_seconds)
+            results['instrumentation'] = self.metrics.summary()
 
         self._display_results(results)
         return results
 
-    def _evaluate_query(self, retrieved_docs: List[Tuple[str, float]],
-                       relevant_docs: Dict[str, int]) -> Dict:
-        """Evalúa una consulta individual"""
-        if not retrieved_docs:
-            return {'precision': [0]*10, 'recall': [0]*10, 'average_precision': 0}
-
-        # Documentos relevantes (relevance > 0)
-        relevant_set = set(doc_id for doc_id, rel in relevant_docs.items() if rel > 0)
-
-        if not relevant_set:
-            return {'precision': [0]*10, 'recall': [0]*10, 'average_precision': 0}
-
-        # Calcular precision y recall en diferentes puntos de corte
-        precisions = []
-        recalls = []
-        relevant_retrieved = 0
-
-        # Para calcular Average Precision
-        precision_at_relevant = []
-
-        for i, (doc_id, score) in enumerate(retrieved_docs[:100], 1):
-            if doc_id in relevant_set:
-                relevant_retrieved += 1
-                precision_at_relevant.append(relevant_retrieved / i)
-
-            precision = relevant_retrieved / i
-            recall = relevant_retrieved / len(relevant_set)
-
-            # Guardar métricas en puntos específicos (cada 10 docs)
-            if i % 10 == 0:
-                precisions.append(precision)
-                recalls.append(recall)
-
-        # Rellenar con ceros si la lista es más corta que 10
-        while len(precisions) < 10:
-            precisions.append(0)
-        while len(recalls) < 10:
-            recalls.append(0)
-
-        # Calcular Average Precision
-        average_precision = sum(precision_at_relevant) / len(relevant_set) if precision_at_relevant else 0
+    def _run_queries(self, queries: List[Tuple[str, str]]) -> List[Tuple]:
+        """Ejecuta ambos modelos para cada consulta; el resultado respeta el orden de entrada"""
+        if self.workers <= 1:
+            if self.batch:
+                return _run_batch(queries, self.retrieval_system, self.reranker, self.rm3)
+            return [_run_query(query, self.retrieval_system, self.reranker, self.rm3) for query in queries]
+        print(f"Ejecutando {len(queries)} consultas con {self.workers} workers...")
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.index_path, self.instrument)) as pool:
+            if self.batch:
+                # Cada worker recibe lotes completos de consultas (al menos un lote por worker)
+                size = max(1, min(BATCH_QUERIES, -(-len(queries) // self.workers)))
+                batches = [queries[start:start + size] for start in range(0, len(queries), size)]
+                run = partial(_run_batch, reranker=self.reranker, rm3=self.rm3)
+                return [result for results in pool.map(run, batches) for result in results]
+            chunksize = max(1, len(queries) // (4 * self.workers))
+            run = partial(_run_query, reranker=self.reranker, rm3=self.rm3)
+            return list(pool.map(run, queries, chunksize=chunksize))
+
+    def sweep_bm25(self, k1_values=K1_GRID, b_values=B_GRID) -> Dict:
+        """
+        Evalúa BM25 en toda la rejilla k1 x b decodificando las postings de cada
+        consulta una sola vez (ver sweep.sweep_bm25)
+
+        Returns:
+            Diccionario con los puntos ordenados por MAP y el tiempo empleado
+        """
+        self._require_single_index("El barrido de BM25")
+        system = self.retrieval_system
+        queries = [(system.query_terms(text), self.qrels[query_id])
+                   for query_id, text in self.queries.items() if query_id in self.qrels]
+        print(f"\nBarrido BM25: {len(k1_values)} x {len(b_values)} puntos sobre {len(queries)} consultas...")
+        start = time.perf_counter()
+        with self.metrics.timer('sweep'):
+            points = sweep_bm25(system.segment, queries, system.doc_count, system.avg_doc_length,
+                                k1_values, b_values)
+        seconds = time.perf_counter() - start
+        results = {'dataset': self.dataset_name, 'queries': len(queries), 'seconds': seconds, 'points': points}
+        self._display_sweep(results)
+        return results
 
-        return {
-            'precision': precisions,
-            'recall': recalls,
-            'average_precision': average_precision
-        }
+    def evaluate_pruning(self, ratios=PRUNE_RATIOS, budget: Optional[float] = None) -> Dict:
+        """
+        Pérdida de efectividad de la búsqueda score-at-a-time sobre el tier por
+        impacto con cada poda estática frente a BM25 exhaustivo sobre el índice
+        completo, para elegir la poda a partir de los datos. Cada poda se
+        obtiene truncando las listas del tier guardado, así que basta con
+        construirlo una vez con la menor poda (p. ej. --impact-tier 1.0).
+
+        Args:
+            ratios: Fracciones de postings conservadas por término (las mayores
+                que la poda del tier guardado se omiten)
+            budget: Presupuesto de postings de impact_search (None = sin
+                terminación temprana, solo el efecto de la poda)
+
+        Returns:
+            Diccionario con el MAP de BM25 y, por poda, MAP, pérdida absoluta y
+            relativa, p-valor del test t pareado, postings por consulta y latencia
+        """
+        self._require_single_index("La evaluación de la poda")
+        system = self.retrieval_system
+        system._require_impacts()
+        stored = system.impact.prune_ratio
+        skipped = [ratio for ratio in ratios if ratio > stored]
+        ratios = [ratio for ratio in ratios if ratio <= stored]
+        if skipped:
+            print(f"⚠️  El tier guarda una poda de {stored:g}: se omiten {', '.join(f'{r:g}' for r in skipped)}")
+        queries = [(query_id, text) for query_id, text in self.queries.items() if query_id in self.qrels]
+        query_ids = [query_id for query_id, _ in queries]
+        print(f"\nPoda estática: {len(ratios)} podas sobre {len(queries)} consultas...")
+
+        bm25_run = {query_id: system.bm25_search(text, k=EVAL_DEPTH) for query_id, text in queries}
+        full = evaluate_run(bm25_run, self.qrels, query_ids, depth=EVAL_DEPTH)[1]
+        full_map = float(full['map'].mean()) if query_ids else 0.0
+        points = []
+        for ratio in ratios:
+            run, postings = {}, 0
+            start = time.perf_counter()
+            with self.metrics.timer('pruning'):
+                for query_id, text in queries:
+                    run[query_id] = system._impact_search(system.query_terms(text), EVAL_DEPTH, budget, ratio)
+                    postings += system.impact.postings_scored
+            seconds = time.perf_counter() - start
+            measures = evaluate_run(run, self.qrels, query_ids, depth=EVAL_DEPTH)[1]
+            averages = summarize(measures)
+            count = max(1, len(queries))
+            points.append({
+                'prune_ratio': ratio,
+                'map': averages['map'],
+                'map_loss': full_map - averages['map'],
+                'relative_loss': (full_map - averages['map']) / full_map if full_map else 0.0,
+                'p_t_test': paired_t_test(measures['map'], full['map'])[1],
+                'avg_ndcg': averages['ndcg_cut'],
+                'avg_postings': postings / count,
+                'avg_latency_ms': 1000 * seconds / count,
+            })
+        results = {'dataset': self.dataset_name, 'queries': len(queries), 'budget': budget,
+                   'bm25_map': full_map, 'points': points}
+        self._display_pruning(results)
+        return results
 
-    def _calculate_summary(self, results: Dict, num_queries: int) -> Dict:
-        """Calcula métricas resumidas"""
+    def _display_pruning(self, results: Dict):
+        """Tabla de la pérdida de MAP por poda frente a BM25 sobre el índice completo"""
+        print("\n" + "="*60)
+        print(f"PODA ESTÁTICA DEL TIER POR IMPACTO (MAP BM25 completo: {results['bm25_map']:.4f})")
+        print("="*60)
+        print(f"  {'poda':>5} {'MAP':>8} {'pérdida':>8} {'rel.':>7} {'p(t)':>7} {'postings':>10} {'ms':>7}")
+        for point in results['points']:
+            print(f"  {point['prune_ratio']:>5.2f} {point['map']:>8.4f} {point['map_loss']:>+8.4f} "
+                  f"{point['relative_loss']:>7.1%} {point['p_t_test']:>7.4f} "
+                  f"{point['avg_postings']:>10.0f} {point['avg_latency_ms']:>7.2f}")
+
+    def _display_sweep(self, results: Dict, top: int = 20):
+        """Tabla de los mejores puntos del barrido por MAP"""
+        print("\n" + "="*60)
+        print("BARRIDO DE PARÁMETROS BM25 (ordenado por MAP)")
+        print("="*60)
+        print(f"  {'k1':>5} {'b':>5} {'MAP':>8} {'P@10':>8} {'P@20':>8} {'R@100':>8}")
+        for point in results['points'][:top]:
+            print(f"  {point['k1']:>5.2f} {point['b']:>5.2f} {point['map']:>8.4f} "
+                  f"{point['avg_precision'][0]:>8.4f} {point['avg_precision'][1]:>8.4f} "
+                  f"{point['avg_recall'][-1]:>8.4f}")
+        if len(results['points']) > top:
+            print(f"  ... ({len(results['points']) - top} puntos más en el JSON)")
+        print(f"\n⏱️  {len(results['points'])} puntos en {results['seconds']:.2f}s")
+
+    def _calculate_summary(self, measures: Dict) -> Dict:
+        """Promedios por método de las métricas por consulta (P, R y nDCG en cada corte)"""
         summary = {}
-
-        for method in ['tfidf', 'bm25']:
-            # Promedio de precision y recall en diferentes cortes
-            avg_precisions = []
-            avg_recalls = []
-
-            for k in range(10):  # Para cada punto de corte (10, 20, ..., 100)
-                precisions_at_k = [precs[k] for precs in results[method]['precision'].values()]
-                recalls_at_k = [recs[k] for recs in results[method]['recall'].values()]
-
-                avg_precisions.append(sum(precisions_at_k) / len(precisions_at_k) if precisions_at_k else 0)
-                avg_recalls.append(sum(recalls_at_k) / len(recalls_at_k) if recalls_at_k else 0)
-
+        for method in self.methods:
+            averages = summarize(measures[method])
             summary[method] = {
-                'avg_precision': avg_precisions,
-                'avg_recall': avg_recalls,
-                'map': results[method]['map']
+                'avg_precision': averages['P'],
+                'avg_recall': averages['recall'],
+                'avg_ndcg': averages['ndcg_cut'],
+                'map': averages['map'],
+                'r_prec': averages['Rprec'],
+                'mrr': averages['recip_rank'],
             }
-
         return summary
 
     def _display_results(self, results: Dict):
@@ -164,32 +375,74 @@ class IREvaluator:
         print("\n📊 MÉTRICAS PROMEDIO:")
         print("-" * 50)
 
+        labels = {method: self._label(method) for method in self.methods}
+        width = max(len(label) for label in labels.values()) + 1
+
         # MAP
         print(f"Mean Average Precision (MAP):")
-        print(f"  TF-IDF: {results['tfidf']['map']:.4f}")
-        print(f"  BM25:   {results['bm25']['map']:.4f}")
+        for method in self.methods:
+            print(f"  {labels[method] + ':':<{width}} {results[method]['map']:.4f}")
 
         # Precision y Recall promedio en diferentes cortes
         print(f"\nPrecision promedio:")
         for i, k in enumerate(range(10, 101, 10)):
-            tfidf_p = results['summary']['tfidf']['avg_precision'][i]
-            bm25_p = results['summary']['bm25']['avg_precision'][i]
-            print(f"  P@{k:3d}: TF-IDF={tfidf_p:.4f}, BM25={bm25_p:.4f}")
+            values = ", ".join(f"{labels[method]}={results['summary'][method]['avg_precision'][i]:.4f}"
+                               for method in self.methods)
+            print(f"  P@{k:3d}: {values}")
 
         print(f"\nRecall promedio:")
         for i, k in enumerate(range(10, 101, 10)):
-            tfidf_r = results['summary']['tfidf']['avg_recall'][i]
-            bm25_r = results['summary']['bm25']['avg_recall'][i]
-            print(f"  R@{k:3d}: TF-IDF={tfidf_r:.4f}, BM25={bm25_r:.4f}")
-
-        # Comparación de métodos
+            values = ", ".join(f"{labels[method]}={results['summary'][method]['avg_recall'][i]:.4f}"
+                               for method in self.methods)
+            print(f"  R@{k:3d}: {values}")
+
+        print(f"\nnDCG promedio:")
+        for i, k in enumerate(CUTOFFS):
+            if k in (10, 20, 50, 100):
+                values = ", ".join(f"{labels[method]}={results['summary'][method]['avg_ndcg'][i]:.4f}"
+                                   for method in self.methods)
+                print(f"  nDCG@{k:3d}: {values}")
+
+        print(f"\nR-Precision y MRR:")
+        for method in self.methods:
+            summary = results['summary'][method]
+            print(f"  {labels[method] + ':':<{width}} R-Prec={summary['r_prec']:.4f}, MRR={summary['mrr']:.4f}")
+
+        if 'significance' in results:
+            print(f"\n📐 SIGNIFICANCIA ({labels['bm25']} vs {labels['tfidf']}, tests pareados):")
+            for measure, test in results['significance'].items():
+                marker = "*" if test['p_t_test'] < 0.05 and test['p_randomization'] < 0.05 else " "
+                print(f"  {measure:<12} Δ={test['difference']:+.4f}  t={test['t']:7.3f}  "
+                      f"p(t)={test['p_t_test']:.4f}  p(aleat.)={test['p_randomization']:.4f} {marker}")
+
+        # Comparación de métodos (a igual MAP gana el primero, como antes TF-IDF frente a BM25)
         print(f"\n🏆 COMPARACIÓN:")
         print("-" * 30)
-        better_method = "BM25" if results['bm25']['map'] > results['tfidf']['map'] else "TF-IDF"
-        print(f"Mejor método por MAP: {better_method}")
+        better_method = max(self.methods, key=lambda method: (results[method]['map'], -self.methods.index(method)))
+        print(f"Mejor método por MAP: {labels[better_method]}")
+
+        if 'timing' in results:
+            timing = results['timing']
+            print(f"\n⏱️  Tiempo: recuperación {timing['retrieval_seconds']:.2f}s, "
+                  f"métricas {timing['metrics_seconds']:.2f}s ({timing['workers']} workers)")
 
         print("="*80)
 
+    def _label(self, method: str) -> str:
+        if method == 'rerank':
+            return f"BM25→{self.reranker}"
+        return METHOD_LABELS.get(method, method)
+
+    def save_runs(self, directory: str = "results/runs"):
+        """Exporta los rankings de la última evaluación como runs TREC (uno por método) y los qrels"""
+        import os
+        os.makedirs(directory, exist_ok=True)
+        for method in self.methods:
+            write_run(os.path.join(directory, f"{method}.run"), self.runs[method], tag=method)
+        write_qrels(os.path.join(directory, "qrels.txt"),
+                    {query_id: self.qrels[query_id] for query_id in self.runs[self.methods[0]]})
+        print(f"Runs TREC guardados en: {directory}")
+
     def save_results(self, results: Dict, filepath: str = "results/evaluation_results.json"):
         """Guarda los resultados de evaluación"""
         import os
@@ -197,11 +450,59 @@ class IREvaluator:
         save_results(results, filepath)
         print(f"\nResultados guardados en: {filepath}")
 
-def main():
+def main(argv=None):
     """Función principal del evaluador"""
-    evaluator = IREvaluator()
-    results = evaluator.evaluate_all_queries()
-    evaluator.save_results(results)
+    parser = argparse.ArgumentParser(description="Evaluación del sistema de IR")
+    parser.add_argument("--index", default="data/index",
+                        help="directorio del índice (un índice particionado, p. ej. data/shards, se detecta solo)")
+    parser.add_argument("--workers", type=int, default=1, help="procesos que ejecutan las consultas")
+    parser.add_argument("--output", default="results/evaluation_results.json", help="archivo de resultados")
+    parser.add_argument("--rerank", choices=RERANKERS, default=None,
+                        help="evalúa también BM25 en dos etapas con este re-ranking")
+    parser.add_argument("--rm3", action="store_true",
+                        help="evalúa también BM25 con expansión RM3 (índice con --term-vectors)")
+    parser.add_argument("--batch", action="store_true",
+                        help="ejecuta TF-IDF y BM25 por lotes de consultas (search_batch)")
+    parser.add_argument("--sweep", action="store_true",
+                        help="barrido de (k1, b) de BM25 en lugar de la evaluación normal")
+    parser.add_argument("--k1-grid", default=None, help="valores de k1 separados por comas")
+    parser.add_argument("--b-grid", default=None, help="valores de b separados por comas")
+    parser.add_argument("--pruning", action="store_true",
+                        help="pérdida de MAP del tier por impacto con cada poda estática (índice con --impact-tier)")
+    parser.add_argument("--prune-ratios", default=None, help="podas separadas por comas")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="presupuesto de postings de la búsqueda por impacto (fracción de documentos)")
+    parser.add_argument("--run-output", default=None,
+                        help="exporta los rankings de cada método como runs TREC en este directorio")
+    parser.add_argument("--metrics", default=None, help="exporta tiempos por etapa y contadores a este JSON")
+    parser.add_argument("--profile", choices=PROFILERS, default=None, help="perfila la evaluación")
+    parser.add_argument("--profile-output", default=None, help="archivo del perfil")
+    args = parser.parse_args(argv)
+
+    evaluator = IREvaluator(index_path=args.index, workers=args.workers, instrument=args.metrics is not None, reranker=args.rerank,
+                            rm3=args.rm3, batch=args.batch)
+    with profiled(args.profile, args.profile_output):
+        if args.sweep:
+            k1_values = [float(v) for v in args.k1_grid.split(",")] if args.k1_grid else K1_GRID
+            b_values = [float(v) for v in args.b_grid.split(",")] if args.b_grid else B_GRID
+            results = evaluator.sweep_bm25(k1_values, b_values)
+        elif args.pruning:
+            ratios = [float(v) for v in args.prune_ratios.split(",")] if args.prune_ratios else PRUNE_RATIOS
+            results = evaluator.evaluate_pruning(ratios, args.budget)
+        else:
+            results = evaluator.evaluate_all_queries()
+    output = args.output
+    if args.sweep and output == parser.get_default("output"):
+        output = "results/bm25_sweep.json"
+    elif args.pruning and output == parser.get_default("output"):
+        output = "results/impact_pruning.json"
+    evaluator.save_results(results, output)
+    if args.run_output and not (args.sweep or args.pruning):
+        evaluator.save_runs(args.run_output)
+    if args.metrics:
+        evaluator.metrics.display()
+        evaluator.metrics.save(args.metrics)
+        print(f"Métricas guardadas en: {args.metrics}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,68 @@
+"""
+Expansión de consultas por realimentación de pseudo-relevancia (RM3).
+
+Los fb_docs mejores documentos de una primera búsqueda BM25 estiman un
+modelo de relevancia P(w|R) a partir de sus vectores de términos, que se leen
+del índice directo sin recorrer las postings. Los fb_terms términos más
+probables se interpolan con la consulta original y la consulta expandida y
+ponderada vuelve a ejecutarse con BM25, de modo que el coste es el de dos
+consultas más la lectura de fb_docs vectores.
+"""
+from collections import Counter
+from typing import Dict, List
+import numpy as np
+
+# Valores por defecto habituales de RM3 (documentos, términos y peso de la consulta original)
+FB_DOCS = 10
+FB_TERMS = 10
+ORIGINAL_QUERY_WEIGHT = 0.5
+
+
+def relevance_model(rows: np.ndarray, terms: np.ndarray, tfs: np.ndarray, doc_scores: np.ndarray,
+                    doc_lengths: np.ndarray, fb_terms: int = FB_TERMS) -> Dict[str, float]:
+    """
+    RM1: P(w|R) ∝ Σ_D P(w|D) · P(D|Q), con P(w|D) = tf / |D| y P(D|Q) el score
+    de la primera etapa normalizado a suma 1.
+
+    Args:
+        rows, terms, tfs: Vectores de términos de los documentos de realimentación
+            (fila del documento, término, tf), como los devuelve term_vectors
+        doc_scores: Score de la primera etapa de cada documento
+        doc_lengths: Longitud de cada documento
+        fb_terms: Términos que se conservan
+
+    Returns:
+        {término: probabilidad} de los fb_terms más probables, renormalizado
+    """
+    if len(rows) == 0 or fb_terms <= 0:
+        return {}
+    doc_weights = np.maximum(np.asarray(doc_scores, dtype=np.float64), 0.0)
+    if doc_weights.sum() <= 0:
+        doc_weights = np.ones(len(doc_weights))
+    doc_weights /= doc_weights.sum()
+    lengths = np.maximum(np.asarray(doc_lengths, dtype=np.float64), 1.0)
+
+    contributions = np.asarray(tfs, dtype=np.float64) / lengths[rows] * doc_weights[rows]
+    unique, inverse = np.unique(terms, return_inverse=True)
+    probabilities = np.bincount(inverse, weights=contributions, minlength=len(unique))
+    # Más probables primero; a igual probabilidad, por orden alfabético
+    order = np.lexsort((np.arange(len(unique)), -probabilities))[:fb_terms]
+    order = order[probabilities[order] > 0]
+    total = probabilities[order].sum()
+    return {str(unique[i]): float(probabilities[i] / total) for i in order.tolist()}
+
+
+def rm3_weights(query_terms: List[str], feedback: Dict[str, float],
+                original_weight: float = ORIGINAL_QUERY_WEIGHT) -> Dict[str, float]:
+    """
+    RM3: P(w|Q') = λ · P(w|Q) + (1 - λ) · P(w|R), con P(w|Q) la frecuencia
+    relativa del término en la consulta original y λ = original_weight.
+
+    Returns:
+        {término: peso} con los términos de la consulta primero; sin pesos nulos
+    """
+    counts = Counter(query_terms)
+    weights = {term: original_weight * count / len(query_terms) for term, count in counts.items()}
+    for term, probability in feedback.items():
+        weights[term] = weights.get(term, 0.0) + (1 - original_weight) * probability
+    return {term: weight for term, weight in weights.items() if weight > 0}
@@ -0,0 +1,530 @@
+"""
+Indexado incremental: los lotes nuevos se escriben como segmentos pequeños e
+inmutables, los borrados se marcan con tombstones y una política de mezcla
+en segundo plano compacta los segmentos para que la latencia no crezca con
+las actualizaciones. Cada publicación actualiza también las sumas de las
+normas TF-IDF globales (ver segment_set) de los términos cuyo df cambia, así
+que los lectores de una generación puntúan con el idf global sin recorrer de
+nuevo los segmentos que no cambian.
+
+Uso: python -m src.incremental add docs.jsonl
+     python -m src.incremental delete DOC_ID [DOC_ID ...]
+     python -m src.incremental merge | norms | status
+"""
+import argparse
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .indexer import InvertedIndexBuilder
+from .merge import merge_segments
+from .segment import Segment, META_FILE, global_term_dfs, set_fast_tokenizer
+from .segment_set import (read_manifest, write_manifest, load_tombstones, save_tombstones,
+                          load_norm_state, save_norm_state, norm_sums)
+
+# Archivos versionados por generación de cada segmento, por clave del manifiesto
+VERSIONED_FILE_RES = {'norms': re.compile(r"^norm\.(\d+)(?:\.df)?\.npy$"),
+                      'tombstones': re.compile(r"^tombstones(?:\.(\d+))?\.npy$")}
+
+
+def _match_terms(keys: np.ndarray, terms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(máscara de terms presentes en keys, su posición en keys); ambos ordenados"""
+    positions = np.searchsorted(keys, terms)
+    if len(keys) == 0:
+        return np.zeros(len(terms), dtype=bool), positions
+    found = keys[np.minimum(positions, len(keys) - 1)] == terms
+    return np.asarray(found, dtype=bool) & (positions < len(keys)), positions
+
+
+class TieredMergePolicy:
+    """
+    Política de mezcla por niveles: los segmentos se agrupan por nivel
+    log_{merge_factor}(documentos vivos) y se mezclan merge_factor segmentos
+    consecutivos del mismo nivel. Un segmento con demasiados borrados se
+    reescribe solo para purgarlos.
+    """
+
+    def __init__(self, merge_factor: int = 10, max_deleted_ratio: float = 0.3):
+        self.merge_factor = merge_factor
+        self.max_deleted_ratio = max_deleted_ratio
+
+    def _tier(self, live: int) -> int:
+        return int(math.log(max(live, 1), self.merge_factor))
+
+    def select(self, doc_counts: List[int], deleted_counts: List[int]) -> Optional[Tuple[int, int]]:
+        """Rango [inicio, fin) de segmentos a mezclar, o None si no hace falta"""
+        for i, (count, deleted) in enumerate(zip(doc_counts, deleted_counts)):
+            if count and deleted / count >= self.max_deleted_ratio:
+                return i, i + 1
+        tiers = [self._tier(count - deleted) for count, deleted in zip(doc_counts, deleted_counts)]
+        start = 0
+        for i in range(1, len(tiers) + 1):
+            if i == len(tiers) or tiers[i] != tiers[start]:
+                if i - start >= self.merge_factor:
+                    return start, start + self.merge_factor
+                start = i
+        return None
+
+
+class IndexWriter:
+    """Escritor de un índice incremental (un único escritor por índice)"""
+
+    def __init__(self, index_path: str = "data/index", merge_policy: TieredMergePolicy = None,
+                 fast_tokenizer: Optional[bool] = None, positions: Optional[bool] = None,
+                 term_vectors: Optional[bool] = None):
+        """
+        Args:
+            index_path: Directorio del índice; si lo construyó el indexador, ese
+                segmento pasa a ser el primero del índice incremental
+            merge_policy: Política de compactación (por defecto, TieredMergePolicy)
+            fast_tokenizer: Tokeniza con expresiones regulares en lugar de word_tokenize
+                (por defecto, como el primer segmento; no se puede cambiar en un índice existente)
+            positions: Guarda posiciones en los segmentos nuevos (por defecto, si
+                las guarda el primer segmento del índice)
+            term_vectors: Escribe el índice directo en los segmentos nuevos (ídem)
+        """
+        self.index_path = index_path
+        self.merge_policy = merge_policy or TieredMergePolicy()
+        self.lock = threading.RLock()
+        os.makedirs(index_path, exist_ok=True)
+        manifest = read_manifest(index_path)
+        if manifest is None:
+            base = ["."] if os.path.exists(os.path.join(index_path, META_FILE)) else []
+            manifest = {'generation': 0, 'next_segment': 0, 'segments': base}
+            if not base:
+                manifest['norms'] = {}
+            write_manifest(index_path, manifest)
+        manifest.setdefault('tombstones', {})
+        self.manifest = manifest
+        segments = manifest['segments']
+        first = Segment(self._path(segments[0])) if segments else None
+        if fast_tokenizer is None:
+            fast_tokenizer = first is not None and first.fast_tokenizer
+        elif first is not None and fast_tokenizer != first.fast_tokenizer:
+            raise ValueError(f"El índice {index_path} se tokenizó "
+                             f"{'con' if first.fast_tokenizer else 'sin'} --fast-tokenizer: "
+                             f"los documentos nuevos deben tokenizarse igual")
+        self.fast_tokenizer = fast_tokenizer
+        if positions is None:
+            positions = first is not None and first.has_positions
+        if term_vectors is None:
+            term_vectors = first is not None and first.has_term_vectors
+        self.positions = positions
+        self.term_vectors = term_vectors
+        self._merging = set()
+        # Términos (bytes UTF-8, ordenados) de cada segmento: son inmutables
+        self._keys = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.normpath(os.path.join(self.index_path, name))
+
+    def _new_name(self) -> str:
+        name = f"seg_{self.manifest['next_segment']:06d}"
+        self.manifest['next_segment'] += 1
+        return name
+
+    def _commit(self) -> None:
+        """Publica una nueva generación del manifiesto"""
+        self.manifest['generation'] += 1
+        write_manifest(self.index_path, self.manifest)
+
+    def _term_keys(self, name: str) -> np.ndarray:
+        keys = self._keys.get(name)
+        if keys is None:
+            terms = Segment(self._path(name)).terms
+            keys = np.array([terms.raw(t) for t in range(len(terms))], dtype=object)
+            self._keys[name] = keys
+        return keys
+
+    def _tombstones(self, name: str, doc_count: int) -> np.ndarray:
+        """Borrados de un segmento en la generación actual del escritor"""
+        return load_tombstones(self._path(name), doc_count, self.manifest['tombstones'].get(name))
+
+    def _ensure_norms(self) -> None:
+        """Calcula las normas globales de un índice que aún no las tiene (de una versión anterior)"""
+        norms = self.manifest.get('norms')
+        if norms is None or any(name not in norms for name in self.manifest['segments']):
+            self.refresh_norms()
+
+    def refresh_norms(self) -> None:
+        """
+        Recalcula desde cero las sumas de las normas TF-IDF globales de todos
+        los segmentos (un recorrido de cada uno) y las publica.
+        """
+        with self.lock:
+            names = self.manifest['segments']
+            segments = [Segment(self._path(name)) for name in names]
+            deleted = [self._tombstones(name, segment.doc_count) for name, segment in zip(names, segments)]
+            deleted = [mask if mask.any() else None for mask in deleted]
+            version = self.manifest['generation'] + 1
+            previous = self.manifest.get('norms', {})
+            norms = {}
+            for name, segment, dfs in zip(names, segments, global_term_dfs(segments, deleted)):
+                save_norm_state(self._path(name), version, norm_sums(segment, dfs), dfs)
+                norms[name] = version
+            self.manifest['norms'] = norms
+            self._commit()
+            self._prune_versions({'norms': previous})
+
+    def _update_norms(self, new: Optional[str], deleted: Dict[str, np.ndarray]) -> Dict[str, int]:
+        """
+        Actualiza las sumas de normas para la próxima generación (sin publicar):
+        solo se recorren, en cada segmento, las postings de los términos cuyo df
+        global cambia por el segmento nuevo y los documentos borrados.
+
+        Returns:
+            Versión anterior de las normas de los segmentos actualizados
+        """
+        version = self.manifest['generation'] + 1
+        norms = self.manifest['norms']
+        # Cambio del df global por término (como bytes UTF-8)
+        keys, deltas = [], []
+        if new is not None:
+            keys.append(self._term_keys(new))
+            deltas.append(np.asarray(Segment(self._path(new)).term_dfs, dtype=np.int64))
+        for name, docs in deleted.items():
+            segment = Segment(self._path(name))
+            counts = np.bincount(self._doc_terms(segment, docs), minlength=segment.term_count)
+            present = np.flatnonzero(counts)
+            keys.append(self._term_keys(name)[present])
+            deltas.append(-counts[present])
+        if not keys:
+            return {}
+        changed, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        delta = np.zeros(len(changed), dtype=np.int64)
+        np.add.at(delta, inverse.ravel(), np.concatenate(deltas))
+
+        # df con que se calcularon las sumas: el mismo en todos los segmentos que tienen el término
+        old_dfs = np.zeros(len(changed), dtype=np.int64)
+        states = {}
+        for name in self.manifest['segments']:
+            if name == new:
+                continue
+            found, positions = _match_terms(self._term_keys(name), changed)
+            if found.any():
+                sums, dfs = load_norm_state(self._path(name), norms[name])
+                old_dfs[found] = dfs[positions[found]]
+                states[name] = (found, positions[found], sums, dfs)
+        new_dfs = old_dfs + delta
+
+        previous = {}
+        for name, (found, positions, sums, dfs) in states.items():
+            moved = new_dfs[found] != old_dfs[found]
+            if not moved.any():
+                continue
+            term_ids = positions[moved]
+            old_logs = np.log(np.maximum(old_dfs[found][moved], 1))
+            new_logs = np.log(np.maximum(new_dfs[found][moved], 1))
+            shifts = np.zeros((2, len(dfs)))
+            shifts[0, term_ids] = new_logs - old_logs
+            shifts[1, term_ids] = new_logs * new_logs - old_logs * old_logs
+            segment = Segment(self._path(name))
+            sums = sums + norm_sums(segment, dfs, term_ids, shifts)
+            dfs = dfs.copy()
+            dfs[term_ids] = new_dfs[found][moved]
+            save_norm_state(self._path(name), version, sums, dfs)
+            previous[name] = norms[name]
+            norms[name] = version
+        if new is not None:
+            dfs = new_dfs[np.searchsorted(changed, self._term_keys(new))]
+            save_norm_state(self._path(new), version, norm_sums(Segment(self._path(new)), dfs), dfs)
+            norms[new] = version
+        return previous
+
+    def _doc_terms(self, segment: Segment, docs: np.ndarray) -> np.ndarray:
+        """Términos (ids locales, uno por par documento-término) de unos documentos del segmento"""
+        if segment.has_term_vectors:
+            offsets = segment.vector_offsets
+            return np.concatenate([np.asarray(segment.vector_terms[offsets[d]:offsets[d + 1]], dtype=np.int64)
+                                   for d in docs.tolist()] + [np.zeros(0, dtype=np.int64)])
+        selected = np.zeros(segment.doc_count, dtype=bool)
+        selected[docs] = True
+        return np.concatenate([np.asarray(term_ids, dtype=np.int64)[selected[doc_ids]]
+                               for term_ids, doc_ids, _ in segment.iter_postings()] + [np.zeros(0, dtype=np.int64)])
+
+    def _prune_versions(self, previous: Dict[str, Dict[str, Optional[int]]]) -> None:
+        """
+        Elimina los archivos versionados (normas, tombstones) anteriores a la
+        versión previa a la publicada, que pueden seguir usando los lectores
+        de la generación anterior.
+
+        Args:
+            previous: Por clave del manifiesto, versión previa de cada segmento actualizado
+        """
+        for key, versions in previous.items():
+            current = self.manifest[key]
+            for name, version in versions.items():
+                if name not in current:
+                    continue
+                path = self._path(name)
+                keep = {version, current[name]}
+                for entry in os.listdir(path):
+                    match = VERSIONED_FILE_RES[key].match(entry)
+                    if match and (int(match.group(1)) if match.group(1) else None) not in keep:
+                        os.remove(os.path.join(path, entry))
+
+    def add_documents(self, docs: Iterable[Tuple[str, str]]) -> int:
+        """
+        Indexa un lote de (doc_id, texto) como un segmento nuevo. Un doc_id ya
+        presente se reemplaza: su versión anterior queda marcada como borrada.
+
+        Returns:
+            Documentos indexados
+        """
+        with self.lock:
+            name = self._new_name()
+        path = self._path(name)
+        builder = InvertedIndexBuilder(run_dir=path + ".tmp", fast_tokenizer=self.fast_tokenizer,
+                                       positions=self.positions, term_vectors=self.term_vectors)
+        # Dentro del lote gana la última versión de cada doc_id
+        batch = dict(docs)
+        for doc_id, text in batch.items():
+            builder._process_document(doc_id, text)
+        if builder.doc_count > 0:
+            builder._write_segment(path)
+            set_fast_tokenizer(path, self.fast_tokenizer)
+        shutil.rmtree(builder.run_dir, ignore_errors=True)
+
+        with self.lock:
+            self._ensure_norms()
+            # También se borra la versión anterior de los documentos que quedan vacíos
+            deleted, previous_tombstones = self._delete(list(batch))
+            if builder.doc_count > 0:
+                self.manifest['segments'].append(name)
+            if deleted or builder.doc_count > 0:
+                previous = self._update_norms(name if builder.doc_count > 0 else None, deleted)
+                self._commit()
+                self._prune_versions({'norms': previous, 'tombstones': previous_tombstones})
+        if builder.doc_count == 0:
+            return 0
+        print(f"Segmento {name}: {builder.doc_count} documentos")
+        return builder.doc_count
+
+    def _delete(self, doc_ids: List[str]) -> Tuple[Dict[str, np.ndarray], Dict[str, Optional[int]]]:
+        """
+        Marca como borradas las apariciones vivas de los doc_ids en la versión
+        de tombstones de la próxima generación (sin publicar).
+
+        Returns:
+            (ordinales locales recién borrados, versión previa de los tombstones)
+            de cada segmento afectado
+        """
+        deleted, previous = {}, {}
+        tombstones = self.manifest['tombstones']
+        for name in self.manifest['segments']:
+            path = self._path(name)
+            segment = Segment(path)
+            mask = self._tombstones(name, segment.doc_count)
+            locals_ = []
+            for doc_id in doc_ids:
+                local = segment.doc_ordinal(doc_id)
+                if local >= 0 and not mask[local]:
+                    mask[local] = True
+                    locals_.append(local)
+            if locals_:
+                save_tombstones(path, mask, self.manifest['generation'] + 1)
+                previous[name] = tombstones.get(name)
+                tombstones[name] = self.manifest['generation'] + 1
+                deleted[name] = np.array(locals_, dtype=np.int64)
+        return deleted, previous
+
+    def delete_documents(self, doc_ids: List[str]) -> int:
+        """Borra documentos por doc_id; devuelve cuántos estaban vivos"""
+        with self.lock:
+            self._ensure_norms()
+            deleted, previous_tombstones = self._delete(list(doc_ids))
+            if deleted:
+                previous = self._update_norms(None, deleted)
+                self._commit()
+                self._prune_versions({'norms': previous, 'tombstones': previous_tombstones})
+        return sum(len(docs) for docs in deleted.values())
+
+    def segment_stats(self) -> List[Dict]:
+        """Documentos y borrados de cada segmento, en orden"""
+        stats = []
+        with self.lock:
+            for name in self.manifest['segments']:
+                path = self._path(name)
+                with open(os.path.join(path, META_FILE)) as f:
+                    doc_count = json.load(f)['doc_count']
+                deleted = int(self._tombstones(name, doc_count).sum())
+                stats.append({'name': name, 'doc_count': doc_count, 'deleted': deleted})
+        return stats
+
+    def merge(self, names: List[str]) -> None:
+        """
+        Mezcla segmentos consecutivos en uno nuevo descartando sus borrados.
+        Los borrados que llegan mientras se mezcla se trasladan al resultado.
+        """
+        with self.lock:
+            self._ensure_norms()
+            paths = [self._path(name) for name in names]
+            before = [self._tombstones(source, Segment(path).doc_count) for source, path in zip(names, paths)]
+            name = self._new_name()
+            self._merging.update(names)
+        path = self._path(name)
+        try:
+            merge_segments(paths, path, before)
+        except Exception:
+            with self.lock:
+                self._merging.difference_update(names)
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        set_fast_tokenizer(path, self.fast_tokenizer)
+        merged = Segment(path)
+        # Posición de cada término del resultado en los segmentos de origen
+        matches = [_match_terms(self._term_keys(source), self._term_keys(name)) for source in names] \
+            if merged.doc_count > 0 else []
+
+        with self.lock:
+            deleted = np.zeros(merged.doc_count, dtype=bool)
+            base = 0
+            for source, mask in zip(names, before):
+                live = ~mask
+                now = self._tombstones(source, len(mask))
+                remap = np.cumsum(live) - 1
+                deleted[base + remap[now & live]] = True
+                base += int(live.sum())
+            segments = self.manifest['segments']
+            start = segments.index(names[0])
+            replacement = [name] if merged.doc_count > 0 else []
+            segments[start:start + len(names)] = replacement
+            if deleted.any():
+                save_tombstones(path, deleted, self.manifest['generation'] + 1)
+                self.manifest['tombstones'][name] = self.manifest['generation'] + 1
+            # Las sumas de normas de los documentos no cambian al mezclar: se
+            # copian las de los orígenes en el estado de esta misma generación
+            norms = self.manifest['norms']
+            if replacement:
+                states = [load_norm_state(segment_path, norms[source]) for segment_path, source in zip(paths, names)]
+                sums = np.concatenate([state_sums[:, ~mask] for (state_sums, _), mask in zip(states, before)], axis=1)
+                dfs = np.zeros(merged.term_count, dtype=np.int64)
+                for (_, source_dfs), (found, positions) in zip(states, matches):
+                    dfs[found] = source_dfs[positions[found]]
+                save_norm_state(path, self.manifest['generation'] + 1, sums, dfs)
+                norms[name] = self.manifest['generation'] + 1
+            for source in names:
+                norms.pop(source, None)
+                self.manifest['tombstones'].pop(source, None)
+                self._keys.pop(source, None)
+            self._commit()
+            self._merging.difference_update(names)
+        if not replacement:
+            shutil.rmtree(path, ignore_errors=True)
+        for segment_path in paths:
+            self._remove_segment(segment_path)
+        print(f"Mezclados {len(names)} segmentos en {name} ({merged.doc_count} documentos)")
+
+    def _remove_segment(self, path: str) -> None:
+        """Elimina los archivos de un segmento que ya no está en el manifiesto"""
+        if os.path.normpath(path) != os.path.normpath(self.index_path):
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        # Segmento original en la raíz del índice: se conservan el manifiesto y los subdirectorios
+        for entry in os.listdir(path):
+            if entry == META_FILE or entry.endswith(".npy") or entry.startswith("docstore."):
+                os.remove(os.path.join(path, entry))
+
+    def maybe_merge(self) -> bool:
+        """Aplica la política de mezcla una vez; devuelve True si mezcló algo"""
+        with self.lock:
+            stats = self.segment_stats()
+            selected = self.merge_policy.select([s['doc_count'] for s in stats],
+                                                [s['deleted'] for s in stats])
+            if selected is None:
+                return False
+            names = [s['name'] for s in stats[selected[0]:selected[1]]]
+            if self._merging.intersection(names):
+                return False
+        self.merge(names)
+        return True
+
+    def force_merge(self) -> None:
+        """Compacta todo el índice en un único segmento sin borrados"""
+        stats = self.segment_stats()
+        if len(stats) > 1 or any(s['deleted'] for s in stats):
+            self.merge([s['name'] for s in stats])
+
+
+class BackgroundMerger(threading.Thread):
+    """Hilo que aplica periódicamente la política de mezcla del escritor"""
+
+    def __init__(self, writer: IndexWriter, interval: float = 1.0):
+        """
+        Args:
+            writer: Escritor del índice
+            interval: Segundos entre comprobaciones
+        """
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                while not self._stop_event.is_set() and self.writer.maybe_merge():
+                    pass
+            except Exception as e:
+                print(f"Error en la mezcla en segundo plano: {e}")
+
+    def stop(self):
+        """Detiene el hilo tras la mezcla en curso"""
+        self._stop_event.set()
+        self.join()
+
+
+def _read_jsonl(path: str) -> Iterable[Tuple[str, str]]:
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                doc = json.loads(line)
+                yield doc['doc_id'], doc['text']
+
+
+def main(argv=None):
+    """Función principal del indexado incremental"""
+    parser = argparse.ArgumentParser(description="Indexado incremental por segmentos")
+    parser.add_argument("--index", default="data/index", help="directorio del índice")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="indexa documentos de un JSONL con doc_id y text")
+    add.add_argument("path")
+    add.add_argument("--batch-size", type=int, default=10000, help="documentos por segmento")
+    add.add_argument("--fast-tokenizer", action="store_true")
+    delete = commands.add_parser("delete", help="borra documentos por doc_id")
+    delete.add_argument("doc_ids", nargs="+")
+    commands.add_parser("merge", help="compacta el índice en un único segmento")
+    commands.add_parser("norms", help="recalcula desde cero las normas TF-IDF con el idf global")
+    commands.add_parser("status", help="muestra los segmentos y sus borrados")
+    args = parser.parse_args(argv)
+
+    writer = IndexWriter(args.index, fast_tokenizer=True if getattr(args, 'fast_tokenizer', False) else None)
+    if args.command == "add":
+        batch = []
+        for doc in _read_jsonl(args.path):
+            batch.append(doc)
+            if len(batch) >= args.batch_size:
+                writer.add_documents(batch)
+                batch = []
+                while writer.maybe_merge():
+                    pass
+        if batch:
+            writer.add_documents(batch)
+        while writer.maybe_merge():
+            pass
+    elif args.command == "delete":
+        print(f"Documentos borrados: {writer.delete_documents(args.doc_ids)}")
+    elif args.command == "merge":
+        writer.force_merge()
+    elif args.command == "norms":
+        writer.refresh_norms()
+    else:
+        for stats in writer.segment_stats():
+            print(f"{stats['name']:<12} {stats['doc_count']:>10} documentos {stats['deleted']:>8} borrados")
+
+if __name__ == "__main__":
+    main()
@@ -2,25 +2,86 @@
 Construcción del índice invertido con preprocesamiento (lematización NLTK)
 y límite de documentos a indexar
 """
+import argparse
 import os
+import shutil
 import sys
+import time
+from array import array
 from collections import defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
 from typing import Dict, List, Tuple
 import ir_datasets
-from .utils import save_index
-from .preprocesamiento import preprocess_text  # Importa la función de lematización
+from .corpus import Corpus, open_corpus
+from .docstore import DocStoreWriter
+from .instrumentation import PROFILERS, make_metrics, profiled
+from .segment import set_fast_tokenizer, write_impact_postings, write_segment
+from .merge import merge_segments, merge_into
+from .sharding import ShardedWriter, shard_path, write_sharded
+from .preprocesamiento import preprocess_text, preprocess_texts, lemma_cache_info, normalize_tokens, tokenize  # Importa la función de lematización
+
+# Estimación de la memoria del índice en construcción (modo SPIMI): bytes por
+# posting (ordinal y tf en arrays de int32 con su sobreasignación), por término
+# nuevo (str, tupla, dos arrays y hueco del diccionario) y por documento
+POSTING_BYTES = 9
+POSITION_BYTES = 5
+TERM_BYTES = 300
+DOC_BYTES = 80
 
 class InvertedIndexBuilder:
     """Constructor del índice invertido"""
 
-    def __init__(self):
-        self.inverted_index = defaultdict(list)  # {término: [(doc_id, tf), ...]}
-        self.doc_lengths = {}  # {doc_id: longitud}
+    def __init__(self, workers: int = 1, batch_size: int = 2000, run_dir: str = "data/runs",
+                 fast_tokenizer: bool = False, shards: int = 1, instrument: bool = False,
+                 memory_budget_mb: float = None, positions: bool = False, term_vectors: bool = False,
+                 impact_tier: float = None):
+        """
+        Args:
+            workers: Procesos de preprocesamiento (1 = construcción en serie)
+            batch_size: Documentos por lote enviado a cada worker
+            run_dir: Directorio temporal para los runs parciales
+            fast_tokenizer: Tokeniza con expresiones regulares en lugar de word_tokenize
+            shards: Particiones del índice guardado (1 = un único segmento)
+            instrument: Acumula tiempos por etapa y contadores en self.metrics
+            memory_budget_mb: Memoria estimada del índice en construcción a partir
+                de la cual la construcción en serie vuelca un run ordenado a disco
+                (SPIMI); los runs se mezclan al guardar. None = sin límite
+            positions: Guarda la posición de cada término en cada documento
+                (consultas de frase y proximidad)
+            term_vectors: Escribe el índice directo (términos y tfs por documento)
+                que usa la expansión de consultas RM3
+            impact_tier: Escribe también el tier ordenado por impacto BM25 con
+                esta poda estática (fracción de postings conservada por término;
+                1.0 = sin poda). None = sin tier
+        """
+        if impact_tier is not None and shards > 1:
+            raise ValueError("El tier por impacto solo se escribe en índices de un único segmento (--shards 1)")
+        self.workers = workers
+        self.shards = shards
+        self.metrics = make_metrics(instrument)
+        self.fast_tokenizer = fast_tokenizer
+        self.batch_size = batch_size
+        self.run_dir = run_dir
+        self.memory_budget = memory_budget_mb * (1 << 20) if memory_budget_mb else None
+        self.positions = positions
+        self.term_vectors = term_vectors
+        self.impact_tier = impact_tier
+        self.runs = []  # runs parciales (modo paralelo o SPIMI), en orden de documentos
+        # {término: (array de ordinales, array de tfs[, array de posiciones])} de los
+        # documentos aún en memoria
+        self.inverted_index = self._new_postings()
+        self.doc_ids = []  # doc_id de cada ordinal (desde el último run volcado)
+        self.doc_lengths = array('i')  # longitud por ordinal (ídem)
         self.doc_count = 0
         self.total_doc_length = 0
-        self.doc_texts = {}  
+        self.memory_estimate = 0  # bytes estimados del índice en memoria
+        # Los textos se escriben comprimidos en un almacén temporal según se
+        # indexan, en lugar de acumularse en memoria
+        self.doc_store = None
 
-    def build_index(self, dataset_name: str = "car/v1.5/test200", max_docs: int = 3500000):
+    def build_index(self, dataset_name: str = "car/v1.5/test200", max_docs: int = 3500000,
+                    corpus_path: str = None):
         """
         Construye el índice invertido desde el dataset TREC CAR,
         limitando la cantidad de documentos a indexar.
@@ -28,17 +89,43 @@ class InvertedIndexBuilder:
         Args:
             dataset_name: Nombre del dataset
             max_docs: Número máximo de documentos a procesar
+            corpus_path: Lee los documentos ya preprocesados de esta caché de
+                corpus (ver corpus.py) en lugar del dataset; se comprueba antes
+                que no esté obsoleta ni corrupta
         """
-        print(f"Cargando dataset {dataset_name}...")
-        dataset = ir_datasets.load(dataset_name)
+        if corpus_path is not None:
+            print(f"Abriendo caché de corpus {corpus_path}...")
+            with self.metrics.timer('corpus_verify'):
+                corpus = open_corpus(corpus_path, dataset_name, self.fast_tokenizer, max_docs)
+            print(f"Construyendo índice invertido desde la caché ({len(corpus)} documentos pre-tokenizados)... "
+                  f"(máx {max_docs} documentos)")
+            if self.workers > 1:
+                self._build_parallel_corpus(corpus, max_docs)
+                return
+            documents = corpus.iter_documents()
+        else:
+            print(f"Cargando dataset {dataset_name}...")
+            dataset = ir_datasets.load(dataset_name)
+            print(f"Construyendo índice invertido con lematización (NLTK)... (máx {max_docs} documentos)")
+            if self.workers > 1:
+                self._build_parallel(dataset, max_docs)
+                return
+            documents = ((doc.doc_id, doc.text, None) for doc in dataset.docs_iter())
 
-        print(f"Construyendo índice invertido con lematización (NLTK)... (máx {max_docs} documentos)")
+        if self.memory_budget is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            print(f"Presupuesto de memoria: {self.memory_budget / (1 << 20):.0f} MiB (SPIMI)")
 
-        for doc in dataset.docs_iter():
+        for doc_id, text, tokens in documents:
             if self.doc_count >= max_docs:
                 print(f"Límite de {max_docs} documentos alcanzado. Deteniendo el indexado.")
                 break
-            self._process_document(doc.doc_id, doc.text)
+            if tokens is None:
+                self._process_document(doc_id, text)
+            else:
+                self.metrics.count('documents')
+                self.metrics.count('tokens', len(tokens))
+                self._add_document(doc_id, text, tokens)
 
             if self.doc_count % 1000 == 0 and self.doc_count > 0:
                 print(f"Procesados {self.doc_count} documentos...")
@@ -46,51 +133,309 @@ class InvertedIndexBuilder:
         # Calcular longitud promedio de documentos
         self.avg_doc_length = self.total_doc_length / self.doc_count if self.doc_count > 0 else 0
 
-        print(f"Índice construido: {self.doc_count} documentos, {len(self.inverted_index)} términos únicos")
+        if self.runs:
+            print(f"Índice construido: {self.doc_count} documentos en {len(self.runs)} runs "
+                  f"y {len(self.doc_ids)} en memoria")
+        else:
+            print(f"Índice construido: {self.doc_count} documentos, {len(self.inverted_index)} términos únicos")
         print(f"Longitud promedio de documento: {self.avg_doc_length:.2f}")
+        cache = lemma_cache_info()
+        print(f"Caché de lemas: {cache.hits} aciertos, {cache.misses} fallos, {cache.currsize} entradas")
+        self.metrics.count('lemma_cache_hits', cache.hits)
+        self.metrics.count('lemma_cache_misses', cache.misses)
+
+    def _build_parallel(self, dataset, max_docs: int):
+        """
+        Construcción paralela: un pool de procesos preprocesa lotes de
+        documentos y cada worker escribe su run ordenado en disco. En este modo
+        max_docs limita los documentos leídos del dataset.
+        """
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+        results = {}  # {lote: (run, documentos, longitud total)}
+        worker_docs = defaultdict(int)
+
+        def collect(done):
+            for future in done:
+                batch_no, run_path, pid, doc_count, total_length, elapsed = future.result()
+                results[batch_no] = (run_path, doc_count, total_length)
+                worker_docs[pid] += doc_count
+                self.metrics.add_time('worker_batch', elapsed)
+                self.metrics.count('documents', doc_count)
+                indexed = sum(r[1] for r in results.values())
+                print(f"[worker {pid}] lote {batch_no}: {doc_count} documentos en {elapsed:.1f}s "
+                      f"(worker: {worker_docs[pid]}, total: {indexed})")
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = set()
+            for batch_no, batch in enumerate(self._iter_batches(dataset.docs_iter(), max_docs)):
+                run_path = os.path.join(self.run_dir, f"run_{batch_no:06d}")
+                pending.add(pool.submit(_index_batch, batch_no, batch, run_path, self.fast_tokenizer,
+                                        self.positions))
+                # Ventana acotada de lotes en vuelo: la memoria no crece con max_docs
+                if len(pending) >= 2 * self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(pending)
+        self._finish_parallel(results, worker_docs)
+
+    def _build_parallel_corpus(self, corpus, max_docs: int):
+        """
+        Construcción paralela desde la caché de corpus: cada worker abre la
+        caché con mmap e indexa un rango de documentos, sin recibir textos ni
+        ejecutar NLTK. Como en _build_parallel, max_docs limita los documentos leídos.
+        """
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+        results = {}
+        worker_docs = defaultdict(int)
+        stop = min(len(corpus), max_docs)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(_index_corpus_batch, batch_no, corpus.corpus_path, start,
+                                   min(start + self.batch_size, stop),
+                                   os.path.join(self.run_dir, f"run_{batch_no:06d}"), self.positions)
+                       for batch_no, start in enumerate(range(0, stop, self.batch_size))]
+            for future in futures:
+                batch_no, run_path, pid, doc_count, total_length, elapsed = future.result()
+                results[batch_no] = (run_path, doc_count, total_length)
+                worker_docs[pid] += doc_count
+                self.metrics.add_time('worker_batch', elapsed)
+                self.metrics.count('documents', doc_count)
+        self._finish_parallel(results, worker_docs)
+
+    def _finish_parallel(self, results: Dict, worker_docs: Dict):
+        """Registra los runs de los workers en orden de lote y las estadísticas del índice"""
+        self.runs = [results[n][0] for n in sorted(results) if results[n][1] > 0]
+        self.doc_count = sum(r[1] for r in results.values())
+        self.total_doc_length = sum(r[2] for r in results.values())
+        self.avg_doc_length = self.total_doc_length / self.doc_count if self.doc_count > 0 else 0
+
+        print(f"Índice construido: {self.doc_count} documentos en {len(self.runs)} runs "
+              f"({len(worker_docs)} workers)")
+        print(f"Longitud promedio de documento: {self.avg_doc_length:.2f}")
+
+    def _iter_batches(self, docs_iter, max_docs: int):
+        """Agrupa (doc_id, texto) en lotes de batch_size hasta max_docs documentos"""
+        batch = []
+        for read, doc in enumerate(docs_iter):
+            if read >= max_docs:
+                print(f"Límite de {max_docs} documentos alcanzado. Deteniendo la lectura.")
+                break
+            batch.append((doc.doc_id, doc.text))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     def _process_document(self, doc_id: str, text: str):
         """Procesa un documento individual con preprocesamiento (lematización)"""
-        tokens = preprocess_text(text)  # Lematización y preprocesamiento
+        metrics = self.metrics
+        if metrics.enabled:
+            # Las dos etapas de preprocess_text medidas por separado
+            with metrics.timer('tokenize'):
+                tokens = tokenize(text, self.fast_tokenizer) if text else []
+            with metrics.timer('lemmatize'):
+                tokens = normalize_tokens(tokens)
+            metrics.count('documents')
+            metrics.count('tokens', len(tokens))
+        else:
+            tokens = preprocess_text(text, self.fast_tokenizer)  # Lematización y preprocesamiento
+        self._add_document(doc_id, text, tokens)
+
+    def _add_document(self, doc_id: str, text: str, tokens: List[str]):
+        """Añade al índice un documento ya preprocesado"""
         if not tokens:
             return
-        self.doc_texts[doc_id] = text  # GUARDA EL TEXTO DEL DOC
+        # El ordinal del documento es su posición de indexado desde el último run
+        ordinal = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        if self.doc_store is None:
+            self.doc_store = DocStoreWriter(self._doc_store_path())
+        with self.metrics.timer('docstore'):
+            self.doc_store.add(text)  # GUARDA EL TEXTO DEL DOC
 
-        # Contar frecuencias de términos
-        term_frequencies = Counter(tokens)
         doc_length = len(tokens)
 
         # Actualizar índice invertido
-        for term, tf in term_frequencies.items():
-            self.inverted_index[term].append((doc_id, tf))
+        term_count = len(self.inverted_index)
+        with self.metrics.timer('postings_append'):
+            if self.positions:
+                # Posición de cada aparición (sobre los tokens ya preprocesados)
+                term_frequencies = defaultdict(list)
+                for position, term in enumerate(tokens):
+                    term_frequencies[term].append(position)
+                for term, term_positions in term_frequencies.items():
+                    docs, tfs, positions = self.inverted_index[term]
+                    docs.append(ordinal)
+                    tfs.append(len(term_positions))
+                    positions.extend(term_positions)
+            else:
+                # Contar frecuencias de términos
+                term_frequencies = Counter(tokens)
+                for term, tf in term_frequencies.items():
+                    docs, tfs = self.inverted_index[term]
+                    docs.append(ordinal)
+                    tfs.append(tf)
 
         # Guardar longitud del documento
-        self.doc_lengths[doc_id] = doc_length
+        self.doc_lengths.append(doc_length)
         self.total_doc_length += doc_length
         self.doc_count += 1
 
-    def save_index(self, filepath: str = "data/index.pkl"):
-        """Guarda el índice en disco"""
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        self.memory_estimate += (POSTING_BYTES * len(term_frequencies) + DOC_BYTES + len(doc_id) +
+                                 TERM_BYTES * (len(self.inverted_index) - term_count))
+        if self.positions:
+            self.memory_estimate += POSITION_BYTES * doc_length
+        if self.memory_budget is not None and self.memory_estimate >= self.memory_budget:
+            self._flush_run()
+
+    def _flush_run(self):
+        """SPIMI: vuelca lo indexado en memoria como run ordenado y empieza uno nuevo"""
+        run_path = os.path.join(self.run_dir, f"spimi_{len(self.runs):06d}")
+        with self.metrics.timer('flush'):
+            # Los textos siguen en el almacén temporal, que se copia entero al
+            # mezclar: sus bloques quedan igual que en la construcción en memoria
+            self._write_segment(run_path, shards=1, term_vectors=False, texts=False)
+        self.metrics.count('runs')
+        print(f"Run {len(self.runs)} volcado: {len(self.doc_ids)} documentos, "
+              f"{len(self.inverted_index)} términos (~{self.memory_estimate / (1 << 20):.0f} MiB)")
+        self.runs.append(run_path)
+        self.inverted_index = self._new_postings()
+        self.doc_ids = []
+        self.doc_lengths = array('i')
+        self.memory_estimate = 0
+
+    def _new_postings(self):
+        """Diccionario vacío de postings en construcción"""
+        if self.positions:
+            return defaultdict(lambda: (array('i'), array('i'), array('i')))
+        return defaultdict(lambda: (array('i'), array('i')))
+
+    def _doc_store_path(self) -> str:
+        """Directorio del almacén temporal de textos"""
+        return os.path.join(self.run_dir, "docstore")
 
-        index_data = {
-            'inverted_index': dict(self.inverted_index),
-            'doc_lengths': self.doc_lengths,
-            'doc_count': self.doc_count,
-            'avg_doc_length': self.avg_doc_length,
-            'total_doc_length': self.total_doc_length,
-            'doc_texts': self.doc_texts  #GUARDA EL DICCIONARIO
-        }
+    def _write_segment(self, index_path: str, shards: int = None, term_vectors: bool = None,
+                       texts: bool = True):
+        """
+        Escribe lo indexado como segmento, copiando los textos del almacén
+        temporal (con texts=False, textos vacíos y el almacén sigue abierto)
+        """
+        shards = self.shards if shards is None else shards
+        term_vectors = self.term_vectors if term_vectors is None else term_vectors
+        if shards > 1:
+            write = partial(write_sharded, index_path, shards, positions=self.positions,
+                            term_vectors=term_vectors)
+        else:
+            write = partial(write_segment, index_path, positions=self.positions, term_vectors=term_vectors)
+        if self.doc_store is None or not texts:
+            write(self.inverted_index, self.doc_ids, self.doc_lengths, [""] * len(self.doc_ids))
+            return
+        self.doc_store.close()
+        write(self.inverted_index, self.doc_ids, self.doc_lengths, docstore=self._doc_store_path())
+        shutil.rmtree(self._doc_store_path(), ignore_errors=True)
+        self.doc_store = None
+
+    def save_index(self, index_path: str = "data/index"):
+        """Guarda el índice en disco como segmento mmap (o como shards, si shards > 1)"""
+        if self.runs:
+            if self.doc_ids:
+                # SPIMI: los documentos que quedan en memoria forman el último run
+                self._flush_run()
+            # Modo paralelo o SPIMI: mezcla k-way de los runs ordenados
+            print(f"Mezclando {len(self.runs)} runs...")
+            docstore = None
+            if self.doc_store is not None:
+                # SPIMI: los textos de todos los runs están en el almacén temporal
+                self.doc_store.close()
+                self.doc_store = None
+                docstore = self._doc_store_path()
+            with self.metrics.timer('merge'):
+                if self.shards > 1:
+                    merge_into(self.runs, ShardedWriter(index_path, self.shards, self.positions,
+                                                        self.term_vectors), docstore=docstore)
+                else:
+                    merge_segments(self.runs, index_path, term_vectors=self.term_vectors, docstore=docstore)
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+        else:
+            with self.metrics.timer('write_segment'):
+                self._write_segment(index_path)
+        # Las consultas se tokenizan con el mismo tokenizador que los documentos
+        paths = [shard_path(index_path, s) for s in range(self.shards)] if self.shards > 1 else [index_path]
+        for path in paths:
+            set_fast_tokenizer(path, self.fast_tokenizer)
+        if self.impact_tier is not None:
+            with self.metrics.timer('impact_tier'):
+                write_impact_postings(index_path, self.impact_tier)
+        shards = f" ({self.shards} shards)" if self.shards > 1 else ""
+        print(f"Índice guardado en {index_path}{shards}")
 
-        save_index(index_data, filepath)
-        print(f"Índice guardado en {filepath}")
+def _index_batch(batch_no: int, docs: List[Tuple[str, str]], run_path: str, fast_tokenizer: bool = False,
+                 positions: bool = False):
+    """Worker: indexa un lote de documentos y lo escribe como run ordenado"""
+    start = time.time()
+    texts = [text for _, text in docs]
+    documents = [(doc_id, text, tokens)
+                 for (doc_id, text), tokens in zip(docs, preprocess_texts(texts, fast_tokenizer))]
+    return _index_documents(batch_no, documents, run_path, positions, start)
 
-def main():
+def _index_corpus_batch(batch_no: int, corpus_path: str, start: int, stop: int, run_path: str,
+                        positions: bool = False):
+    """Worker: indexa los documentos [start, stop) de la caché de corpus (ya preprocesados)"""
+    started = time.time()
+    corpus = Corpus(corpus_path)
+    return _index_documents(batch_no, corpus.iter_documents(start, stop), run_path, positions, started)
+
+def _index_documents(batch_no: int, documents, run_path: str, positions: bool, start: float):
+    """Indexa (doc_id, texto, tokens) y escribe el run ordenado; devuelve sus estadísticas"""
+    builder = InvertedIndexBuilder(run_dir=run_path + ".tmp", positions=positions)
+    for doc_id, text, tokens in documents:
+        builder._add_document(doc_id, text, tokens)
+    if builder.doc_count > 0:
+        builder._write_segment(run_path)
+        shutil.rmtree(builder.run_dir, ignore_errors=True)
+    return batch_no, run_path, os.getpid(), builder.doc_count, builder.total_doc_length, time.time() - start
+
+def main(argv=None):
     """Función principal para construcción del índice"""
-    builder = InvertedIndexBuilder()
-    # número máximo de documentos
-    builder.build_index(max_docs=3500000)
-    builder.save_index()
+    parser = argparse.ArgumentParser(description="Construcción del índice invertido")
+    parser.add_argument("--max-docs", type=int, default=3500000, help="número máximo de documentos")
+    parser.add_argument("--workers", type=int, default=1, help="procesos de preprocesamiento")
+    parser.add_argument("--batch-size", type=int, default=2000, help="documentos por lote")
+    parser.add_argument("--fast-tokenizer", action="store_true",
+                        help="tokenizador por expresiones regulares (verificar con python -m src.preprocesamiento)")
+    parser.add_argument("--shards", type=int, default=1, help="particiones del índice (scatter-gather)")
+    parser.add_argument("--output", default=None,
+                        help="directorio del índice (por defecto data/index, o data/shards con --shards)")
+    parser.add_argument("--memory-budget-mb", type=float, default=None,
+                        help="construcción en serie con memoria acotada: vuelca runs a disco al superar este presupuesto")
+    parser.add_argument("--positions", action="store_true",
+                        help="guarda posiciones para consultas de frase y proximidad")
+    parser.add_argument("--term-vectors", action="store_true",
+                        help="guarda el índice directo (términos por documento) para la expansión RM3")
+    parser.add_argument("--corpus", default=None,
+                        help="indexa desde esta caché de corpus pre-tokenizado (python -m src.corpus) sin NLTK")
+    parser.add_argument("--impact-tier", type=float, default=None, metavar="RATIO",
+                        help="escribe el tier ordenado por impacto con poda estática RATIO (1.0 = sin poda)")
+    parser.add_argument("--metrics", default=None, help="exporta tiempos por etapa y contadores a este JSON")
+    parser.add_argument("--profile", choices=PROFILERS, default=None, help="perfila la construcción")
+    parser.add_argument("--profile-output", default=None, help="archivo del perfil")
+    args = parser.parse_args(argv)
+
+    builder = InvertedIndexBuilder(workers=args.workers, batch_size=args.batch_size,
+                                   fast_tokenizer=args.fast_tokenizer, shards=args.shards,
+                                   instrument=args.metrics is not None, memory_budget_mb=args.memory_budget_mb,
+                                   positions=args.positions, term_vectors=args.term_vectors,
+                                   impact_tier=args.impact_tier)
+    with profiled(args.profile, args.profile_output):
+        with builder.metrics.timer('build'):
+            builder.build_index(max_docs=args.max_docs, corpus_path=args.corpus)
+        builder.save_index(args.output or ("data/shards" if args.shards > 1 else "data/index"))
+    if args.metrics:
+        builder.metrics.display()
+        builder.metrics.save(args.metrics)
+        print(f"Métricas guardadas en: {args.metrics}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,165 @@
+"""
+Instrumentación opcional de los caminos críticos: temporizadores por etapa y
+contadores (términos consultados, postings visitadas, candidatos, aciertos de
+caché...) que se exportan a JSON, y un envoltorio para perfilar una ejecución
+con cProfile o tracemalloc.
+
+Los componentes reciben un objeto Metrics; por defecto usan DISABLED, cuyos
+métodos no hacen nada, de modo que el coste sin instrumentar es una llamada
+vacía por etapa.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+PROFILERS = ("cprofile", "tracemalloc")
+# Líneas del perfil que se muestran por pantalla
+PROFILE_TOP = 20
+
+
+class Metrics:
+    """Temporizadores acumulados por etapa y contadores con nombre"""
+
+    enabled = True
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Acumula el tiempo del bloque en la etapa `stage`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - start
+            self.calls[stage] += 1
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        """Acumula un tiempo medido fuera de un bloque `timer`"""
+        self.seconds[stage] += seconds
+        self.calls[stage] += 1
+
+    def count(self, counter: str, n: int = 1) -> None:
+        self.counters[counter] += n
+
+    def summary(self) -> Dict:
+        """Resumen serializable a JSON"""
+        return {
+            'timers': {stage: {'seconds': self.seconds[stage], 'calls': self.calls[stage]}
+                       for stage in sorted(self.seconds)},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def merge(self, summary: Dict) -> None:
+        """Suma un resumen (por ejemplo, el de un proceso worker)"""
+        for stage, timer in summary.get('timers', {}).items():
+            self.seconds[stage] += timer['seconds']
+            self.calls[stage] += timer['calls']
+        for counter, value in summary.get('counters', {}).items():
+            self.counters[counter] += value
+
+    def reset(self) -> None:
+        self.seconds.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def drain(self) -> Dict:
+        """Devuelve el resumen y vuelve a empezar"""
+        summary = self.summary()
+        self.reset()
+        return summary
+
+    def save(self, filepath: str) -> None:
+        """Exporta el resumen a JSON"""
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        with open(filepath, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def display(self) -> None:
+        summary = self.summary()
+        print("\n⏱️  Instrumentación:")
+        for stage, timer in summary['timers'].items():
+            print(f"  {stage:<28} {timer['seconds']:>10.4f}s  ({timer['calls']} llamadas)")
+        for counter, value in summary['counters'].items():
+            print(f"  {counter:<28} {value:>10}")
+
+
+class _DisabledMetrics(Metrics):
+    """Metrics sin efecto: la instrumentación desactivada"""
+
+    enabled = False
+    _null = nullcontext()
+
+    def timer(self, stage: str):
+        return self._null
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        pass
+
+    def count(self, counter: str, n: int = 1) -> None:
+        pass
+
+
+DISABLED = _DisabledMetrics()
+
+
+def make_metrics(enabled: bool) -> Metrics:
+    """Metrics nuevo si se pide instrumentación, DISABLED si no"""
+    return Metrics() if enabled else DISABLED
+
+
+@contextmanager
+def profiled(profiler: Optional[str], filepath: Optional[str] = None):
+    """
+    Perfila el bloque con cProfile (estadísticas en formato pstats) o con
+    tracemalloc (asignaciones por línea en texto) y guarda el perfil en
+    `filepath`. Con profiler=None no hace nada.
+    """
+    if profiler is None:
+        yield
+        return
+    if profiler not in PROFILERS:
+        raise ValueError(f"Perfilador desconocido: {profiler}. Opciones: {', '.join(PROFILERS)}")
+    filepath = filepath or os.path.join("results", f"profile.{'prof' if profiler == 'cprofile' else 'txt'}")
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+
+    if profiler == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(filepath)
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            print(stream.getvalue())
+            print(f"Perfil cProfile guardado en: {filepath}")
+        return
+
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = snapshot.statistics("lineno")
+        with open(filepath, 'w') as f:
+            f.write(f"Memoria actual: {current / (1 << 20):.1f} MiB, pico: {peak / (1 << 20):.1f} MiB\n")
+            for stat in stats:
+                f.write(f"{stat}\n")
+        print(f"\nMemoria trazada: actual {current / (1 << 20):.1f} MiB, pico {peak / (1 << 20):.1f} MiB")
+        for stat in stats[:PROFILE_TOP]:
+            print(f"  {stat}")
+        print(f"Perfil tracemalloc guardado en: {filepath}")
@@ -0,0 +1,109 @@
+"""
+Generador de carga para el servidor de búsqueda: lanza consultas
+concurrentes por HTTP y reporta latencias (p50/p99) y QPS.
+
+Uso: python -m src.loadgen --url http://127.0.0.1:8080 --concurrency 16 --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+from itertools import cycle
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, urlencode
+import numpy as np
+
+
+def load_queries(path: Optional[str] = None, dataset_name: str = "car/v1.5/test200") -> List[str]:
+    """Consultas de un archivo (una por línea) o, por defecto, las del dataset"""
+    if path:
+        with open(path, encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    import ir_datasets
+    return [q.text for q in ir_datasets.load(dataset_name).queries_iter()]
+
+
+async def _client(host: str, port: int, requests, latencies: List[float], errors: List[str]):
+    """Un cliente con conexión keep-alive que consume peticiones de la cola compartida"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for target in requests:
+            start = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin1'))
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode('latin1').split("\r\n")
+            length = 0
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            body = await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            status = lines[0].split()[1]
+            if status != "200":
+                errors.append(f"{status}: {json.loads(body).get('error')}")
+    finally:
+        writer.close()
+
+
+async def run_load(url: str, queries: List[str], concurrency: int = 16, total: int = 1000,
+                   model: str = "bm25", k: int = 10) -> Dict:
+    """
+    Envía `total` consultas repartidas en `concurrency` conexiones.
+
+    Returns:
+        Diccionario con peticiones, errores, QPS y percentiles de latencia en ms
+    """
+    parts = urlsplit(url)
+    host, port = parts.hostname or "127.0.0.1", parts.port or 80
+    targets = cycle("/search?" + urlencode({'q': q, 'model': model, 'k': k}) for q in queries)
+    # Iterador compartido: cada cliente toma la siguiente petición pendiente
+    requests = (next(targets) for _ in range(total))
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, requests, latencies, errors)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'qps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'mean': float(ms.mean()) if len(ms) else 0.0,
+            'p50': float(np.percentile(ms, 50)) if len(ms) else 0.0,
+            'p99': float(np.percentile(ms, 99)) if len(ms) else 0.0,
+            'max': float(ms.max()) if len(ms) else 0.0,
+        },
+        'first_errors': errors[:5],
+    }
+
+
+def main(argv=None):
+    """Función principal del generador de carga"""
+    parser = argparse.ArgumentParser(description="Generador de carga para el servidor de búsqueda")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--queries", help="archivo con una consulta por línea (por defecto, las del dataset)")
+    parser.add_argument("--concurrency", type=int, default=16, help="conexiones simultáneas")
+    parser.add_argument("--requests", type=int, default=1000, help="peticiones totales")
+    parser.add_argument("--model", default="bm25", choices=("bm25", "tfidf"))
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    queries = load_queries(args.queries)
+    report = asyncio.run(run_load(args.url, queries, args.concurrency, args.requests, args.model, args.k))
+    latency = report['latency_ms']
+    print(f"{report['requests']} peticiones ({report['errors']} errores) en {report['seconds']:.2f}s "
+          f"con {report['concurrency']} conexiones")
+    print(f"QPS: {report['qps']:.1f}")
+    print(f"Latencia (ms): media={latency['mean']:.2f} p50={latency['p50']:.2f} "
+          f"p99={latency['p99']:.2f} máx={latency['max']:.2f}")
+    for error in report['first_errors']:
+        print(f"  Error: {error}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Mezcla k-way de segmentos ordenados en un único segmento.
+
+Los runs parciales que escriben los workers del indexado paralelo son
+segmentos pequeños con ordinales locales; la mezcla recorre sus
+diccionarios de términos en paralelo y reescribe las postings con los
+ordinales globales sin cargar ningún run completo en memoria.
+"""
+import heapq
+from itertools import groupby
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+from .docstore import DocStore
+from .segment import Segment, SegmentWriter
+
+# Postings decodificados por lectura en cada segmento durante la mezcla
+MERGE_READ_POSTINGS = 1 << 14
+# Documentos copiados por lote a las tablas del segmento final
+MERGE_DOC_BATCH = 10000
+
+
+def _iter_terms(segment: Segment, rank: int, remap: Optional[np.ndarray] = None,
+                positions: bool = False) -> Iterator[Tuple]:
+    """
+    Recorre un segmento término a término en orden: (término, rank, docs, tfs)
+    y, con positions=True, también las posiciones de esas postings.
+    Con `remap` (nuevo ordinal por ordinal, -1 si está borrado) se descartan
+    los documentos borrados y se renumeran los demás.
+    """
+    for chunk in segment.iter_postings(MERGE_READ_POSTINGS, positions):
+        term_ids, docs, tfs = chunk[:3]
+        chunk_positions = chunk[3] if positions else None
+        if remap is not None:
+            docs = remap[docs]
+            live = docs >= 0
+            if positions:
+                chunk_positions = chunk_positions[np.repeat(live, tfs)]
+            term_ids, docs, tfs = term_ids[live], docs[live], tfs[live]
+            if len(docs) == 0:
+                continue
+        bounds = np.flatnonzero(np.diff(term_ids)) + 1
+        starts = np.concatenate(([0], bounds)).tolist()
+        ends = np.concatenate((bounds, [len(term_ids)])).tolist()
+        if positions:
+            # Offset de las posiciones de cada posting del bloque
+            position_offsets = np.concatenate(([0], np.cumsum(tfs))).tolist()
+        for start, end in zip(starts, ends):
+            item = (segment.terms.raw(int(term_ids[start])), rank, docs[start:end], tfs[start:end])
+            if positions:
+                item += (chunk_positions[position_offsets[start]:position_offsets[end]],)
+            yield item
+
+
+def _copy_documents(segment: Segment, writer: SegmentWriter,
+                    live: Optional[np.ndarray] = None, texts: bool = True) -> None:
+    """Copia por lotes las tablas por documento de un segmento al escritor (y sus textos si texts)"""
+    if not texts:
+        ordinals = np.flatnonzero(live).tolist() if live is not None else range(segment.doc_count)
+        for start in range(0, len(ordinals), MERGE_DOC_BATCH):
+            batch = ordinals[start:start + MERGE_DOC_BATCH]
+            writer.add_documents([segment.doc_ids[i] for i in batch],
+                                 segment.doc_lengths[batch].tolist())
+        return
+    if live is not None:
+        # Con borrados los bloques del almacén no se pueden copiar tal cual
+        ordinals = np.flatnonzero(live).tolist()
+        for start in range(0, len(ordinals), MERGE_DOC_BATCH):
+            batch = ordinals[start:start + MERGE_DOC_BATCH]
+            writer.add_documents([segment.doc_ids[i] for i in batch],
+                                 segment.doc_lengths[batch].tolist(),
+                                 [segment.docstore.get(i) for i in batch])
+        return
+    for start in range(0, segment.doc_count, MERGE_DOC_BATCH):
+        end = min(start + MERGE_DOC_BATCH, segment.doc_count)
+        writer.add_documents([segment.doc_ids[i] for i in range(start, end)],
+                             segment.doc_lengths[start:end].tolist())
+    # Los textos se copian bloque a bloque, sin descomprimirlos
+    writer.add_docstore(segment.docstore)
+
+
+def merge_segments(input_paths: List[str], index_path: str,
+                   deleted: Optional[List[Optional[np.ndarray]]] = None,
+                   term_vectors: Optional[bool] = None, docstore: Optional[str] = None) -> None:
+    """
+    Mezcla segmentos en uno nuevo. Los documentos conservan el orden de
+    `input_paths`, por lo que las postings resultantes siguen ordenadas.
+
+    Args:
+        input_paths: Directorios de los segmentos de entrada, en orden
+        index_path: Directorio del segmento resultante
+        deleted: Máscara de borrados por segmento (None = sin borrados); los
+            documentos borrados no se copian al segmento resultante
+        term_vectors: Escribe el índice directo (por defecto, si lo tienen
+            todos los segmentos de entrada)
+        docstore: Ver merge_into
+    """
+    segments = [Segment(path) for path in input_paths]
+    positions = bool(segments) and all(segment.has_positions for segment in segments)
+    if term_vectors is None:
+        term_vectors = bool(segments) and all(segment.has_term_vectors for segment in segments)
+    merge_into(input_paths, SegmentWriter(index_path, positions, term_vectors), deleted, docstore)
+
+
+def merge_into(input_paths: List[str], writer,
+               deleted: Optional[List[Optional[np.ndarray]]] = None,
+               docstore: Optional[str] = None) -> None:
+    """
+    Mezcla segmentos sobre un escritor ya abierto (SegmentWriter o cualquier
+    escritor con su misma interfaz, como el de un índice particionado) y lo cierra.
+    Si el escritor guarda posiciones, todos los segmentos deben tenerlas.
+    Con `docstore` (almacén con los textos de todos los documentos vivos, en
+    orden) los textos de los segmentos no se leen: se copia ese almacén entero.
+    """
+    segments = [Segment(path) for path in input_paths]
+    deleted = deleted or [None] * len(segments)
+    positions = writer.positions
+    if positions and not all(segment.has_positions for segment in segments):
+        raise ValueError("No se pueden mezclar posiciones de segmentos que no las guardan")
+
+    bases, remaps = [], []
+    for segment, mask in zip(segments, deleted):
+        bases.append(writer.doc_count)
+        if mask is not None and mask.any():
+            live = ~mask
+            remaps.append(np.where(live, np.cumsum(live) - 1, -1))
+            _copy_documents(segment, writer, live, texts=docstore is None)
+        else:
+            remaps.append(None)
+            _copy_documents(segment, writer, texts=docstore is None)
+    if docstore is not None:
+        writer.add_docstore(DocStore(docstore))
+
+    streams = [_iter_terms(segment, rank, remap, positions)
+               for rank, (segment, remap) in enumerate(zip(segments, remaps))]
+    for key, group in groupby(heapq.merge(*streams, key=lambda item: (item[0], item[1])),
+                              key=lambda item: item[0]):
+        parts = list(group)
+        docs = np.concatenate([part[2] + bases[part[1]] for part in parts])
+        tfs = np.concatenate([part[3] for part in parts])
+        term_positions = np.concatenate([part[4] for part in parts]) if positions else None
+        writer.add_postings(key.decode('utf-8'), docs, tfs, term_positions)
+    writer.close()
@@ -1,8 +1,12 @@
 # preprocesamiento.py
 
+import re
+from functools import lru_cache
+from itertools import chain
+from typing import Dict, List
 import nltk
 from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
+from nltk.tokenize import sent_tokenize, word_tokenize
 from nltk.stem import WordNetLemmatizer
 
 # Descargar recursos (solo si no están ya descargados)
@@ -22,19 +26,155 @@ except LookupError:
 stop_words = set(stopwords.words('english'))
 lemmatizer = WordNetLemmatizer()
 
-def preprocess_text(text: str):
+# Tamaño máximo de la caché token -> lema (LRU, compartida por indexado y consultas)
+LEMMA_CACHE_SIZE = 1 << 20
+
+# Tokenizador rápido: separadores que el tokenizador Treebank de NLTK aísla siempre
+# (puntuación, comillas dobles y tipográficas, paréntesis, "--", "...", "*" y guiones largos)
+FAST_SPLIT_RE = re.compile(r"""\s+|[;@#$%&?!*()\[\]{}<>"«»“”‘’„\u2012-\u2015]|`+|--|\.{2,}""")
+# Comilla simple de apertura tras un carácter que no es de palabra (también sin
+# espacio: "='x'", "|'ed"), salvo delante de un clítico: NLTK la separa
+FAST_QUOTE_RE = re.compile(r"(?<!\w)'(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)")
+# Comillas dobles de apertura, que NLTK convierte en `` antes de buscar el punto final
+FAST_OPEN_QUOTES_RE = re.compile(r"""(^|[ (\[{<])(?:"|'')""")
+# Punto final de una oración (seguido de cierres de comillas o paréntesis), la
+# única posición en la que NLTK lo separa de la palabra
+FAST_FINAL_PERIOD_RE = re.compile(r"""([^.])\.([\]\)}>"'»”’ ]*)\s*$""")
+# ":" y "," seguidos de algo que no sea un dígito, con la misma regla que NLTK:
+# en "::x" el segundo ":" queda pegado a la palabra
+FAST_COLON_RE = re.compile(r"([:,])([^\d]|$)")
+# Fragmento que NLTK reduce a una palabra alfabética: comillas simples (salvo
+# delante de un clítico) se separan, igual que los clíticos ("n't", "'s", ...)
+# y las contracciones "more'n" y "d'ye" de MacIntyre; con un punto pegado
+# ("etc.", "u.s") NLTK deja un token no alfabético que se descarta
+FAST_WORD_RE = re.compile(r"""(?:'(?!(?:re|ve|ll|m|t|s|d|n)\b))*([^\W\d_]+?)"""
+                          r"""(?:n't|'s|'re|'ve|'ll|'d|'m|(?<=\bmore)'n|(?<=\bd)'ye)?'*""")
+# Resto de contracciones de MacIntyre (CONTRACTIONS2) que NLTK parte en dos palabras
+FAST_CONTRACTIONS = {
+    'cannot': ['can', 'not'], 'gimme': ['gim', 'me'], 'gonna': ['gon', 'na'],
+    'gotta': ['got', 'ta'], 'lemme': ['lem', 'me'], 'wanna': ['wan', 'na'],
+}
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def _normalize_token(token: str):
+    """Filtra stopwords y tokens no alfabéticos y lematiza; None si se descarta"""
+    if not token.isalpha() or token in stop_words:
+        return None
+    return lemmatizer.lemmatize(token)
+
+def fast_tokenize(text: str) -> List[str]:
+    """
+    Tokenización con expresiones regulares compiladas que reproduce las reglas
+    de NLTKWordTokenizer (separadores, comillas, clíticos y contracciones de
+    MacIntyre) y solo conserva los tokens alfabéticos. Divide el texto en
+    oraciones con el mismo punkt que word_tokenize, porque el punto solo se
+    separa de la palabra al final de una oración: así abreviaturas e
+    iniciales ("etc.", "j.") se descartan igual que en word_tokenize.
+    verify_fast_tokenizer mide las diferencias que queden en el corpus.
+    """
+    tokens = []
+    for sentence in sent_tokenize(text):
+        sentence = FAST_OPEN_QUOTES_RE.sub(r"\1 `` ", FAST_QUOTE_RE.sub("' ", sentence))
+        sentence = FAST_COLON_RE.sub(r" \1 \2", FAST_FINAL_PERIOD_RE.sub(r"\1 \2", sentence))
+        for chunk in FAST_SPLIT_RE.split(sentence):
+            match = FAST_WORD_RE.fullmatch(chunk) if chunk else None
+            # [^\W\d_] admite números como "²" o "ⅳ", que no son alfabéticos
+            if match and match.group(1).isalpha():
+                word = match.group(1)
+                if word in FAST_CONTRACTIONS:
+                    tokens.extend(FAST_CONTRACTIONS[word])
+                else:
+                    tokens.append(word)
+    return tokens
+
+def preprocess_text(text: str, fast: bool = False):
     """
     Realiza preprocesamiento: minúsculas, tokenización, stopwords, lematización
     Solo usa NLTK. Devuelve lista de tokens procesados.
+
+    Args:
+        text: Texto a procesar
+        fast: Usa el tokenizador de expresiones regulares en lugar de word_tokenize
     """
     if not text:
         return []
+    return normalize_tokens(tokenize(text, fast))
+
+def tokenize(text: str, fast: bool = False) -> List[str]:
+    """Primera etapa de preprocess_text: minúsculas y tokenización"""
     # Minúsculas
     text = text.lower()
     # Tokenizar
-    tokens = word_tokenize(text)
-    # Eliminar stopwords y tokens no alfabéticos
-    tokens = [t for t in tokens if t.isalpha() and t not in stop_words]
-    # Lematización
-    tokens = [lemmatizer.lemmatize(t) for t in tokens]
-    return tokens
+    return fast_tokenize(text) if fast else word_tokenize(text)
+
+def normalize_tokens(tokens: List[str]) -> List[str]:
+    """Segunda etapa de preprocess_text: stopwords, tokens no alfabéticos y lematización"""
+    # Eliminar stopwords y tokens no alfabéticos + lematización (con caché)
+    normalized = [_normalize_token(t) for t in tokens]
+    return [t for t in normalized if t is not None]
+
+def preprocess_texts(texts: List[str], fast: bool = False) -> List[List[str]]:
+    """
+    Preprocesa un lote de textos (misma salida que preprocess_text): primero
+    se tokenizan todos y después cada token distinto del lote se filtra y
+    lematiza una sola vez.
+    """
+    tokenized = [tokenize(text, fast) if text else [] for text in texts]
+    unique = set(chain.from_iterable(tokenized))
+    lemma = dict(zip(unique, map(_normalize_token, unique))).__getitem__
+    return [[t for t in map(lemma, tokens) if t is not None] for tokens in tokenized]
+
+def lemma_cache_info():
+    """Estadísticas de la caché de lemas (hits, misses, maxsize, currsize)"""
+    return _normalize_token.cache_info()
+
+def verify_fast_tokenizer(texts: List[str], max_examples: int = 10) -> Dict:
+    """
+    Compara el tokenizador rápido con word_tokenize sobre una muestra del corpus.
+
+    Returns:
+        Diccionario con textos comparados, textos distintos y ejemplos
+    """
+    mismatches = []
+    mismatch_count = 0
+    for text in texts:
+        expected = preprocess_text(text)
+        actual = preprocess_text(text, fast=True)
+        if expected != actual:
+            mismatch_count += 1
+            if len(mismatches) < max_examples:
+                mismatches.append({'text': text[:200], 'nltk': expected, 'fast': actual})
+    return {
+        'texts': len(texts),
+        'mismatched_texts': mismatch_count,
+        'identical': mismatch_count == 0,
+        'examples': mismatches,
+    }
+
+def main(argv=None):
+    """Verifica el tokenizador rápido sobre los primeros documentos del dataset"""
+    import argparse
+    parser = argparse.ArgumentParser(description="Verificación del tokenizador rápido")
+    parser.add_argument("--dataset", default="car/v1.5/test200")
+    parser.add_argument("--docs", type=int, default=10000, help="documentos a comparar")
+    parser.add_argument("--file", default=None,
+                        help="compara sobre los párrafos (separados por líneas en blanco) de un texto plano")
+    args = parser.parse_args(argv)
+
+    texts = []
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            texts = [p.strip() for p in re.split(r"\n\s*\n", f.read()) if p.strip()][:args.docs]
+    else:
+        import ir_datasets
+        for doc in ir_datasets.load(args.dataset).docs_iter():
+            if len(texts) >= args.docs:
+                break
+            texts.append(doc.text)
+    report = verify_fast_tokenizer(texts)
+    print(f"Textos comparados: {report['texts']}, distintos: {report['mismatched_texts']}")
+    for example in report['examples']:
+        print(f"- {example['text'][:80]!r}\n  nltk: {example['nltk']}\n  fast: {example['fast']}")
+
+if __name__ == "__main__":
+    main()
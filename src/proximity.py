@@ -0,0 +1,58 @@
+"""
+Consultas de frase y proximidad sobre el índice posicional.
+
+Las posiciones se guardan sobre los tokens ya preprocesados (sin stopwords),
+así que "deep learning" casa también con "deep (the) learning". Las
+posiciones solo se decodifican para los candidatos que sobreviven a la
+primera etapa (intersección de postings para las frases, top de BM25 para
+la proximidad).
+"""
+from itertools import combinations
+from typing import Dict, List
+import numpy as np
+
+# Distancia máxima entre dos términos de la consulta que puntúa como proximidad
+PROXIMITY_WINDOW = 5
+# Candidatos de la primera etapa BM25 que se reordenan por proximidad
+PROXIMITY_CANDIDATES = 100
+
+
+def phrase_frequency(position_lists: List[np.ndarray]) -> int:
+    """Apariciones de la frase: posiciones p con el término i de la frase en p + i"""
+    starts = position_lists[0]
+    for offset, positions in enumerate(position_lists[1:], 1):
+        if len(starts) == 0:
+            break
+        starts = np.intersect1d(starts, positions - offset, assume_unique=True)
+    return len(starts)
+
+
+def pair_proximity(first: np.ndarray, second: np.ndarray, window: int = PROXIMITY_WINDOW) -> float:
+    """Suma de 1/d² sobre los pares de apariciones a distancia d entre 1 y window"""
+    if len(first) == 0 or len(second) == 0:
+        return 0.0
+    distances = np.abs(np.subtract.outer(first, second)).ravel()
+    distances = distances[(distances > 0) & (distances <= window)].astype(np.float64)
+    return float(np.sum(1.0 / (distances * distances)))
+
+
+def bm25tp_boost(positions: Dict[str, List[np.ndarray]], idfs: Dict[str, float],
+                 length_norms: np.ndarray, k1: float, window: int = PROXIMITY_WINDOW) -> np.ndarray:
+    """
+    Componente de proximidad de BM25TP (Rasolofo y Savoy) por candidato: para
+    cada par de términos distintos de la consulta, min(idf) * tpi*(k1+1) / (K + tpi),
+    con tpi la suma de 1/d² de sus apariciones cercanas y K = k1*(1-b+b*dl/avgdl).
+
+    Args:
+        positions: {término: posiciones en cada candidato}
+        idfs: IDF BM25 de cada término
+        length_norms: K de cada candidato
+        k1: Parámetro de saturación
+        window: Distancia máxima entre apariciones
+    """
+    boost = np.zeros(len(length_norms), dtype=np.float64)
+    for first, second in combinations(positions, 2):
+        tpi = np.array([pair_proximity(a, b, window)
+                        for a, b in zip(positions[first], positions[second])], dtype=np.float64)
+        boost += min(idfs[first], idfs[second]) * (tpi * (k1 + 1)) / (length_norms + tpi)
+    return boost
@@ -0,0 +1,237 @@
+"""
+Procesamiento de consultas document-at-a-time con poda dinámica (BlockMax-WAND)
+"""
+import heapq
+import math
+import sys
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .segment import Segment
+
+EXHAUSTED = sys.maxsize
+# Holgura relativa de las cotas frente a diferencias de redondeo al sumar
+BOUND_SLACK = 1 + 1e-9
+
+
+def bm25_bounds(idf: float, max_tf: np.ndarray, min_length: np.ndarray,
+                k1: float, b: float, avg_doc_length: float) -> np.ndarray:
+    """
+    Cota superior de la contribución BM25 por bloque.
+
+    La contribución crece con tf y decrece con la longitud del documento, por lo
+    que evaluarla en (tf máximo, longitud mínima) acota cualquier posting del
+    bloque para cualquier (k1, b). Un idf no positivo nunca suma: cota 0.
+    """
+    if idf <= 0:
+        return np.zeros(len(max_tf), dtype=np.float64)
+    max_tf = np.asarray(max_tf, dtype=np.float64)
+    norm = k1 * (1 - b + b * (np.asarray(min_length, dtype=np.float64) / avg_doc_length))
+    return idf * ((max_tf * (k1 + 1)) / (max_tf + norm))
+
+
+class TermCursor:
+    """Cursor sobre las postings de un término que decodifica bloque a bloque"""
+
+    def __init__(self, segment: Segment, t: int, idf: float, k1: float, b: float,
+                 avg_doc_length: float):
+        self.segment = segment
+        self.t = t
+        self.idf = idf
+        self.first_block = int(segment.block_offsets[t])
+        end_block = int(segment.block_offsets[t + 1])
+        self.block_last = segment.block_last[self.first_block:end_block].tolist()
+        self.block_bounds = bm25_bounds(idf, segment.block_max_tf[self.first_block:end_block],
+                                        segment.block_min_length[self.first_block:end_block],
+                                        k1, b, avg_doc_length).tolist()
+        self.bound = max(self.block_bounds)
+        self.decoded = 0
+        self._load_block(0)
+
+    def _load_block(self, j: int):
+        """Decodifica el bloque local j y sitúa el cursor en su primer posting"""
+        docs, tfs = self.segment.block_postings(self.t, self.first_block + j)
+        self.block = j
+        self.docs = docs.tolist()
+        self.tfs = tfs.tolist()
+        self.decoded += len(self.docs)
+        self.pos = 0
+        self.doc = self.docs[0]
+
+    def _block_of(self, target: int) -> int:
+        """Bloque local que contendría a target (desde el bloque actual)"""
+        return bisect_left(self.block_last, target, self.block)
+
+    @property
+    def tf(self) -> int:
+        return self.tfs[self.pos]
+
+    def next(self):
+        """Avanza al siguiente posting"""
+        self.pos += 1
+        if self.pos < len(self.docs):
+            self.doc = self.docs[self.pos]
+        elif self.block + 1 < len(self.block_last):
+            self._load_block(self.block + 1)
+        else:
+            self.doc = EXHAUSTED
+
+    def next_geq(self, target: int):
+        """Avanza al primer posting con doc >= target, saltando bloques completos"""
+        if target <= self.doc:
+            return
+        if target > self.block_last[self.block]:
+            j = self._block_of(target)
+            if j == len(self.block_last):
+                self.doc = EXHAUSTED
+                return
+            self._load_block(j)
+        self.pos = bisect_left(self.docs, target, self.pos)
+        self.doc = self.docs[self.pos]
+
+    def shallow_bound(self, target: int) -> Tuple[float, int]:
+        """Cota y último doc del bloque que contendría a target, sin decodificarlo"""
+        j = self._block_of(target)
+        if j == len(self.block_last):
+            return 0.0, EXHAUSTED
+        return self.block_bounds[j], self.block_last[j]
+
+
+class WandProcessor:
+    """Top-k BM25 document-at-a-time con BlockMax-WAND y heap acotado"""
+
+    def __init__(self, segment: Segment):
+        self.segment = segment
+        self.postings_scored = 0
+        self.postings_decoded = 0
+
+    def bm25(self, query_terms: List[str], k: int, k1: float, b: float,
+             idfs: Optional[Dict[str, float]] = None, avg_doc_length: Optional[float] = None,
+             deleted: Optional[np.ndarray] = None,
+             weights: Optional[Dict[str, float]] = None,
+             with_first: bool = False) -> List[Tuple]:
+        """
+        BM25 con poda segura: devuelve exactamente el mismo top-k (y el mismo
+        desempate por orden de aparición) que la evaluación exhaustiva.
+
+        Args:
+            idfs: IDF global por término (por defecto, el del propio segmento)
+            avg_doc_length: Longitud media global (por defecto, la del propio segmento)
+            deleted: Máscara de documentos borrados, que nunca entran en el top-k
+            weights: Peso positivo por término que multiplica su contribución
+                (consultas expandidas); por defecto, 1
+            with_first: Añade a cada resultado la posición en query_terms del
+                primer término presente en el documento (la clave de desempate)
+
+        Returns:
+            Lista de (ordinal, score) (o (ordinal, score, posición)) ordenada por relevancia
+        """
+        self.postings_scored = 0
+        self.postings_decoded = 0
+        if k <= 0:
+            return []
+
+        if avg_doc_length is None:
+            avg_doc_length = self.segment.avg_doc_length
+        # Un cursor por término distinto; las repeticiones suman su cota
+        cursors: Dict[str, TermCursor] = {}
+        multiplicity: Dict[str, int] = {}
+        order: List[Tuple[int, str]] = []  # (posición, término) con postings, en orden de consulta
+        for position, term in enumerate(query_terms):
+            t = self.segment.term_id(term)
+            if t < 0:
+                continue
+            order.append((position, term))
+            if term not in cursors:
+                if idfs is not None:
+                    idf = idfs[term]
+                else:
+                    df = int(self.segment.term_dfs[t])
+                    idf = math.log((self.segment.doc_count - df + 0.5) / (df + 0.5))
+                if weights is not None:
+                    idf *= weights[term]
+                cursors[term] = TermCursor(self.segment, t, idf, k1, b, avg_doc_length)
+                multiplicity[term] = 0
+            multiplicity[term] += 1
+        if not cursors:
+            return []
+        for term, cursor in cursors.items():
+            scale = multiplicity[term] * BOUND_SLACK
+            cursor.bound *= scale
+            cursor.block_bounds = [bound * scale for bound in cursor.block_bounds]
+
+        # Heap de (score, -primer término, -doc): la raíz es el peor del top-k
+        heap = []
+        active = list(cursors.values())
+
+        while True:
+            active.sort(key=lambda c: c.doc)
+            full = len(heap) >= k
+            threshold = heap[0][0] if full else -math.inf
+
+            # Pivote: primer cursor cuya suma de cotas alcanza el umbral
+            bound_sum = 0.0
+            pivot = -1
+            for i, cursor in enumerate(active):
+                if cursor.doc == EXHAUSTED:
+                    break
+                bound_sum += cursor.bound
+                if not full or bound_sum >= threshold:
+                    pivot = i
+                    break
+            if pivot < 0:
+                break
+            pivot_doc = active[pivot].doc
+            while pivot + 1 < len(active) and active[pivot + 1].doc == pivot_doc:
+                pivot += 1
+
+            if full:
+                # Cota por bloques (BlockMax): si no alcanza, se salta el rango completo
+                block_sum = 0.0
+                next_doc = active[pivot + 1].doc if pivot + 1 < len(active) else EXHAUSTED
+                for cursor in active[:pivot + 1]:
+                    bound, last = cursor.shallow_bound(pivot_doc)
+                    block_sum += bound
+                    next_doc = min(next_doc, last + 1 if last != EXHAUSTED else EXHAUSTED)
+                if block_sum < threshold:
+                    for cursor in active[:pivot + 1]:
+                        cursor.next_geq(next_doc)
+                    continue
+
+            if active[0].doc == pivot_doc and deleted is not None and deleted[pivot_doc]:
+                for cursor in active:
+                    if cursor.doc == pivot_doc:
+                        cursor.next()
+            elif active[0].doc == pivot_doc:
+                # Evaluación completa, sumando en el orden de la consulta
+                score = 0.0
+                first = -1
+                doc_length = int(self.segment.doc_lengths[pivot_doc])
+                for position, term in order:
+                    cursor = cursors[term]
+                    if cursor.doc != pivot_doc:
+                        continue
+                    if first < 0:
+                        first = position
+                    tf = cursor.tf
+                    numerator = tf * (k1 + 1)
+                    denominator = tf + k1 * (1 - b + b * (doc_length / avg_doc_length))
+                    score += cursor.idf * (numerator / denominator)
+                    self.postings_scored += 1
+                entry = (score, -first, -pivot_doc)
+                if not full:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+                for cursor in active:
+                    if cursor.doc == pivot_doc:
+                        cursor.next()
+            else:
+                for cursor in active[:pivot]:
+                    cursor.next_geq(pivot_doc)
+
+        self.postings_decoded = sum(c.decoded for c in cursors.values())
+        ranked = sorted(heap, reverse=True)
+        if with_first:
+            return [(-neg_doc, score, -neg_first) for score, neg_first, neg_doc in ranked]
+        return [(-neg_doc, score) for score, _, neg_doc in ranked]
@@ -0,0 +1,90 @@
+"""
+Recuperación en dos etapas: BM25 con poda (WAND) genera los N mejores
+candidatos y una segunda etapa los vuelve a puntuar con otros modelos sobre
+rasgos densos por candidato (matriz de tfs candidatos x términos, longitudes
+y normas). La segunda etapa solo lee los bloques de postings que contienen a
+los candidatos, así que su coste depende de N y no del tamaño de la colección.
+"""
+import math
+from collections import Counter
+from typing import List, Sequence
+import numpy as np
+
+# Constante de Reciprocal Rank Fusion (Cormack et al., 2009)
+RRF_K = 60
+# Modelos de la segunda etapa
+RERANKERS = ("tfidf", "rrf", "combsum")
+
+
+class CandidateFeatures:
+    """Rasgos densos de los candidatos para los términos de una consulta"""
+
+    def __init__(self, segment, query_terms: List[str], docs: Sequence[int]):
+        """
+        Args:
+            segment: Segment o SegmentSet abierto
+            query_terms: Términos preprocesados de la consulta (con repeticiones)
+            docs: Ordinales de los candidatos
+        """
+        counts = Counter(query_terms)
+        self.terms = list(counts)
+        self.counts = np.array([counts[term] for term in self.terms], dtype=np.float64)
+        self.dfs = np.array([segment.df(term) for term in self.terms], dtype=np.float64)
+        self.docs = np.asarray(docs, dtype=np.int64)
+        # tfs[i, j]: frecuencia del término j en el candidato i
+        self.tfs = np.zeros((len(self.docs), len(self.terms)), dtype=np.float64)
+        for j, term in enumerate(self.terms):
+            self.tfs[:, j] = segment.term_frequencies(term, self.docs)
+        self.lengths = np.asarray(segment.doc_lengths[self.docs], dtype=np.float64)
+        self.norms = np.asarray(segment.doc_norms[self.docs], dtype=np.float64)
+
+    def bm25(self, doc_count: int, avg_doc_length: float, k1: float, b: float) -> np.ndarray:
+        """Score BM25 de cada candidato (cada repetición de un término suma su componente)"""
+        present = self.dfs > 0
+        idfs = np.zeros(len(self.terms))
+        idfs[present] = np.log((doc_count - self.dfs[present] + 0.5) / (self.dfs[present] + 0.5))
+        norms = k1 * (1 - b + b * (self.lengths / avg_doc_length))
+        components = (self.tfs * (k1 + 1)) / (self.tfs + norms[:, None])
+        return components @ (idfs * self.counts)
+
+    def tfidf(self, doc_count: int) -> np.ndarray:
+        """Similitud coseno TF-IDF de cada candidato con la norma completa del documento"""
+        present = self.dfs > 0
+        idfs = np.zeros(len(self.terms))
+        idfs[present] = np.log(doc_count / self.dfs[present])
+        query_vector = self.counts * idfs
+        query_norm = math.sqrt(float(np.sum(query_vector * query_vector)))
+        # Igual que el motor exhaustivo: cada aparición del término en la consulta suma tf * peso
+        scores = self.tfs @ (self.counts * query_vector * idfs)
+        nonzero = (self.norms > 0) & (query_norm > 0)
+        scores[nonzero] /= self.norms[nonzero] * query_norm
+        return scores
+
+
+def ranks(scores: np.ndarray) -> np.ndarray:
+    """Posición (0 = mejor) de cada candidato; los empates conservan el orden de entrada"""
+    order = np.lexsort((np.arange(len(scores)), -scores))
+    positions = np.empty(len(scores), dtype=np.int64)
+    positions[order] = np.arange(len(scores))
+    return positions
+
+
+def rrf(score_lists: List[np.ndarray], k: int = RRF_K) -> np.ndarray:
+    """Reciprocal Rank Fusion: suma de 1 / (k + posición) en cada ranking"""
+    return sum(1.0 / (k + 1 + ranks(scores)) for scores in score_lists)
+
+
+def combsum(score_lists: List[np.ndarray]) -> np.ndarray:
+    """CombSUM: suma de los scores normalizados min-max de cada modelo"""
+    fused = np.zeros(len(score_lists[0]), dtype=np.float64)
+    for scores in score_lists:
+        low, high = float(scores.min()), float(scores.max())
+        if high > low:
+            fused += (scores - low) / (high - low)
+    return fused
+
+
+def top_k(docs: np.ndarray, scores: np.ndarray, k: int):
+    """(ordinal, score) de los k mejores; los empates conservan el orden de la primera etapa"""
+    order = np.lexsort((np.arange(len(scores)), -scores))[:k]
+    return list(zip(docs[order].tolist(), scores[order].tolist()))
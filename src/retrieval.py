@@ -4,33 +4,91 @@ Modelos de recuperación de información: TF-IDF y BM25
 import math
 from typing import List, Tuple, Dict
 from collections import defaultdict
-from .utils import load_index
+import numpy as np
+from .segment import SegmentTexts
+from .segment_set import SegmentSet, SegmentSetWand, open_index, read_manifest
+from .scoring import VectorizedScorer, accumulate_scores, top_k as vector_top_k
+from .pruning import WandProcessor
+from .proximity import PROXIMITY_CANDIDATES, bm25tp_boost, phrase_frequency
+from .rerank import RERANKERS, CandidateFeatures, combsum, rrf, top_k
+from .boolean import BOOLEAN_MODES, BooleanMatcher, conjunction, parse_query, positive_terms
+from .impact import BUDGET_FRACTION, ImpactProcessor
+from .feedback import FB_DOCS, FB_TERMS, ORIGINAL_QUERY_WEIGHT, relevance_model, rm3_weights
+from .cache import LRUCache
+from .instrumentation import make_metrics
 from .preprocesamiento import preprocess_text 
+from .sharding import ShardedRetrievalSystem, is_sharded
+
+# Consultas distintas por bloque de search_batch (acota la matriz consultas x candidatos)
+BATCH_QUERIES = 256
 
 class RetrievalSystem:
     """Sistema de recuperación con TF-IDF y BM25"""
 
-    def __init__(self, index_path: str = "data/index.pkl"):
+    BACKENDS = ("python", "numpy")
+    STRATEGIES = ("exhaustive", "wand")
+    MODELS = ("tfidf", "bm25")
+
+    def __init__(self, index_path: str = "data/index", backend: str = "python",
+                 cache_size: int = 1024, cache_ttl: float = None, instrument: bool = False):
         """
         Inicializa el sistema de recuperación
 
         Args:
-            index_path: Ruta al archivo del índice
+            index_path: Ruta al directorio del índice
+            backend: Motor de scoring: "python" (bucle por posting) o "numpy" (vectorizado;
+                acumula en float32, así que documentos con scores casi empatados
+                pueden ordenarse distinto que con "python")
+            cache_size: Entradas máximas de las cachés de consultas (0 = sin caché)
+            cache_ttl: Segundos de vida de cada entrada en caché (None = sin expiración)
+            instrument: Acumula tiempos por etapa y contadores en self.metrics
         """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Backend desconocido: {backend}. Opciones: {', '.join(self.BACKENDS)}")
+        self.backend = backend
+        self.metrics = make_metrics(instrument)
+        # Caché de términos preprocesados por texto de consulta y de resultados por
+        # (modelo, términos, parámetros); ambas se vacían al cargar otro índice
+        self.terms_cache = LRUCache(cache_size, cache_ttl)
+        self.result_cache = LRUCache(cache_size, cache_ttl)
+        self.index_version = 0
         self._load_index(index_path)
 
     def _load_index(self, index_path: str):
-        """Carga el índice desde disco"""
+        """Abre el índice con mmap (un segmento o varios, si es incremental)"""
         try:
-            index_data = load_index(index_path)
-            self.inverted_index = index_data['inverted_index']
-            self.doc_lengths = index_data['doc_lengths']
-            self.doc_count = index_data['doc_count']
-            self.avg_doc_length = index_data['avg_doc_length']
-            self.doc_texts = index_data.get('doc_texts', {})
-            print(f"Índice cargado: {self.doc_count} documentos, {len(self.inverted_index)} términos")
+            self.segment = open_index(index_path)
         except FileNotFoundError:
             raise FileNotFoundError(f"No se encontró el índice en {index_path}. Ejecuta primero indexer.py")
+        self.index_path = index_path
+        self.doc_lengths = self.segment.doc_lengths
+        self.doc_norms = self.segment.doc_norms
+        self.doc_count = self.segment.doc_count
+        self.avg_doc_length = self.segment.avg_doc_length
+        self.doc_texts = SegmentTexts(self.segment)
+        self.scorer = VectorizedScorer(self.segment) if self.backend == "numpy" else None
+        if isinstance(self.segment, SegmentSet):
+            self.wand = SegmentSetWand(self.segment)
+        else:
+            self.wand = WandProcessor(self.segment)
+        # Búsqueda score-at-a-time solo si el segmento trae el tier por impacto
+        self.impact = ImpactProcessor(self.segment) if getattr(self.segment, 'has_impacts', False) else None
+        self.index_version += 1
+        self.terms_cache.clear()
+        self.result_cache.clear()
+        print(f"Índice cargado: {self.doc_count} documentos, {self.segment.term_count} términos")
+
+    def refresh(self) -> bool:
+        """
+        Reabre el índice si un escritor incremental publicó una generación
+        nueva; devuelve True si se recargó.
+        """
+        manifest = read_manifest(self.index_path)
+        generation = manifest['generation'] if manifest is not None else None
+        if generation == getattr(self.segment, 'generation', None):
+            return False
+        self._load_index(self.index_path)
+        return True
 
     def tfidf_search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
         """
@@ -43,46 +101,69 @@ class RetrievalSystem:
         Returns:
             Lista de (doc_id, score) ordenada por relevancia
         """
-        query_terms = preprocess_text(query)  # ¡Aquí usamos lematización!
+        query_terms = self.query_terms(query)
         if not query_terms:
             return []
+        return self._cached(('tfidf', tuple(query_terms), k),
+                            lambda: self._tfidf_search(query_terms, k))
+
+    def _tfidf_search(self, query_terms: List[str], k: int) -> List[Tuple[str, float]]:
+        """TF-IDF sobre términos ya preprocesados (sin caché)"""
+        # df y postings de cada término se decodifican una sola vez
+        with self.segment.shared_postings():
+            return self._tfidf_scores(query_terms, k)
 
+    def _tfidf_scores(self, query_terms: List[str], k: int) -> List[Tuple[str, float]]:
+        """Vector de consulta, similitud coseno y top-k"""
+        metrics = self.metrics
         # Calcular vector de consulta
-        query_vector = self._calculate_query_tfidf_vector(query_terms)
+        with metrics.timer('tfidf.query_vector'):
+            query_vector = self._calculate_query_tfidf_vector(query_terms)
+        metrics.count('terms_looked_up', len(query_terms))
+
+        if self.scorer is not None:
+            with metrics.timer('tfidf.score'):
+                ranked = self.scorer.tfidf(query_vector, query_terms, k)
+            self._count_postings(query_terms)
+            return self._to_doc_ids(ranked)
 
         # Calcular scores para todos los documentos candidatos
         doc_scores = defaultdict(float)
-        doc_norms = defaultdict(float)
 
-        for term in query_terms:
-            if term not in self.inverted_index:
-                continue
-
-            # IDF del término
-            df = len(self.inverted_index[term])
-            idf = math.log(self.doc_count / df)
+        with metrics.timer('tfidf.postings'):
+            for term in query_terms:
+                docs, tfs = self.segment.postings(term)
+                df = len(docs)
+                if df == 0:
+                    continue
+                metrics.count('postings_visited', df)
 
-            for doc_id, tf in self.inverted_index[term]:
-                # TF-IDF del documento
-                tfidf_doc = tf * idf
+                # IDF del término y peso en la consulta
+                idf = math.log(self.doc_count / df)
+                weight = query_vector[term] * idf
 
-                # Producto punto para similitud coseno
-                doc_scores[doc_id] += query_vector[term] * tfidf_doc
-                doc_norms[doc_id] += tfidf_doc ** 2
+                for doc_id, tf in zip(docs.tolist(), tfs.tolist()):
+                    # Producto punto para similitud coseno
+                    doc_scores[doc_id] += weight * tf
+        metrics.count('candidates', len(doc_scores))
 
-        # Normalizar scores (similitud coseno)
-        query_norm = math.sqrt(sum(score ** 2 for score in query_vector.values()))
+        with metrics.timer('tfidf.normalize'):
+            # Normalizar scores (similitud coseno) con la norma completa precalculada
+            query_norm = math.sqrt(sum(score ** 2 for score in query_vector.values()))
 
-        for doc_id in doc_scores:
-            doc_norm = math.sqrt(doc_norms[doc_id])
-            if doc_norm > 0 and query_norm > 0:
-                doc_scores[doc_id] = doc_scores[doc_id] / (doc_norm * query_norm)
+            candidates = list(doc_scores)
+            doc_norms = self.doc_norms[candidates].tolist() if candidates else []
+            for doc_id, doc_norm in zip(candidates, doc_norms):
+                if doc_norm > 0 and query_norm > 0:
+                    doc_scores[doc_id] = doc_scores[doc_id] / (doc_norm * query_norm)
 
         # Ordenar y retornar top-k
-        ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked_docs[:k]
+        with metrics.timer('tfidf.sort'):
+            ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
+        return self._to_doc_ids(ranked_docs[:k])
 
-    def bm25_search(self, query: str, k: int = 10, k1: float = 1.5, b: float = 0.75) -> List[Tuple[str, float]]:
+    def bm25_search(self, query: str, k: int = 10, k1: float = 1.5, b: float = 0.75,
+                    strategy: str = "exhaustive", proximity: bool = False) -> List[Tuple[str, float]]:
         """
         Búsqueda usando BM25
 
@@ -91,39 +172,476 @@ class RetrievalSystem:
             k: Número de documentos a retornar
             k1: Parámetro de saturación de término
             b: Parámetro de normalización de longitud
+            strategy: "exhaustive" puntúa todas las postings; "wand" usa
+                BlockMax-WAND y devuelve el mismo top-k tocando menos postings
+            proximity: Reordena los mejores candidatos con el componente de
+                proximidad de BM25TP (requiere un índice con posiciones)
 
         Returns:
             Lista de (doc_id, score) ordenada por relevancia
         """
-        query_terms = preprocess_text(query)  # ¡Aquí usamos lematización!
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Estrategia desconocida: {strategy}. Opciones: {', '.join(self.STRATEGIES)}")
+        query_terms = self.query_terms(query)
         if not query_terms:
             return []
+        if proximity:
+            self._require_positions()
+        return self._cached(('bm25', tuple(query_terms), k, k1, b, strategy, proximity),
+                            lambda: self._bm25_search(query_terms, k, k1, b, strategy, proximity))
 
-        doc_scores = defaultdict(float)
+    def _bm25_search(self, query_terms: List[str], k: int, k1: float, b: float,
+                     strategy: str, proximity: bool = False) -> List[Tuple[str, float]]:
+        """BM25 sobre términos ya preprocesados (sin caché)"""
+        if not proximity:
+            return self._to_doc_ids(self._bm25_ranked(query_terms, k, k1, b, strategy))
+        # Primera etapa por términos; las posiciones solo se leen para sus candidatos
+        ranked = self._bm25_ranked(query_terms, max(k, PROXIMITY_CANDIDATES), k1, b, strategy)
+        return self._to_doc_ids(self._proximity_rerank(query_terms, ranked, k, k1, b))
 
-        for term in query_terms:
-            if term not in self.inverted_index:
-                continue
+    def _bm25_ranked(self, query_terms: List[str], k: int, k1: float, b: float,
+                     strategy: str) -> List[Tuple[int, float]]:
+        """Top-k BM25 con ordinales internos"""
+        metrics = self.metrics
+        metrics.count('terms_looked_up', len(query_terms))
+        if strategy == "wand":
+            with metrics.timer('bm25.wand'):
+                ranked = self.wand.bm25(query_terms, k, k1, b)
+            metrics.count('postings_visited', self.wand.postings_scored)
+            metrics.count('postings_decoded', self.wand.postings_decoded)
+            return ranked
+        if self.scorer is not None:
+            with metrics.timer('bm25.score'):
+                ranked = self.scorer.bm25(query_terms, k, k1, b)
+            self._count_postings(query_terms)
+            return ranked
+
+        doc_scores = defaultdict(float)
 
-            # IDF del término
-            df = len(self.inverted_index[term])
-            idf = math.log((self.doc_count - df + 0.5) / (df + 0.5))
+        with metrics.timer('bm25.postings'):
+            for term in query_terms:
+                docs, tfs = self.segment.postings(term)
+                df = len(docs)
+                if df == 0:
+                    continue
+                metrics.count('postings_visited', df)
 
-            for doc_id, tf in self.inverted_index[term]:
-                # Longitud del documento
-                doc_length = self.doc_lengths.get(doc_id, 0)
+                # IDF del término
+                idf = math.log((self.doc_count - df + 0.5) / (df + 0.5))
 
-                # BM25 score
-                numerator = tf * (k1 + 1)
-                denominator = tf + k1 * (1 - b + b * (doc_length / self.avg_doc_length))
+                lengths = self.doc_lengths[docs]
+                for doc_id, tf, doc_length in zip(docs.tolist(), tfs.tolist(), lengths.tolist()):
+                    # BM25 score
+                    numerator = tf * (k1 + 1)
+                    denominator = tf + k1 * (1 - b + b * (doc_length / self.avg_doc_length))
 
-                bm25_component = idf * (numerator / denominator)
-                doc_scores[doc_id] += bm25_component
+                    bm25_component = idf * (numerator / denominator)
+                    doc_scores[doc_id] += bm25_component
+        metrics.count('candidates', len(doc_scores))
 
         # Ordenar y retornar top-k
-        ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
+        with metrics.timer('bm25.sort'):
+            ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
         return ranked_docs[:k]
 
+    def _bm25_idf(self, term: str) -> float:
+        df = self.segment.df(term)
+        return math.log((self.doc_count - df + 0.5) / (df + 0.5))
+
+    def _proximity_rerank(self, query_terms: List[str], ranked: List[Tuple[int, float]],
+                          k: int, k1: float, b: float) -> List[Tuple[int, float]]:
+        """Suma a cada candidato el componente de proximidad de BM25TP y reordena"""
+        terms = list(dict.fromkeys(query_terms))
+        if len(terms) < 2 or not ranked:
+            return ranked[:k]
+        with self.metrics.timer('bm25.proximity'):
+            docs = np.array([doc for doc, _ in ranked], dtype=np.int64)
+            positions = {term: self.segment.positions(term, docs) for term in terms}
+            lengths = np.asarray(self.doc_lengths[docs], dtype=np.float64)
+            length_norms = k1 * (1 - b + b * (lengths / self.avg_doc_length))
+            boost = bm25tp_boost(positions, {term: self._bm25_idf(term) for term in terms}, length_norms, k1)
+            scores = [score + extra for (_, score), extra in zip(ranked, boost.tolist())]
+        self.metrics.count('proximity_candidates', len(docs))
+        # sorted es estable: a igual score se conserva el orden de la primera etapa
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+        return [(int(docs[i]), scores[i]) for i in order]
+
+    def phrase_search(self, query: str, k: int = 10, k1: float = 1.5, b: float = 0.75) -> List[Tuple[str, float]]:
+        """
+        Búsqueda de la consulta como frase exacta (términos consecutivos tras el
+        preprocesamiento). Los documentos que la contienen se puntúan con BM25
+        tratando la frase como un término con su propia frecuencia y df.
+
+        Returns:
+            Lista de (doc_id, score) ordenada por relevancia
+        """
+        self._require_positions()
+        query_terms = self.query_terms(query)
+        if not query_terms:
+            return []
+        return self._cached(('phrase', tuple(query_terms), k, k1, b),
+                            lambda: self._phrase_search(query_terms, k, k1, b))
+
+    def _phrase_search(self, query_terms: List[str], k: int, k1: float, b: float) -> List[Tuple[str, float]]:
+        """Frase sobre términos ya preprocesados (sin caché)"""
+        metrics = self.metrics
+        terms = list(dict.fromkeys(query_terms))
+        # Primera etapa: documentos que contienen todos los términos
+        with metrics.timer('phrase.intersect'), self.segment.shared_postings():
+            candidates = None
+            for term in sorted(terms, key=self.segment.df):
+                docs, _ = self.segment.postings(term)
+                candidates = docs if candidates is None else \
+                    np.intersect1d(candidates, docs, assume_unique=True)
+                if len(candidates) == 0:
+                    return []
+        metrics.count('candidates', len(candidates))
+
+        # Segunda etapa: posiciones solo de los candidatos
+        with metrics.timer('phrase.positions'):
+            positions = {term: self.segment.positions(term, candidates) for term in terms}
+            tfs = np.array([phrase_frequency([positions[term][i] for term in query_terms])
+                            for i in range(len(candidates))], dtype=np.int64)
+        matched = tfs > 0
+        docs, tfs = candidates[matched], tfs[matched].astype(np.float64)
+        if len(docs) == 0:
+            return []
+
+        df = len(docs)
+        idf = math.log((self.doc_count - df + 0.5) / (df + 0.5))
+        lengths = np.asarray(self.doc_lengths[docs], dtype=np.float64)
+        scores = idf * (tfs * (k1 + 1)) / (tfs + k1 * (1 - b + b * (lengths / self.avg_doc_length)))
+        ranked_docs = sorted(zip(docs.tolist(), scores.tolist()), key=lambda x: x[1], reverse=True)
+        return self._to_doc_ids(ranked_docs[:k])
+
+    def rerank_search(self, query: str, k: int = 10, candidates: int = 1000, reranker: str = "rrf",
+                      k1: float = 1.5, b: float = 0.75) -> List[Tuple[str, float]]:
+        """
+        Búsqueda en dos etapas: BM25 con WAND selecciona los `candidates`
+        mejores documentos y la segunda etapa los reordena.
+
+        Args:
+            query: Consulta de texto
+            k: Número de documentos a retornar
+            candidates: Candidatos de la primera etapa (N)
+            reranker: "tfidf" (coseno TF-IDF sobre los candidatos), "rrf"
+                (Reciprocal Rank Fusion de BM25 y TF-IDF) o "combsum" (suma de
+                scores normalizados de BM25 y TF-IDF)
+            k1: Parámetro de saturación de término
+            b: Parámetro de normalización de longitud
+
+        Returns:
+            Lista de (doc_id, score) ordenada por relevancia
+        """
+        if reranker not in RERANKERS:
+            raise ValueError(f"Re-ranking desconocido: {reranker}. Opciones: {', '.join(RERANKERS)}")
+        query_terms = self.query_terms(query)
+        if not query_terms:
+            return []
+        return self._cached(('rerank', tuple(query_terms), k, candidates, reranker, k1, b),
+                            lambda: self._rerank_search(query_terms, k, candidates, reranker, k1, b))
+
+    def _rerank_search(self, query_terms: List[str], k: int, candidates: int, reranker: str,
+                       k1: float, b: float) -> List[Tuple[str, float]]:
+        """Dos etapas sobre términos ya preprocesados (sin caché)"""
+        metrics = self.metrics
+        with metrics.timer('rerank.first_stage'):
+            first = self.wand.bm25(query_terms, candidates, k1, b)
+        if not first:
+            return []
+        docs = np.array([doc for doc, _ in first], dtype=np.int64)
+        bm25_scores = np.array([score for _, score in first], dtype=np.float64)
+        metrics.count('candidates', len(docs))
+
+        with metrics.timer('rerank.features'):
+            features = CandidateFeatures(self.segment, query_terms, docs)
+        with metrics.timer('rerank.second_stage'):
+            tfidf_scores = features.tfidf(self.doc_count)
+            if reranker == "tfidf":
+                scores = tfidf_scores
+            elif reranker == "rrf":
+                scores = rrf([bm25_scores, tfidf_scores])
+            else:
+                scores = combsum([bm25_scores, tfidf_scores])
+            ranked = top_k(docs, scores, k)
+        return self._to_doc_ids(ranked)
+
+    def rm3_search(self, query: str, k: int = 10, fb_docs: int = FB_DOCS, fb_terms: int = FB_TERMS,
+                   original_weight: float = ORIGINAL_QUERY_WEIGHT, k1: float = 1.5,
+                   b: float = 0.75) -> List[Tuple[str, float]]:
+        """
+        BM25 con expansión de la consulta por pseudo-relevancia (RM3). Requiere
+        un índice con índice directo (python -m src.indexer --term-vectors).
+
+        Args:
+            query: Consulta de texto
+            k: Número de documentos a retornar
+            fb_docs: Documentos de la primera búsqueda que se toman como relevantes
+            fb_terms: Términos de expansión
+            original_weight: Peso de la consulta original en la interpolación (λ)
+            k1: Parámetro de saturación de término
+            b: Parámetro de normalización de longitud
+
+        Returns:
+            Lista de (doc_id, score) ordenada por relevancia
+        """
+        if not getattr(self.segment, 'has_term_vectors', False):
+            raise ValueError("El índice no guarda índice directo: constrúyelo con "
+                             "python -m src.indexer --term-vectors")
+        query_terms = self.query_terms(query)
+        if not query_terms:
+            return []
+        return self._cached(('rm3', tuple(query_terms), k, fb_docs, fb_terms, original_weight, k1, b),
+                            lambda: self._rm3_search(query_terms, k, fb_docs, fb_terms, original_weight, k1, b))
+
+    def _rm3_search(self, query_terms: List[str], k: int, fb_docs: int, fb_terms: int,
+                    original_weight: float, k1: float, b: float) -> List[Tuple[str, float]]:
+        """RM3 sobre términos ya preprocesados (sin caché)"""
+        metrics = self.metrics
+        with metrics.timer('rm3.first_stage'):
+            first = self.wand.bm25(query_terms, fb_docs, k1, b)
+        if not first:
+            return []
+        docs = np.array([doc for doc, _ in first], dtype=np.int64)
+        scores = np.array([score for _, score in first], dtype=np.float64)
+
+        # Modelo de relevancia desde el índice directo de los documentos de realimentación
+        with metrics.timer('rm3.feedback'):
+            rows, terms, tfs = self.segment.term_vectors(docs)
+            feedback = relevance_model(rows, terms, tfs, scores, self.doc_lengths[docs], fb_terms)
+            weights = rm3_weights(query_terms, feedback, original_weight)
+        metrics.count('expansion_terms', len(weights))
+
+        with metrics.timer('rm3.second_stage'):
+            ranked = self.wand.bm25(list(weights), k, k1, b, weights=weights)
+        metrics.count('postings_visited', self.wand.postings_scored)
+        return self._to_doc_ids(ranked)
+
+    def boolean_search(self, query: str, k: int = 10, mode: str = "boolean", k1: float = 1.5,
+                       b: float = 0.75) -> List[Tuple[str, float]]:
+        """
+        Búsqueda booleana puntuada con BM25. Solo se puntúan los documentos que
+        cumplen la consulta, que se obtienen intersecando las postings desde el
+        término más raro por la tabla de saltos (ver boolean.BooleanMatcher).
+
+        Args:
+            query: Consulta de texto
+            k: Número de documentos a retornar
+            mode: "boolean" (operadores AND, OR y NOT en mayúsculas y paréntesis;
+                las palabras sin operador se unen con AND), "and" (documentos con
+                todos los términos) o "fallback" (los de "and" primero y, si no
+                llegan a k, se completa con BM25 disyuntivo)
+            k1: Parámetro de saturación de término
+            b: Parámetro de normalización de longitud
+
+        Returns:
+            Lista de (doc_id, score) ordenada por relevancia; en los modos "and"
+            y "fallback" los documentos conjuntivos tienen el mismo score y orden
+            que en bm25_search
+        """
+        if mode not in BOOLEAN_MODES:
+            raise ValueError(f"Modo desconocido: {mode}. Opciones: {', '.join(BOOLEAN_MODES)}")
+        if mode == "boolean":
+            tree = parse_query(query, self.query_terms)
+            query_terms = positive_terms(tree)
+        else:
+            query_terms = self.query_terms(query)
+            tree = conjunction(query_terms)
+        if tree is None:
+            return []
+        if not query_terms:
+            raise ValueError("NOT necesita un término positivo con el que combinarse (p. ej. 'a NOT b')")
+        return self._cached(('boolean', tree, k, mode, k1, b),
+                            lambda: self._boolean_search(tree, query_terms, k, mode, k1, b))
+
+    def _boolean_search(self, tree: tuple, query_terms: List[str], k: int, mode: str,
+                        k1: float, b: float) -> List[Tuple[str, float]]:
+        """Búsqueda booleana sobre el árbol ya analizado (sin caché)"""
+        metrics = self.metrics
+        matcher = BooleanMatcher(self.segment)
+        with self.segment.shared_postings():
+            with metrics.timer('boolean.match'):
+                docs = matcher.match(tree)
+            metrics.count('boolean_matches', len(docs))
+            with metrics.timer('boolean.score'):
+                docs, scores = matcher.bm25(query_terms, docs, self.doc_count, self.avg_doc_length, k1, b)
+                ranked = vector_top_k(scores, docs, k)
+        if mode == "fallback" and len(ranked) < k:
+            # Se completa con el top-k disyuntivo sin repetir los documentos conjuntivos
+            with metrics.timer('boolean.fallback'):
+                matched = {doc for doc, _ in ranked}
+                disjunctive = self.wand.bm25(query_terms, k, k1, b)
+                ranked += [(doc, score) for doc, score in disjunctive if doc not in matched][:k - len(ranked)]
+            metrics.count('boolean_fallbacks')
+        return self._to_doc_ids(ranked)
+
+    def impact_search(self, query: str, k: int = 10, budget: float = BUDGET_FRACTION,
+                      prune_ratio: float = None) -> List[Tuple[str, float]]:
+        """
+        Búsqueda BM25 score-at-a-time sobre el tier ordenado por impacto: los
+        grupos de postings se procesan de mayor a menor impacto cuantizado y la
+        búsqueda termina al agotar el presupuesto (ver impact.ImpactProcessor).
+
+        Args:
+            query: Consulta de texto
+            k: Número de documentos a retornar
+            budget: Postings procesadas como fracción de los documentos de la
+                colección (None = todo el tier)
+            prune_ratio: Poda estática más agresiva que la del tier guardado
+
+        Returns:
+            Lista de (doc_id, score) ordenada por relevancia, con scores BM25
+            aproximados (impactos cuantizados con k1 y b fijados al indexar)
+        """
+        self._require_impacts()
+        query_terms = self.query_terms(query)
+        if not query_terms:
+            return []
+        return self._cached(('impact', tuple(query_terms), k, budget, prune_ratio),
+                            lambda: self._impact_search(query_terms, k, budget, prune_ratio))
+
+    def _impact_search(self, query_terms: List[str], k: int, budget: float,
+                       prune_ratio: float) -> List[Tuple[str, float]]:
+        """Búsqueda score-at-a-time sobre términos ya preprocesados (sin caché)"""
+        with self.metrics.timer('impact.search'):
+            ranked = self.impact.search(query_terms, k, budget, prune_ratio)
+        self.metrics.count('postings_visited', self.impact.postings_scored)
+        return self._to_doc_ids(ranked)
+
+    def search_batch(self, queries: List[str], model: str = "bm25", k: int = 10, k1: float = 1.5,
+                     b: float = 0.75) -> List[List[Tuple[str, float]]]:
+        """
+        Búsqueda exhaustiva de un lote de consultas. Las consultas se agrupan por
+        término: cada lista de postings se decodifica y puntúa una sola vez por
+        bloque de BATCH_QUERIES consultas, las contribuciones se suman en una
+        matriz dispersa consultas x candidatos y el top-k de cada consulta se
+        extrae con argpartition. Las consultas repetidas se puntúan una vez.
+
+        Los scores se calculan en float64 y coinciden con los de tfidf_search y
+        bm25_search (estrategia exhaustiva) del backend "python".
+
+        Args:
+            queries: Consultas de texto
+            model: "tfidf" o "bm25"
+            k: Número de documentos a retornar por consulta
+            k1, b: Parámetros de BM25
+
+        Returns:
+            Lista de (doc_id, score) de cada consulta, en el orden de `queries`
+        """
+        if model not in self.MODELS:
+            raise ValueError(f"Modelo desconocido: {model}. Opciones: {', '.join(self.MODELS)}")
+        term_lists = [tuple(self.query_terms(query)) for query in queries]
+        unique = list(dict.fromkeys(terms for terms in term_lists if terms))
+        self.metrics.count('batch_queries', len(queries))
+        ranked = {}
+        for start in range(0, len(unique), BATCH_QUERIES):
+            block = unique[start:start + BATCH_QUERIES]
+            with self.segment.shared_postings():
+                ranked.update(zip(block, self._score_batch(block, model, k, k1, b)))
+        return [self._to_doc_ids(ranked[terms]) if terms else [] for terms in term_lists]
+
+    def _score_batch(self, block: List[Tuple[str, ...]], model: str, k: int, k1: float,
+                     b: float) -> List[List[Tuple[int, float]]]:
+        """Top-k (ordinales) de un bloque de consultas preprocesadas distintas"""
+        metrics = self.metrics
+        # Contribuciones de cada término (con TF-IDF, de cada par término-peso)
+        # calculadas una vez para todo el bloque
+        contributions = {}
+        query_norms = np.zeros(len(block), dtype=np.float64)
+        query_ids, doc_parts, score_parts = [], [], []
+        with metrics.timer('batch.postings'):
+            for q, terms in enumerate(block):
+                if model == "tfidf":
+                    query_vector = self._calculate_query_tfidf_vector(list(terms))
+                    query_norms[q] = math.sqrt(sum(score ** 2 for score in query_vector.values()))
+                for term in terms:
+                    key = term if model == "bm25" else (term, query_vector[term])
+                    if key not in contributions:
+                        contributions[key] = self._term_contributions(term, model, key, k1, b)
+                    docs, scores = contributions[key]
+                    if len(docs):
+                        query_ids.append(np.full(len(docs), q, dtype=np.int64))
+                        doc_parts.append(docs)
+                        score_parts.append(scores)
+        metrics.count('postings_decoded', sum(len(docs) for docs, _ in contributions.values()))
+        if not query_ids:
+            return [[] for _ in block]
+
+        with metrics.timer('batch.accumulate'):
+            rows, candidates, scores = accumulate_scores(np.concatenate(query_ids), np.concatenate(doc_parts),
+                                                         np.concatenate(score_parts), len(self.doc_lengths))
+            if model == "tfidf":
+                # Similitud coseno con la norma completa del documento
+                doc_norms = self.doc_norms[candidates].astype(np.float64)
+                norms = doc_norms * query_norms[rows]
+                nonzero = (doc_norms > 0) & (query_norms[rows] > 0)
+                scores[nonzero] = scores[nonzero] / norms[nonzero]
+        metrics.count('candidates', len(candidates))
+
+        with metrics.timer('batch.top_k'):
+            bounds = np.searchsorted(rows, np.arange(len(block) + 1))
+            return [vector_top_k(scores[start:end], candidates[start:end], k)
+                    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+    def _term_contributions(self, term: str, model: str, key, k1: float,
+                            b: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(docs, contribución al score) de cada posting del término"""
+        docs, tfs = self.segment.postings(term)
+        if len(docs) == 0:
+            return docs, np.zeros(0, dtype=np.float64)
+        tfs = tfs.astype(np.float64)
+        df = len(docs)
+        if model == "tfidf":
+            # Mismo orden de operaciones que el motor en Python: (peso * idf) * tf
+            return docs, (key[1] * math.log(self.doc_count / df)) * tfs
+        idf = math.log((self.doc_count - df + 0.5) / (df + 0.5))
+        lengths = np.asarray(self.doc_lengths[docs], dtype=np.float64)
+        return docs, idf * ((tfs * (k1 + 1)) / (tfs + k1 * (1 - b + b * (lengths / self.avg_doc_length))))
+
+    def _require_positions(self) -> None:
+        if not getattr(self.segment, 'has_positions', False):
+            raise ValueError("El índice no guarda posiciones: constrúyelo con python -m src.indexer --positions")
+
+    def _require_impacts(self) -> None:
+        if self.impact is None:
+            raise ValueError("El índice no tiene tier por impacto: constrúyelo con "
+                             "python -m src.indexer --impact-tier RATIO o python -m src.segment impact")
+
+    def _count_postings(self, query_terms: List[str]) -> None:
+        """Postings recorridas por el motor vectorizado (solo con instrumentación)"""
+        if self.metrics.enabled:
+            self.metrics.count('postings_visited', sum(self.segment.df(term) for term in query_terms))
+
+    def query_terms(self, query: str) -> List[str]:
+        """Preprocesa la consulta una sola vez; TF-IDF y BM25 comparten el resultado"""
+        terms = self.terms_cache.get(query)
+        if terms is None:
+            self.metrics.count('terms_cache_misses')
+            with self.metrics.timer('preprocess'):
+                # ¡Aquí usamos lematización! Con el mismo tokenizador que el índice
+                terms = preprocess_text(query, self.segment.fast_tokenizer)
+            self.terms_cache.put(query, terms)
+        else:
+            self.metrics.count('terms_cache_hits')
+        return list(terms)
+
+    def _cached(self, key: tuple, search) -> List[Tuple[str, float]]:
+        """Devuelve el resultado en caché para la clave o lo calcula y lo guarda"""
+        key = (self.index_version,) + key
+        results = self.result_cache.get(key)
+        if results is None:
+            self.metrics.count('result_cache_misses')
+            results = search()
+            self.result_cache.put(key, results)
+        else:
+            self.metrics.count('result_cache_hits')
+        return list(results)
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Contadores de aciertos/fallos de las cachés de consultas"""
+        return {'terms': self.terms_cache.stats(), 'results': self.result_cache.stats()}
+
     def _calculate_query_tfidf_vector(self, query_terms: List[str]) -> Dict[str, float]:
         """Calcula el vector TF-IDF de la consulta"""
         # Frecuencias de términos en la consulta
@@ -134,11 +652,26 @@ class RetrievalSystem:
         # Calcular TF-IDF para cada término de la consulta
         query_vector = {}
         for term, tf in term_freq.items():
-            if term in self.inverted_index:
-                df = len(self.inverted_index[term])
+            df = self.segment.df(term)
+            if df > 0:
                 idf = math.log(self.doc_count / df)
                 query_vector[term] = tf * idf
             else:
                 query_vector[term] = 0
 
         return query_vector
+
+    def _to_doc_ids(self, ranked_docs: List[Tuple[int, float]]) -> List[Tuple[str, float]]:
+        """Traduce ordinales internos a doc_ids (solo para el top-k)"""
+        return [(self.segment.doc_ids[doc], score) for doc, score in ranked_docs]
+
+
+def open_retrieval_system(index_path: str = "data/index", instrument: bool = False):
+    """
+    Abre el sistema de recuperación adecuado para el directorio: un
+    ShardedRetrievalSystem si es un índice particionado (python -m src.indexer
+    --shards N) y un RetrievalSystem en otro caso (segmento único o incremental)
+    """
+    if is_sharded(index_path):
+        return ShardedRetrievalSystem(index_path, instrument=instrument)
+    return RetrievalSystem(index_path, instrument=instrument)
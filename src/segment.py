@@ -0,0 +1,931 @@
+"""
+Formato de índice en disco basado en segmentos.
+
+Un segmento es un directorio con arreglos contiguos (.npy) que se abren con
+mmap: diccionario de términos, postings comprimidos (gaps de doc ordinal y
+tf en varint) con tabla de saltos por bloques, longitudes y normas TF-IDF de
+documento y tabla de doc_ids. Opcionalmente guarda también las posiciones de
+cada término en cada documento (gaps en varint, con offsets por bloque de la
+tabla de saltos para decodificar solo los bloques de los candidatos) y un
+índice directo con los términos y tfs de cada documento, y un tier de postings ordenadas por impacto BM25
+cuantizado (con poda estática opcional). Los textos viven aparte, en un almacén de
+documentos comprimido por bloques (ver docstore). Abrir un segmento no
+deserializa nada, por lo que el arranque es inmediato y las páginas se
+comparten entre procesos.
+"""
+import json
+import os
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from .compression import encode_varint, decode_varint, delta_encode, delta_decode, delta_decode_lists, varint_sizes
+from .docstore import DocStore, DocStoreWriter
+from .utils import load_index
+
+FORMAT_VERSION = 5
+META_FILE = "meta.json"
+# Postings decodificados por bloque al recorrer el segmento completo
+SCAN_BLOCK_POSTINGS = 1 << 22
+# Postings por bloque de la tabla de saltos (skip list + cotas por bloque)
+BLOCK_SIZE = 128
+# Tamaño fijo de la cabecera .npy de los arreglos escritos por partes
+NPY_HEADER_SIZE = 128
+# Bits de los impactos BM25 cuantizados del tier ordenado por impacto
+IMPACT_BITS = 8
+
+
+def _save_array(index_path: str, name: str, array: np.ndarray) -> None:
+    """Guarda un arreglo NumPy dentro del directorio del segmento"""
+    # Escritura atómica: los lectores con mmap conservan el archivo anterior
+    path = os.path.join(index_path, f"{name}.npy")
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def _load_array(index_path: str, name: str) -> np.ndarray:
+    """Abre un arreglo del segmento con mmap (solo lectura)"""
+    return np.load(os.path.join(index_path, f"{name}.npy"), mmap_mode='r')
+
+
+def _save_strings(index_path: str, name: str, strings: Sequence[str]) -> None:
+    """Guarda una lista de cadenas como blob UTF-8 más tabla de offsets"""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    _save_array(index_path, f"{name}.blob", blob)
+    _save_array(index_path, f"{name}.off", offsets)
+
+
+class StringTable:
+    """Tabla de cadenas respaldada por mmap con búsqueda binaria opcional"""
+
+    def __init__(self, index_path: str, name: str, order: Optional[np.ndarray] = None):
+        """
+        Args:
+            index_path: Directorio del segmento
+            name: Prefijo de los archivos de la tabla
+            order: Permutación que ordena la tabla (None si ya está ordenada)
+        """
+        self.blob = _load_array(index_path, f"{name}.blob")
+        self.offsets = _load_array(index_path, f"{name}.off")
+        self.order = order
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        """Devuelve la cadena i-ésima sin decodificar"""
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i: int) -> str:
+        return self.raw(i).decode('utf-8')
+
+    def find(self, value: str) -> int:
+        """Búsqueda binaria de una cadena; devuelve su posición o -1"""
+        key = value.encode('utf-8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = int(self.order[mid]) if self.order is not None else mid
+            current = self.raw(i)
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return i
+        return -1
+
+
+def tfidf_idf(dfs: np.ndarray, doc_count: int) -> np.ndarray:
+    """IDF de TF-IDF, log(N / df), para un arreglo de frecuencias documentales"""
+    dfs = np.asarray(dfs, dtype=np.float64)
+    idf = np.zeros(len(dfs), dtype=np.float64)
+    present = dfs > 0
+    idf[present] = np.log(doc_count / dfs[present])
+    return idf
+
+
+def doc_norm_squares(docs: np.ndarray, tfs: np.ndarray, term_ids: np.ndarray,
+                     idf: np.ndarray, doc_count: int) -> np.ndarray:
+    """Suma por documento de (tf * idf)^2 para un bloque de postings"""
+    weights = np.asarray(tfs, dtype=np.float64) * idf[term_ids]
+    return np.bincount(docs, weights=weights * weights, minlength=doc_count)
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenación de los rangos [start, end) como un único arreglo de índices"""
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(ends, dtype=np.int64) - starts
+    return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(int(lengths.sum()))
+
+
+def _varint_offsets(values: np.ndarray) -> np.ndarray:
+    """Offset en bytes de cada valor dentro del stream varint (len = valores + 1)"""
+    ends = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(varint_sizes(values), out=ends[1:])
+    return ends
+
+
+def _npy_header(dtype, count: int) -> bytes:
+    """Cabecera .npy v1.0 de tamaño fijo para un arreglo 1-D de `count` elementos"""
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                   'fortran_order': False, 'shape': (count,)})
+    header = header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class _ArrayStream:
+    """Arreglo .npy 1-D escrito por partes sin mantenerlo en memoria"""
+
+    def __init__(self, index_path: str, name: str, dtype):
+        self.path = os.path.join(index_path, f"{name}.npy")
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.file = open(self.path + ".tmp", 'wb')
+        self.file.write(_npy_header(self.dtype, 0))
+
+    def append(self, values) -> None:
+        values = np.asarray(values, dtype=self.dtype)
+        self.file.write(values.tobytes())
+        self.count += len(values)
+
+    def close(self) -> None:
+        """Reescribe la cabecera con el tamaño final y publica el archivo"""
+        self.file.seek(0)
+        self.file.write(_npy_header(self.dtype, self.count))
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class _StringStream:
+    """Tabla de cadenas (blob + offsets) escrita por partes"""
+
+    def __init__(self, index_path: str, name: str):
+        self.blob = _ArrayStream(index_path, f"{name}.blob", np.uint8)
+        self.offsets = _ArrayStream(index_path, f"{name}.off", np.int64)
+        self.offsets.append([0])
+        self.size = 0
+
+    def append(self, strings: Sequence[str]) -> None:
+        encoded = [s.encode('utf-8') for s in strings]
+        if not encoded:
+            return
+        self.blob.append(np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        self.offsets.append(self.size + np.cumsum([len(e) for e in encoded]))
+        self.size += sum(len(e) for e in encoded)
+
+    def close(self) -> None:
+        self.blob.close()
+        self.offsets.close()
+
+
+class SegmentWriter:
+    """
+    Escritor incremental de segmentos.
+
+    Primero se añaden los documentos (en orden de ordinal) y después las
+    postings término a término en orden UTF-8 ascendente. Las postings se
+    acumulan hasta SCAN_BLOCK_POSTINGS y se comprimen por lotes, de modo que
+    la memoria no depende del tamaño de la colección.
+    """
+
+    def __init__(self, index_path: str, positions: bool = False, term_vectors: bool = False):
+        """
+        Args:
+            index_path: Directorio del segmento
+            positions: Guarda las posiciones de cada término (add_postings las recibe)
+            term_vectors: Al cerrar, escribe el índice directo (ver write_term_vectors)
+        """
+        os.makedirs(index_path, exist_ok=True)
+        self.index_path = index_path
+        self.positions = positions
+        self.term_vectors = term_vectors
+        self.doc_lengths = array('i')
+        self._docids = _StringStream(index_path, "docids")
+        self._texts = DocStoreWriter(index_path)
+        self._terms = None
+        self._last_term = None
+        self._pending: List[Tuple[str, np.ndarray, np.ndarray, Optional[np.ndarray]]] = []
+        self._pending_postings = 0
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.doc_lengths)
+
+    def add_documents(self, doc_ids: Sequence[str], doc_lengths: Sequence[int],
+                      doc_texts: Optional[Sequence[str]] = None) -> None:
+        """
+        Añade documentos; sus ordinales continúan los ya añadidos. Si no se
+        pasan los textos, deben añadirse después con add_texts o add_docstore.
+        """
+        if self._terms is not None:
+            raise ValueError("Los documentos deben añadirse antes que las postings")
+        self._docids.append(doc_ids)
+        if doc_texts is not None:
+            self.add_texts(doc_texts)
+        self.doc_lengths.extend(doc_lengths)
+
+    def add_texts(self, doc_texts: Sequence[str]) -> None:
+        """Añade los textos de los siguientes documentos añadidos sin texto"""
+        if self._terms is not None:
+            raise ValueError("Los documentos deben añadirse antes que las postings")
+        for text in doc_texts:
+            self._texts.add(text)
+
+    def add_docstore(self, store: DocStore) -> None:
+        """Añade los textos de un almacén existente copiando sus bloques comprimidos"""
+        if self._terms is not None:
+            raise ValueError("Los documentos deben añadirse antes que las postings")
+        self._texts.append_store(store)
+
+    def _start_postings(self) -> None:
+        """Abre los streams de postings una vez conocida la colección completa"""
+        self._lengths = np.frombuffer(self.doc_lengths, dtype=np.int32) if self.doc_lengths \
+            else np.zeros(0, dtype=np.int32)
+        self._squares = np.zeros(self.doc_count, dtype=np.float64)
+        self._terms = _StringStream(self.index_path, "terms")
+        names = {
+            'df': ("postings.df", np.int32), 'doc': ("postings.doc", np.uint8),
+            'doc_off': ("postings.doc.off", np.int64), 'tf': ("postings.tf", np.uint8),
+            'tf_off': ("postings.tf.off", np.int64), 'block_off': ("blocks.off", np.int64),
+            'block_last': ("blocks.last", np.int32), 'block_doc': ("blocks.doc", np.int64),
+            'block_tf': ("blocks.tf", np.int64), 'block_maxtf': ("blocks.maxtf", np.int32),
+            'block_mindl': ("blocks.mindl", np.int32),
+        }
+        if self.positions:
+            names.update({'pos': ("positions", np.uint8), 'pos_off': ("positions.off", np.int64),
+                          'block_pos': ("blocks.pos", np.int64)})
+        self._streams = {key: _ArrayStream(self.index_path, name, dtype)
+                         for key, (name, dtype) in names.items()}
+        self._posting_count = 0
+        self._block_count = 0
+
+    def add_postings(self, term: str, docs: Sequence[int], tfs: Sequence[int],
+                     positions: Optional[Sequence[int]] = None) -> None:
+        """
+        Añade la lista de postings (ordinales ascendentes) del siguiente término.
+        Con posiciones, `positions` concatena las de cada documento en orden
+        ascendente (tf posiciones por documento).
+        """
+        if self._terms is None:
+            self._start_postings()
+        key = term.encode('utf-8')
+        if self._last_term is not None and key <= self._last_term:
+            raise ValueError(f"Términos fuera de orden: {term!r}")
+        self._last_term = key
+        docs = np.asarray(docs, dtype=np.int64)
+        tfs = np.asarray(tfs, dtype=np.int64)
+        if self.positions:
+            if positions is None:
+                raise ValueError(f"Faltan las posiciones del término {term!r}")
+            positions = np.asarray(positions, dtype=np.int64)
+            if len(positions) != int(tfs.sum()):
+                raise ValueError(f"Posiciones del término {term!r} inconsistentes con sus tfs")
+        else:
+            positions = None
+        self._pending.append((term, docs, tfs, positions))
+        self._pending_postings += len(docs)
+        if self._pending_postings >= SCAN_BLOCK_POSTINGS:
+            self._flush()
+
+    def _flush(self) -> None:
+        """Comprime y escribe las postings pendientes"""
+        if not self._pending:
+            return
+        streams = self._streams
+        terms = [term for term, _, _, _ in self._pending]
+        dfs = np.array([len(docs) for _, docs, _, _ in self._pending], dtype=np.int64)
+        docs = np.concatenate([docs for _, docs, _, _ in self._pending])
+        tfs = np.concatenate([tfs for _, _, tfs, _ in self._pending])
+        positions = np.concatenate([p for _, _, _, p in self._pending]) if self.positions else None
+        self._pending, self._pending_postings = [], 0
+
+        term_offsets = np.zeros(len(dfs) + 1, dtype=np.int64)
+        np.cumsum(dfs, out=term_offsets[1:])
+        self._terms.append(terms)
+        streams['df'].append(dfs)
+
+        # Postings comprimidos: gaps de ordinales y tfs como varint
+        gaps = delta_encode(docs, term_offsets)
+        doc_bytes, tf_bytes = _varint_offsets(gaps), _varint_offsets(tfs)
+        doc_base, tf_base = streams['doc'].count, streams['tf'].count
+        streams['doc_off'].append(doc_bytes[term_offsets[:-1]] + doc_base)
+        streams['tf_off'].append(tf_bytes[term_offsets[:-1]] + tf_base)
+        streams['doc'].append(encode_varint(gaps))
+        streams['tf'].append(encode_varint(tfs))
+
+        # Tabla de saltos: bloques de BLOCK_SIZE postings con su último doc,
+        # offsets en bytes y datos para acotar su score (tf máx., longitud mín.)
+        position = np.arange(len(docs), dtype=np.int64) - np.repeat(term_offsets[:-1], dfs)
+        block_starts = np.flatnonzero(position % BLOCK_SIZE == 0)
+        block_ends = np.append(block_starts[1:], len(docs))
+        blocks_per_term = (dfs + BLOCK_SIZE - 1) // BLOCK_SIZE
+        streams['block_off'].append(self._block_count + np.cumsum(blocks_per_term) - blocks_per_term)
+        streams['block_last'].append(docs[block_ends - 1])
+        streams['block_doc'].append(doc_bytes[block_starts] + doc_base)
+        streams['block_tf'].append(tf_bytes[block_starts] + tf_base)
+        streams['block_maxtf'].append(np.maximum.reduceat(tfs, block_starts))
+        streams['block_mindl'].append(np.minimum.reduceat(self._lengths[docs], block_starts))
+        self._block_count += len(block_starts)
+
+        if self.positions:
+            # Posiciones: gaps dentro de cada documento (la primera absoluta)
+            posting_offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+            np.cumsum(tfs, out=posting_offsets[1:])
+            position_gaps = delta_encode(positions, posting_offsets)
+            position_bytes = _varint_offsets(position_gaps) + streams['pos'].count
+            streams['pos_off'].append(position_bytes[posting_offsets[term_offsets[:-1]]])
+            streams['block_pos'].append(position_bytes[posting_offsets[block_starts]])
+            streams['pos'].append(encode_varint(position_gaps))
+        self._posting_count += len(docs)
+
+        # Normas TF-IDF: la colección ya está completa, el idf es definitivo
+        self._squares += doc_norm_squares(docs, tfs, np.repeat(np.arange(len(dfs)), dfs),
+                                          tfidf_idf(dfs, self.doc_count), self.doc_count)
+
+    def close(self) -> None:
+        """Cierra los streams y escribe las tablas finales y meta.json"""
+        if self._terms is None:
+            self._start_postings()
+        self._flush()
+        streams = self._streams
+        # Centinelas finales: offsets de fin de la última lista y del último bloque
+        streams['doc_off'].append([streams['doc'].count])
+        streams['tf_off'].append([streams['tf'].count])
+        streams['block_off'].append([self._block_count])
+        streams['block_doc'].append([streams['doc'].count])
+        streams['block_tf'].append([streams['tf'].count])
+        if self.positions:
+            streams['pos_off'].append([streams['pos'].count])
+            streams['block_pos'].append([streams['pos'].count])
+        for stream in streams.values():
+            stream.close()
+        term_count = self._terms.offsets.count - 1
+        self._terms.close()
+        self._docids.close()
+        if self._texts.doc_count != self.doc_count:
+            raise ValueError(f"El almacén tiene {self._texts.doc_count} textos para "
+                             f"{self.doc_count} documentos")
+        self._texts.close()
+
+        _save_array(self.index_path, "doclen", self._lengths)
+        _save_array(self.index_path, "docnorm", np.sqrt(self._squares).astype(np.float32))
+        _save_array(self.index_path, "docids.order", _sorted_order(StringTable(self.index_path, "docids")))
+
+        total_doc_length = int(self._lengths.sum())
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'doc_count': self.doc_count,
+            'term_count': term_count,
+            'posting_count': self._posting_count,
+            'block_size': BLOCK_SIZE,
+            'total_doc_length': total_doc_length,
+            'avg_doc_length': total_doc_length / self.doc_count if self.doc_count > 0 else 0,
+            'positions': self.positions,
+            'term_vectors': False,
+        }
+        _save_meta(self.index_path, meta)
+        if self.term_vectors:
+            write_term_vectors(self.index_path)
+
+
+def _save_meta(index_path: str, meta: Dict) -> None:
+    """Escribe meta.json de forma atómica"""
+    path = os.path.join(index_path, META_FILE)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def set_fast_tokenizer(index_path: str, fast_tokenizer: bool) -> None:
+    """Anota en meta.json el tokenizador del segmento: las consultas deben tokenizarse igual"""
+    with open(os.path.join(index_path, META_FILE)) as f:
+        meta = json.load(f)
+    meta['fast_tokenizer'] = bool(fast_tokenizer)
+    _save_meta(index_path, meta)
+
+
+def _sorted_order(table: StringTable) -> np.ndarray:
+    """Permutación que ordena una tabla de cadenas por sus bytes UTF-8"""
+    if len(table) == 0:
+        return np.zeros(0, dtype=np.int32)
+    keys = np.array([table.raw(i) for i in range(len(table))])
+    return np.argsort(keys, kind='stable').astype(np.int32)
+
+
+def write_segment(index_path: str, postings: Dict[str, Tuple[Sequence[int], Sequence[int]]],
+                  doc_ids: Sequence[str], doc_lengths: Sequence[int],
+                  doc_texts: Optional[Sequence[str]] = None,
+                  docstore: Optional[str] = None, positions: bool = False,
+                  term_vectors: bool = False) -> None:
+    """
+    Escribe un segmento en disco.
+
+    Args:
+        index_path: Directorio destino
+        postings: {término: (doc ordinals ascendentes, tfs)}, o
+            {término: (doc ordinals, tfs, posiciones)} con positions=True
+        doc_ids: doc_id de cada ordinal
+        doc_lengths: Longitud de cada documento por ordinal
+        doc_texts: Texto de cada documento por ordinal
+        docstore: Directorio de un almacén ya escrito con los textos (alternativa a doc_texts)
+        positions: Guarda las posiciones de cada término
+        term_vectors: Escribe también el índice directo
+    """
+    writer = SegmentWriter(index_path, positions, term_vectors)
+    writer.add_documents(doc_ids, doc_lengths, doc_texts)
+    if docstore is not None:
+        writer.add_docstore(DocStore(docstore))
+    # Diccionario de términos ordenado por bytes UTF-8 (búsqueda binaria)
+    for term in sorted(postings, key=lambda t: t.encode('utf-8')):
+        writer.add_postings(term, *postings[term])
+    writer.close()
+
+
+class Segment:
+    """Lector de un segmento del índice abierto con mmap"""
+
+    def __init__(self, index_path: str):
+        meta_path = os.path.join(index_path, META_FILE)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No se encontró el índice en {index_path}")
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        if self.meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Versión de formato no soportada en {index_path}: "
+                             f"{self.meta.get('format_version')}")
+
+        self.index_path = index_path
+        self.doc_count = self.meta['doc_count']
+        self.avg_doc_length = self.meta['avg_doc_length']
+        self.total_doc_length = self.meta['total_doc_length']
+
+        self.terms = StringTable(index_path, "terms")
+        self.term_dfs = _load_array(index_path, "postings.df")
+        self.postings_docs = _load_array(index_path, "postings.doc")
+        self.docs_offsets = _load_array(index_path, "postings.doc.off")
+        self.postings_tfs = _load_array(index_path, "postings.tf")
+        self.tfs_offsets = _load_array(index_path, "postings.tf.off")
+        self.block_offsets = _load_array(index_path, "blocks.off")
+        self.block_last = _load_array(index_path, "blocks.last")
+        self.block_docs_offsets = _load_array(index_path, "blocks.doc")
+        self.block_tfs_offsets = _load_array(index_path, "blocks.tf")
+        self.block_max_tf = _load_array(index_path, "blocks.maxtf")
+        self.block_min_length = _load_array(index_path, "blocks.mindl")
+        self.doc_lengths = _load_array(index_path, "doclen")
+        self.doc_norms = _load_array(index_path, "docnorm")
+        self.doc_ids = StringTable(index_path, "docids", order=_load_array(index_path, "docids.order"))
+        self.has_positions = bool(self.meta.get('positions'))
+        # Tokenizador con que se indexó (los segmentos anteriores usaban word_tokenize)
+        self.fast_tokenizer = bool(self.meta.get('fast_tokenizer'))
+        if self.has_positions:
+            self.postings_positions = _load_array(index_path, "positions")
+            self.positions_offsets = _load_array(index_path, "positions.off")
+            self.block_positions_offsets = _load_array(index_path, "blocks.pos")
+        self.has_term_vectors = bool(self.meta.get('term_vectors'))
+        if self.has_term_vectors:
+            self.vector_offsets = _load_array(index_path, "vectors.off")
+            self.vector_terms = _load_array(index_path, "vectors.term")
+            self.vector_tfs = _load_array(index_path, "vectors.tf")
+        # Tier por impacto: grupos de postings con el mismo impacto cuantizado,
+        # de mayor a menor impacto dentro de cada término
+        self.impact_meta = self.meta.get('impact')
+        self.has_impacts = self.impact_meta is not None
+        if self.has_impacts:
+            self.impact_term_offsets = _load_array(index_path, "impact.term.off")
+            self.impact_group_offsets = _load_array(index_path, "impact.group.off")
+            self.impact_group_values = _load_array(index_path, "impact.group.value")
+            self.impact_docs = _load_array(index_path, "impact.doc")
+        self.docstore = DocStore(index_path)
+        self._postings_memo = None  # postings decodificadas compartidas (ver shared_postings)
+
+    @property
+    def term_count(self) -> int:
+        return len(self.terms)
+
+    def term_id(self, term: str) -> int:
+        """Ordinal del término en el diccionario, o -1 si no existe"""
+        return self.terms.find(term)
+
+    def df(self, term: str) -> int:
+        """Frecuencia documental del término"""
+        t = self.term_id(term)
+        if t < 0:
+            return 0
+        return int(self.term_dfs[t])
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Decodifica (doc ordinals, tfs) del término desde el mmap"""
+        if self._postings_memo is not None and term in self._postings_memo:
+            return self._postings_memo[term]
+        t = self.term_id(term)
+        if t < 0:
+            postings = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        else:
+            postings = self.term_postings(t)
+        if self._postings_memo is not None:
+            self._postings_memo[term] = postings
+        return postings
+
+    @contextmanager
+    def shared_postings(self):
+        """
+        Dentro del bloque, cada término se decodifica una sola vez: las
+        consultas de un mismo lote reutilizan las postings ya decodificadas.
+        """
+        outer = self._postings_memo is not None
+        if not outer:
+            self._postings_memo = {}
+        try:
+            yield
+        finally:
+            if not outer:
+                self._postings_memo = None
+
+    def term_postings(self, t: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Decodifica las postings del término con ordinal t"""
+        gaps = decode_varint(self.postings_docs[self.docs_offsets[t]:self.docs_offsets[t + 1]])
+        tfs = decode_varint(self.postings_tfs[self.tfs_offsets[t]:self.tfs_offsets[t + 1]])
+        return delta_decode(gaps), tfs
+
+    def block_postings(self, t: int, j: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Decodifica solo el bloque j (índice global) del término t"""
+        gaps = decode_varint(self.postings_docs[self.block_docs_offsets[j]:self.block_docs_offsets[j + 1]])
+        tfs = decode_varint(self.postings_tfs[self.block_tfs_offsets[j]:self.block_tfs_offsets[j + 1]])
+        # El primer gap de la lista es absoluto; los demás bloques parten del último doc previo
+        base = int(self.block_last[j - 1]) if j > self.block_offsets[t] else 0
+        return np.cumsum(gaps) + base, tfs
+
+    def _candidate_postings(self, t: int, docs: np.ndarray):
+        """
+        Busca los documentos `docs` en las postings del término t decodificando
+        solo los bloques que pueden contenerlos.
+
+        Yields:
+            (bloque j, tfs del bloque, índices en docs encontrados, su posición en el bloque)
+        """
+        first, last = int(self.block_offsets[t]), int(self.block_offsets[t + 1])
+        # Bloque de cada documento: el primero cuyo último ordinal no es menor
+        blocks = first + np.searchsorted(self.block_last[first:last], docs)
+        for j in np.unique(blocks[blocks < last]).tolist():
+            block_docs, block_tfs = self.block_postings(t, j)
+            wanted = np.flatnonzero(blocks == j)
+            found = np.minimum(np.searchsorted(block_docs, docs[wanted]), len(block_docs) - 1)
+            hit = block_docs[found] == docs[wanted]
+            yield j, block_tfs, wanted[hit], found[hit]
+
+    def term_frequencies(self, term: str, docs: Sequence[int]) -> np.ndarray:
+        """tf del término en cada documento de `docs` (0 si no aparece), sin decodificar la lista entera"""
+        docs = np.asarray(docs, dtype=np.int64)
+        tfs = np.zeros(len(docs), dtype=np.int64)
+        t = self.term_id(term)
+        if t < 0 or len(docs) == 0:
+            return tfs
+        for _, block_tfs, indices, found in self._candidate_postings(t, docs):
+            tfs[indices] = block_tfs[found]
+        return tfs
+
+    def positions(self, term: str, docs: Sequence[int]) -> List[np.ndarray]:
+        """
+        Posiciones del término en cada documento de `docs` (vacías si no
+        aparece). Solo se decodifican los bloques que contienen a esos documentos.
+        """
+        if not self.has_positions:
+            raise ValueError(f"El segmento {self.index_path} no guarda posiciones")
+        docs = np.asarray(docs, dtype=np.int64)
+        result = [np.zeros(0, dtype=np.int64)] * len(docs)
+        t = self.term_id(term)
+        if t < 0 or len(docs) == 0:
+            return result
+        for j, block_tfs, indices, found in self._candidate_postings(t, docs):
+            gaps = decode_varint(self.postings_positions[self.block_positions_offsets[j]:
+                                                         self.block_positions_offsets[j + 1]])
+            positions = delta_decode_lists(gaps, block_tfs)
+            ends = np.cumsum(block_tfs)
+            for i, f in zip(indices.tolist(), found.tolist()):
+                result[i] = positions[ends[f] - block_tfs[f]:ends[f]]
+        return result
+
+    def iter_postings(self, block_postings: int = SCAN_BLOCK_POSTINGS, positions: bool = False):
+        """
+        Recorre todas las postings del segmento decodificándolas por bloques de términos.
+
+        Yields:
+            (term_ids, docs, tfs) con un elemento por posting, y con
+            positions=True también las posiciones concatenadas de cada posting
+        """
+        if positions and not self.has_positions:
+            raise ValueError(f"El segmento {self.index_path} no guarda posiciones")
+        t0 = 0
+        ends = np.cumsum(self.term_dfs, dtype=np.int64)
+        while t0 < self.term_count:
+            # Último término del bloque: al menos uno, hasta block_postings postings
+            base = ends[t0 - 1] if t0 > 0 else 0
+            t1 = max(t0 + 1, int(np.searchsorted(ends, base + block_postings, side='right')))
+            t1 = min(t1, self.term_count)
+            dfs = np.asarray(self.term_dfs[t0:t1], dtype=np.int64)
+            gaps = decode_varint(self.postings_docs[self.docs_offsets[t0]:self.docs_offsets[t1]])
+            tfs = decode_varint(self.postings_tfs[self.tfs_offsets[t0]:self.tfs_offsets[t1]])
+            docs = delta_decode_lists(gaps, dfs)
+            if positions:
+                position_gaps = decode_varint(self.postings_positions[self.positions_offsets[t0]:
+                                                                      self.positions_offsets[t1]])
+                yield np.repeat(np.arange(t0, t1), dfs), docs, tfs, delta_decode_lists(position_gaps, tfs)
+            else:
+                yield np.repeat(np.arange(t0, t1), dfs), docs, tfs
+            t0 = t1
+
+    def iter_term_postings(self, term_ids: Sequence[int], block_postings: int = SCAN_BLOCK_POSTINGS):
+        """
+        Como iter_postings, pero solo para los términos `term_ids` (ascendentes):
+        cada bloque reúne los bytes de varias listas y los decodifica de una vez.
+
+        Yields:
+            (term_ids, docs, tfs) con un elemento por posting
+        """
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        dfs = np.asarray(self.term_dfs, dtype=np.int64)[term_ids]
+        ends = np.cumsum(dfs)
+        i0 = 0
+        while i0 < len(term_ids):
+            base = ends[i0 - 1] if i0 > 0 else 0
+            i1 = min(max(i0 + 1, int(np.searchsorted(ends, base + block_postings, side='right'))), len(term_ids))
+            ts = term_ids[i0:i1]
+            gaps = decode_varint(self.postings_docs[_ranges(self.docs_offsets[ts], self.docs_offsets[ts + 1])])
+            tfs = decode_varint(self.postings_tfs[_ranges(self.tfs_offsets[ts], self.tfs_offsets[ts + 1])])
+            yield np.repeat(ts, dfs[i0:i1]), delta_decode_lists(gaps, dfs[i0:i1]), tfs
+            i0 = i1
+
+    def term_vectors(self, docs: Sequence[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Términos y tfs de los documentos `docs` leídos del índice directo, sin
+        tocar las postings.
+
+        Returns:
+            (fila en docs, término, tf) de cada par documento-término, con los
+            términos como arreglo de cadenas
+        """
+        if not self.has_term_vectors:
+            raise ValueError(f"El segmento {self.index_path} no guarda índice directo")
+        docs = np.asarray(docs, dtype=np.int64)
+        starts = np.asarray(self.vector_offsets[docs], dtype=np.int64)
+        counts = np.asarray(self.vector_offsets[docs + 1], dtype=np.int64) - starts
+        rows = np.repeat(np.arange(len(docs)), counts)
+        indices = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts) + starts[rows]
+        # Cada término distinto se lee una sola vez del diccionario
+        unique, inverse = np.unique(self.vector_terms[indices], return_inverse=True)
+        terms = np.array([self.terms[t] for t in unique.tolist()], dtype=object)
+        return rows, terms[inverse], np.asarray(self.vector_tfs[indices], dtype=np.int64)
+
+    def doc_ordinal(self, doc_id: str) -> int:
+        """Ordinal de un doc_id, o -1 si no existe"""
+        return self.doc_ids.find(doc_id)
+
+    def doc_text(self, doc_id: str, default: str = "") -> str:
+        """Texto de un documento leído bajo demanda"""
+        d = self.doc_ordinal(doc_id)
+        return self.docstore.get(d) if d >= 0 else default
+
+    def doc_snippet(self, doc_id: str, max_chars: int, default: str = "") -> str:
+        """Primeros max_chars caracteres de un documento, sin descomprimirlo entero"""
+        d = self.doc_ordinal(doc_id)
+        return self.docstore.snippet(d, max_chars) if d >= 0 else default
+
+
+class SegmentTexts:
+    """Vista tipo diccionario {doc_id: texto} sobre un segmento"""
+
+    def __init__(self, segment: Segment):
+        self.segment = segment
+
+    def get(self, doc_id: str, default: str = None) -> str:
+        return self.segment.doc_text(doc_id, default)
+
+    def snippet(self, doc_id: str, max_chars: int, default: str = None) -> str:
+        return self.segment.doc_snippet(doc_id, max_chars, default)
+
+
+def rebuild_doc_norms(index_path: str, idf: Optional[np.ndarray] = None) -> None:
+    """
+    Recalcula las normas TF-IDF de un segmento sin reconstruir el índice.
+
+    Args:
+        index_path: Directorio del segmento
+        idf: IDF por ordinal de término (por defecto, el del propio segmento)
+    """
+    segment = Segment(index_path)
+    if idf is None:
+        idf = tfidf_idf(segment.term_dfs, segment.doc_count)
+    squares = np.zeros(segment.doc_count, dtype=np.float64)
+    for term_ids, docs, tfs in segment.iter_postings():
+        squares += doc_norm_squares(docs, tfs, term_ids, idf, segment.doc_count)
+    _save_array(index_path, "docnorm", np.sqrt(squares).astype(np.float32))
+    print(f"Normas de documento recalculadas en {index_path}")
+
+
+def write_term_vectors(index_path: str) -> None:
+    """
+    Escribe el índice directo de un segmento: para cada documento, sus
+    ordinales de término (ascendentes) y tfs en arreglos contiguos con offsets
+    por documento. Es la transpuesta de las postings y se calcula en dos
+    pasadas por bloques, escribiendo sobre arreglos mmap, así que la memoria
+    no depende del tamaño del segmento.
+    """
+    segment = Segment(index_path)
+    counts = np.zeros(segment.doc_count, dtype=np.int64)
+    for _, docs, _ in segment.iter_postings():
+        counts += np.bincount(docs, minlength=segment.doc_count)
+    offsets = np.zeros(segment.doc_count + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    _save_array(index_path, "vectors.off", offsets)
+
+    total = int(offsets[-1])
+    if total == 0:
+        _save_array(index_path, "vectors.term", np.zeros(0, dtype=np.int32))
+        _save_array(index_path, "vectors.tf", np.zeros(0, dtype=np.int32))
+    else:
+        paths = [os.path.join(index_path, f"vectors.{name}.npy") for name in ("term", "tf")]
+        terms, tfs = (np.lib.format.open_memmap(path + ".tmp", mode='w+', dtype=np.int32, shape=(total,))
+                      for path in paths)
+        cursor = offsets[:-1].copy()
+        for term_ids, docs, chunk_tfs in segment.iter_postings():
+            # Los términos llegan en orden ascendente: la ordenación estable por
+            # documento los conserva ordenados dentro de cada documento
+            order = np.argsort(docs, kind='stable')
+            sorted_docs = docs[order]
+            starts = np.flatnonzero(np.diff(sorted_docs, prepend=-1))
+            sizes = np.diff(np.append(starts, len(sorted_docs)))
+            targets = cursor[sorted_docs] + np.arange(len(sorted_docs)) - np.repeat(starts, sizes)
+            terms[targets] = term_ids[order]
+            tfs[targets] = chunk_tfs[order]
+            cursor[sorted_docs[starts]] += sizes
+        terms.flush()
+        tfs.flush()
+        del terms, tfs
+        for path in paths:
+            os.replace(path + ".tmp", path)
+
+    meta = dict(segment.meta, term_vectors=True)
+    _save_meta(index_path, meta)
+
+
+def impact_keep(dfs: np.ndarray, prune_ratio: float) -> np.ndarray:
+    """Postings que conserva la poda estática de cada término: las ceil(ratio * df) de más impacto"""
+    return np.ceil(np.asarray(dfs, dtype=np.float64) * prune_ratio - 1e-9).astype(np.int64)
+
+
+def write_impact_postings(index_path: str, prune_ratio: float = 1.0, k1: float = 1.5, b: float = 0.75,
+                          bits: int = IMPACT_BITS) -> None:
+    """
+    Escribe el tier ordenado por impacto de un segmento: el impacto BM25 de
+    cada posting (con el idf y la longitud media del segmento) se cuantiza
+    linealmente a -(2^bits - 1)..2^bits - 1 (con signo: los términos con df
+    mayor que la mitad de la colección tienen idf negativo, como en bm25_search)
+    y las postings de cada término se ordenan de mayor a menor impacto,
+    agrupadas por impacto cuantizado. Con prune_ratio < 1 solo se guardan las
+    ceil(prune_ratio * df) postings de más impacto de cada término (poda
+    estática). Dos pasadas por bloques: el máximo absoluto y la escritura.
+    """
+    if not 0 < prune_ratio <= 1:
+        raise ValueError(f"prune_ratio debe estar en (0, 1]: {prune_ratio}")
+    segment = Segment(index_path)
+    dfs = np.asarray(segment.term_dfs, dtype=np.int64)
+    idf = np.log((segment.doc_count - dfs + 0.5) / (dfs + 0.5))
+    keep = impact_keep(dfs, prune_ratio)
+    lengths = np.asarray(segment.doc_lengths, dtype=np.float64)
+    avg_doc_length = segment.avg_doc_length or 1.0
+
+    def impacts(term_ids, docs, tfs):
+        tfs = tfs.astype(np.float64)
+        return idf[term_ids] * ((tfs * (k1 + 1)) / (tfs + k1 * (1 - b + b * (lengths[docs] / avg_doc_length))))
+
+    max_impact = 0.0
+    for term_ids, docs, tfs in segment.iter_postings():
+        max_impact = max(max_impact, float(np.abs(impacts(term_ids, docs, tfs)).max(initial=0.0)))
+    levels = (1 << bits) - 1
+    scale = max_impact / levels if max_impact > 0 else 1.0
+
+    streams = {
+        'doc': _ArrayStream(index_path, "impact.doc", np.int32),
+        'value': _ArrayStream(index_path, "impact.group.value", np.int16 if bits < 16 else np.int32),
+        'group_off': _ArrayStream(index_path, "impact.group.off", np.int64),
+        'term_off': _ArrayStream(index_path, "impact.term.off", np.int64),
+    }
+    streams['term_off'].append([0])
+    group_count = 0
+    for term_ids, docs, tfs in segment.iter_postings():
+        # Cada bloque cubre los términos consecutivos [first, last]
+        first, last = int(term_ids[0]), int(term_ids[-1])
+        weights = impacts(term_ids, docs, tfs)
+        # Dentro de cada término, de mayor a menor impacto exacto (a igual impacto, por ordinal)
+        order = np.lexsort((docs, -weights, term_ids))
+        term_ids, docs, weights = term_ids[order], docs[order], weights[order]
+        starts = np.flatnonzero(np.diff(term_ids, prepend=-1))
+        ranks = np.arange(len(term_ids)) - np.repeat(starts, np.diff(np.append(starts, len(term_ids))))
+        kept = ranks < keep[term_ids]
+        term_ids, docs, weights = term_ids[kept], docs[kept], weights[kept]
+        # Redondeo hacia fuera: un impacto no nulo nunca se cuantiza a 0
+        values = (np.sign(weights) * np.minimum(np.ceil(np.abs(weights) / scale), levels)).astype(np.int64)
+        # Un grupo por cada (término, impacto cuantizado) distinto
+        group_starts = np.flatnonzero((np.diff(term_ids, prepend=-1) != 0) | (np.diff(values, prepend=-1) != 0))
+        streams['group_off'].append(streams['doc'].count + group_starts)
+        streams['doc'].append(docs)
+        streams['value'].append(values[group_starts])
+        groups = np.bincount(term_ids[group_starts] - first, minlength=last - first + 1)
+        streams['term_off'].append(group_count + np.cumsum(groups))
+        group_count += len(group_starts)
+    streams['group_off'].append([streams['doc'].count])
+    for stream in streams.values():
+        stream.close()
+
+    meta = dict(segment.meta, impact={'prune_ratio': prune_ratio, 'k1': k1, 'b': b, 'bits': bits,
+                                      'scale': scale, 'posting_count': streams['doc'].count})
+    _save_meta(index_path, meta)
+
+
+def global_term_dfs(segments: List["Segment"],
+                    deleted: Optional[List[Optional[np.ndarray]]] = None) -> List[np.ndarray]:
+    """
+    df global (sumado sobre todos los segmentos) de cada término de cada
+    segmento, alineado con sus ordinales de término.
+
+    Args:
+        segments: Segmentos abiertos
+        deleted: Máscara de borrados por segmento (None = sin borrados), que no cuentan en el df
+    """
+    deleted = deleted or [None] * len(segments)
+    terms, dfs = [], []
+    for segment, mask in zip(segments, deleted):
+        if mask is None:
+            live_dfs = np.asarray(segment.term_dfs, dtype=np.int64)
+        else:
+            live_dfs = np.zeros(segment.term_count, dtype=np.int64)
+            for term_ids, docs, _ in segment.iter_postings():
+                live_dfs += np.bincount(term_ids[~mask[docs]], minlength=segment.term_count)
+        terms.append(np.array([segment.terms.raw(t) for t in range(segment.term_count)], dtype=object))
+        dfs.append(live_dfs)
+    if not segments:
+        return []
+    unique, inverse = np.unique(np.concatenate(terms), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate(dfs), minlength=len(unique)).astype(np.int64)
+    bounds = np.cumsum([0] + [len(t) for t in terms])
+    return [totals[inverse[start:end]] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def convert_pickle_index(pickle_path: str = "data/index.pkl", index_path: str = "data/index") -> None:
+    """Convierte un índice pickle del formato anterior al formato de segmentos"""
+    print(f"Cargando índice pickle {pickle_path}...")
+    index_data = load_index(pickle_path)
+    doc_lengths = index_data['doc_lengths']
+    doc_texts = index_data.get('doc_texts', {})
+
+    doc_ids = list(doc_lengths)
+    ordinals = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+
+    print("Convirtiendo postings a ordinales...")
+    postings = {}
+    for term, plist in index_data['inverted_index'].items():
+        pairs = sorted((ordinals[doc_id], tf) for doc_id, tf in plist)
+        postings[term] = ([d for d, _ in pairs], [tf for _, tf in pairs])
+
+    write_segment(index_path, postings, doc_ids,
+                  [doc_lengths[doc_id] for doc_id in doc_ids],
+                  [doc_texts.get(doc_id, "") for doc_id in doc_ids])
+    print(f"Índice convertido en {index_path}")
+
+
+def main():
+    """
+    Conversión única de data/index.pkl al formato de segmentos,
+    recálculo de normas con `python -m src.segment norms [data/index]` o
+    índice directo de un segmento existente con `python -m src.segment vectors [data/index]` y
+    tier ordenado por impacto con `python -m src.segment impact [data/index] [prune_ratio]`
+    """
+    if len(sys.argv) > 1 and sys.argv[1] == "norms":
+        rebuild_doc_norms(sys.argv[2] if len(sys.argv) > 2 else "data/index")
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "vectors":
+        index_path = sys.argv[2] if len(sys.argv) > 2 else "data/index"
+        write_term_vectors(index_path)
+        print(f"Índice directo escrito en {index_path}")
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "impact":
+        index_path = sys.argv[2] if len(sys.argv) > 2 else "data/index"
+        prune_ratio = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+        write_impact_postings(index_path, prune_ratio)
+        print(f"Tier por impacto (poda {prune_ratio:g}) escrito en {index_path}")
+        return
+    pickle_path = sys.argv[1] if len(sys.argv) > 1 else "data/index.pkl"
+    index_path = sys.argv[2] if len(sys.argv) > 2 else "data/index"
+    convert_pickle_index(pickle_path, index_path)
+
+
+if __name__ == "__main__":
+    main()
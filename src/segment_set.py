@@ -0,0 +1,348 @@
+"""
+Índice formado por varios segmentos inmutables (indexado incremental).
+
+El directorio del índice contiene un manifiesto (segments.json) con la lista
+ordenada de segmentos; cada segmento puede tener un bitmap de borrados
+(tombstones) junto a sus arreglos. SegmentSet ofrece la misma interfaz de
+lectura que Segment con ordinales globales (base del segmento + ordinal local)
+y estadísticas agregadas sobre los documentos vivos.
+
+Las normas TF-IDF con idf global se guardan descompuestas por documento: con
+g el df global de cada término, A = sum(tf^2), B = sum(tf^2 ln g) y
+C = sum(tf^2 (ln g)^2), de modo que norma^2 = ln(N)^2 A - 2 ln(N) B + C. Cada
+segmento guarda esas sumas y el df global de sus términos con que se
+calcularon (norm.VERSION.npy y norm.VERSION.df.npy, la versión en el
+manifiesto, igual que la de sus tombstones.VERSION.npy); el escritor solo actualiza las de los términos cuyo df cambia y
+el lector calcula las normas con el N de la generación que abre.
+"""
+import json
+import math
+import os
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .cache import LRUCache
+from .pruning import WandProcessor
+from .segment import Segment
+
+MANIFEST_FILE = "segments.json"
+# Bitmap de borrados de cada versión (en el manifiesto); sin versión, el de índices anteriores
+TOMBSTONES_FILE = "tombstones.{version}.npy"
+LEGACY_TOMBSTONES_FILE = "tombstones.npy"
+# Sumas por documento (A, B, C) y df global por término de cada versión de las normas
+NORM_SUMS_FILE = "norm.{version}.npy"
+NORM_DFS_FILE = "norm.{version}.df.npy"
+# Frecuencias documentales vivas cacheadas por segmento con borrados
+LIVE_DF_CACHE_SIZE = 1 << 16
+
+
+def read_manifest(index_path: str) -> Optional[Dict]:
+    """Manifiesto del índice, o None si es un segmento único sin manifiesto"""
+    path = os.path.join(index_path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(index_path: str, manifest: Dict) -> None:
+    """Publica el manifiesto de forma atómica"""
+    path = os.path.join(index_path, MANIFEST_FILE)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _tombstones_path(segment_path: str, version: Optional[int]) -> str:
+    name = LEGACY_TOMBSTONES_FILE if version is None else TOMBSTONES_FILE.format(version=version)
+    return os.path.join(segment_path, name)
+
+
+def load_tombstones(segment_path: str, doc_count: int, version: Optional[int] = None) -> np.ndarray:
+    """Máscara de documentos borrados de un segmento en una versión (todo False si no hay borrados)"""
+    path = _tombstones_path(segment_path, version)
+    if not os.path.exists(path):
+        return np.zeros(doc_count, dtype=bool)
+    return np.unpackbits(np.load(path), count=doc_count).astype(bool)
+
+
+def save_tombstones(segment_path: str, deleted: np.ndarray, version: int) -> None:
+    """
+    Guarda el bitmap de borrados de una versión de forma atómica. Es un archivo
+    nuevo: los lectores de generaciones anteriores siguen viendo el suyo hasta
+    que el manifiesto publica esta versión.
+    """
+    _save_npy(_tombstones_path(segment_path, version), np.packbits(deleted))
+
+
+def _save_npy(path: str, array: np.ndarray) -> None:
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def load_norm_state(segment_path: str, version: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(sumas A, B, C por documento como arreglo 3 x docs, df global por término) de una versión"""
+    return (np.load(os.path.join(segment_path, NORM_SUMS_FILE.format(version=version))),
+            np.load(os.path.join(segment_path, NORM_DFS_FILE.format(version=version))))
+
+
+def save_norm_state(segment_path: str, version: int, sums: np.ndarray, dfs: np.ndarray) -> None:
+    """Guarda una versión de las sumas de normas de un segmento (de forma atómica)"""
+    _save_npy(os.path.join(segment_path, NORM_DFS_FILE.format(version=version)), np.asarray(dfs, dtype=np.int64))
+    _save_npy(os.path.join(segment_path, NORM_SUMS_FILE.format(version=version)), np.asarray(sums, dtype=np.float64))
+
+
+def norm_sums(segment: Segment, dfs: np.ndarray, term_ids: Optional[np.ndarray] = None,
+              shifts: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Sumas por documento (A, B, C) de las normas TF-IDF globales de un segmento.
+
+    Args:
+        segment: Segmento abierto
+        dfs: df global de cada término del segmento
+        term_ids: Recorre solo estos términos (ascendentes); None = todo el segmento
+        shifts: Con term_ids, (cambio de ln g, cambio de (ln g)^2) por término
+            en lugar de ln g: devuelve los incrementos de B y C (A queda a 0)
+    """
+    logs = np.log(np.maximum(np.asarray(dfs, dtype=np.float64), 1))
+    sums = np.zeros((3, segment.doc_count), dtype=np.float64)
+    if term_ids is None:
+        blocks = segment.iter_postings()
+    else:
+        blocks = segment.iter_term_postings(term_ids)
+    for ids, docs, tfs in blocks:
+        squares = np.asarray(tfs, dtype=np.float64) ** 2
+        if shifts is None:
+            term_logs = logs[ids]
+            sums[0] += np.bincount(docs, weights=squares, minlength=segment.doc_count)
+            sums[1] += np.bincount(docs, weights=squares * term_logs, minlength=segment.doc_count)
+            sums[2] += np.bincount(docs, weights=squares * term_logs * term_logs, minlength=segment.doc_count)
+        else:
+            sums[1] += np.bincount(docs, weights=squares * shifts[0][ids], minlength=segment.doc_count)
+            sums[2] += np.bincount(docs, weights=squares * shifts[1][ids], minlength=segment.doc_count)
+    return sums
+
+
+def global_doc_norms(sums: np.ndarray, doc_count: int) -> np.ndarray:
+    """Normas TF-IDF (float32, como docnorm.npy) a partir de las sumas A, B, C y el N global"""
+    if doc_count <= 0:
+        return np.zeros(sums.shape[1], dtype=np.float32)
+    log_n = math.log(doc_count)
+    squares = log_n * log_n * sums[0] - 2 * log_n * sums[1] + sums[2]
+    return np.sqrt(np.maximum(squares, 0)).astype(np.float32)
+
+
+def open_index(index_path: str):
+    """Abre un índice: Segment si es un segmento único, SegmentSet si tiene manifiesto"""
+    if read_manifest(index_path) is not None:
+        return SegmentSet(index_path)
+    return Segment(index_path)
+
+
+class _DocIdView:
+    """doc_id por ordinal global"""
+
+    def __init__(self, segment_set: "SegmentSet"):
+        self.segment_set = segment_set
+
+    def __len__(self) -> int:
+        return len(self.segment_set.doc_lengths)
+
+    def __getitem__(self, ordinal: int) -> str:
+        s, local = self.segment_set.locate(ordinal)
+        return self.segment_set.segments[s].doc_ids[local]
+
+
+class SegmentSet:
+    """Lector de un índice de varios segmentos con borrados"""
+
+    def __init__(self, index_path: str):
+        manifest = read_manifest(index_path)
+        if manifest is None:
+            raise FileNotFoundError(f"No se encontró el índice en {index_path}")
+        self.index_path = index_path
+        self.generation = manifest['generation']
+        self.names = list(manifest['segments'])
+        self.segments = [Segment(os.path.join(index_path, name)) for name in self.names]
+        tombstones = manifest.get('tombstones', {})
+        self.deleted = [load_tombstones(os.path.join(index_path, name), segment.doc_count, tombstones.get(name))
+                        for name, segment in zip(self.names, self.segments)]
+        self.has_deletes = [bool(mask.any()) for mask in self.deleted]
+
+        counts = [segment.doc_count for segment in self.segments]
+        self.bases = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+        # Tablas por ordinal global (incluye los borrados, que nunca aparecen en postings)
+        self.doc_lengths = np.concatenate([s.doc_lengths for s in self.segments] +
+                                          [np.zeros(0, dtype=np.int32)])
+        self.deleted_mask = np.concatenate(self.deleted + [np.zeros(0, dtype=bool)])
+        self.doc_ids = _DocIdView(self)
+        self.has_positions = bool(self.segments) and all(s.has_positions for s in self.segments)
+        self.has_term_vectors = bool(self.segments) and all(s.has_term_vectors for s in self.segments)
+        # IndexWriter no mezcla tokenizadores: el del primer segmento vale para todos
+        self.fast_tokenizer = bool(self.segments) and self.segments[0].fast_tokenizer
+
+        # Estadísticas globales sobre los documentos vivos
+        self.doc_count = int(len(self.deleted_mask) - self.deleted_mask.sum())
+        self.total_doc_length = int(self.doc_lengths[~self.deleted_mask].sum())
+        self.avg_doc_length = self.total_doc_length / self.doc_count if self.doc_count > 0 else 0
+        # Normas con el idf global de esta generación; sin sumas guardadas
+        # (índice de una versión anterior), las de cada segmento con su idf local
+        versions = manifest.get('norms', {})
+        if all(name in versions for name in self.names):
+            sums = [load_norm_state(os.path.join(index_path, name), versions[name])[0] for name in self.names]
+            self.doc_norms = global_doc_norms(np.concatenate(sums + [np.zeros((3, 0))], axis=1), self.doc_count)
+        else:
+            self.doc_norms = np.concatenate([s.doc_norms for s in self.segments] +
+                                            [np.zeros(0, dtype=np.float32)])
+        self._live_dfs = [LRUCache(LIVE_DF_CACHE_SIZE) for _ in self.segments]
+        self._postings_memo = None
+
+    @property
+    def term_count(self) -> int:
+        """Suma de los diccionarios de cada segmento (un término puede contarse varias veces)"""
+        return sum(segment.term_count for segment in self.segments)
+
+    def locate(self, ordinal: int) -> Tuple[int, int]:
+        """(segmento, ordinal local) de un ordinal global"""
+        s = int(np.searchsorted(self.bases, ordinal, side='right')) - 1
+        return s, ordinal - int(self.bases[s])
+
+    def _segment_postings(self, s: int, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Postings vivas de un segmento con ordinales locales"""
+        docs, tfs = self.segments[s].postings(term)
+        if self.has_deletes[s] and len(docs):
+            live = ~self.deleted[s][docs]
+            docs, tfs = docs[live], tfs[live]
+        return docs, tfs
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(ordinales globales, tfs) del término en todos los segmentos, sin borrados"""
+        if self._postings_memo is not None and term in self._postings_memo:
+            return self._postings_memo[term]
+        parts = [self._segment_postings(s, term) for s in range(len(self.segments))]
+        docs = np.concatenate([docs + self.bases[s] for s, (docs, _) in enumerate(parts)] +
+                              [np.zeros(0, dtype=np.int64)])
+        tfs = np.concatenate([tfs for _, tfs in parts] + [np.zeros(0, dtype=np.int64)])
+        if self._postings_memo is not None:
+            self._postings_memo[term] = docs, tfs
+        return docs, tfs
+
+    @contextmanager
+    def shared_postings(self):
+        """Dentro del bloque, cada término se decodifica una sola vez"""
+        outer = self._postings_memo is not None
+        if not outer:
+            self._postings_memo = {}
+        try:
+            yield
+        finally:
+            if not outer:
+                self._postings_memo = None
+
+    def _by_segment(self, docs: np.ndarray):
+        """Agrupa ordinales globales por segmento: (segmento, índices en docs, ordinales locales)"""
+        owners = np.searchsorted(self.bases, docs, side='right') - 1
+        for s in np.unique(owners).tolist():
+            wanted = np.flatnonzero(owners == s)
+            yield s, wanted, docs[wanted] - self.bases[s]
+
+    def term_frequencies(self, term: str, docs) -> np.ndarray:
+        """tf del término en cada documento (ordinales globales) de `docs`"""
+        docs = np.asarray(docs, dtype=np.int64)
+        tfs = np.zeros(len(docs), dtype=np.int64)
+        for s, wanted, local in self._by_segment(docs):
+            tfs[wanted] = self.segments[s].term_frequencies(term, local)
+        return tfs
+
+    def positions(self, term: str, docs) -> List[np.ndarray]:
+        """Posiciones del término en cada documento (ordinales globales) de `docs`"""
+        docs = np.asarray(docs, dtype=np.int64)
+        result = [np.zeros(0, dtype=np.int64)] * len(docs)
+        for s, wanted, local in self._by_segment(docs):
+            for i, positions in zip(wanted.tolist(), self.segments[s].positions(term, local)):
+                result[i] = positions
+        return result
+
+    def term_vectors(self, docs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(fila en docs, término, tf) de los documentos (ordinales globales) de `docs`"""
+        docs = np.asarray(docs, dtype=np.int64)
+        parts = []
+        for s, wanted, local in self._by_segment(docs):
+            rows, terms, tfs = self.segments[s].term_vectors(local)
+            parts.append((wanted[rows], terms, tfs))
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=object), np.zeros(0, dtype=np.int64)
+        return tuple(np.concatenate([part[i] for part in parts]) for i in range(3))
+
+    def segment_df(self, s: int, term: str) -> int:
+        """Frecuencia documental viva del término en un segmento"""
+        if not self.has_deletes[s]:
+            return self.segments[s].df(term)
+        df = self._live_dfs[s].get(term)
+        if df is None:
+            df = len(self._segment_postings(s, term)[0])
+            self._live_dfs[s].put(term, df)
+        return df
+
+    def df(self, term: str) -> int:
+        """Frecuencia documental global sobre los documentos vivos"""
+        return sum(self.segment_df(s, term) for s in range(len(self.segments)))
+
+    def doc_ordinal(self, doc_id: str) -> int:
+        """Ordinal global de un doc_id vivo (el segmento más reciente primero), o -1"""
+        for s in range(len(self.segments) - 1, -1, -1):
+            local = self.segments[s].doc_ordinal(doc_id)
+            if local >= 0 and not self.deleted[s][local]:
+                return int(self.bases[s]) + local
+        return -1
+
+    def doc_text(self, doc_id: str, default: str = "") -> str:
+        """Texto de un documento leído bajo demanda"""
+        ordinal = self.doc_ordinal(doc_id)
+        if ordinal < 0:
+            return default
+        s, local = self.locate(ordinal)
+        return self.segments[s].docstore.get(local)
+
+    def doc_snippet(self, doc_id: str, max_chars: int, default: str = "") -> str:
+        """Primeros max_chars caracteres de un documento, sin descomprimirlo entero"""
+        ordinal = self.doc_ordinal(doc_id)
+        if ordinal < 0:
+            return default
+        s, local = self.locate(ordinal)
+        return self.segments[s].docstore.snippet(local, max_chars)
+
+
+class SegmentSetWand:
+    """BlockMax-WAND por segmento con estadísticas globales y fusión de los top-k"""
+
+    def __init__(self, segment_set: SegmentSet):
+        self.segment_set = segment_set
+        self.processors = [WandProcessor(segment) for segment in segment_set.segments]
+        self.postings_scored = 0
+        self.postings_decoded = 0
+
+    def bm25(self, query_terms: List[str], k: int, k1: float, b: float,
+             weights: Optional[Dict[str, float]] = None) -> List[Tuple[int, float]]:
+        """Top-k BM25 global: el top-k de cada segmento contiene su parte del top-k global"""
+        segment_set = self.segment_set
+        idfs = {}
+        for term in set(query_terms):
+            df = segment_set.df(term)
+            idfs[term] = math.log((segment_set.doc_count - df + 0.5) / (df + 0.5))
+            if weights is not None:
+                idfs[term] *= weights[term]
+        # (score, posición del primer término de la consulta, ordinal global):
+        # el mismo desempate que WandProcessor dentro de un segmento
+        ranked = []
+        for s, processor in enumerate(self.processors):
+            deleted = segment_set.deleted[s] if segment_set.has_deletes[s] else None
+            top = processor.bm25(query_terms, k, k1, b, idfs, segment_set.avg_doc_length, deleted,
+                                 with_first=True)
+            base = int(segment_set.bases[s])
+            ranked.extend((score, first, base + doc) for doc, score, first in top)
+        self.postings_scored = sum(p.postings_scored for p in self.processors)
+        self.postings_decoded = sum(p.postings_decoded for p in self.processors)
+        ranked.sort(key=lambda item: (-item[0], item[1], item[2]))
+        return [(doc, score) for score, _, doc in ranked[:k]]
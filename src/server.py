@@ -0,0 +1,291 @@
+"""
+Servidor de búsqueda HTTP (asyncio, JSON) que mantiene el índice cargado.
+
+Las peticiones que llegan dentro de una ventana corta se agrupan en lotes
+(micro-batching) y cada lote se puntúa en un pool de procesos; dentro de un
+lote las postings de los términos compartidos se decodifican una sola vez.
+
+Uso: python -m src.server --port 8080 --workers 4
+     GET /search?q=texto&model=bm25|tfidf&k=10
+     GET /search?q=a+AND+(b+OR+c)+NOT+d&mode=boolean|and|fallback&k=10
+     GET /stats
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit, parse_qs
+from .boolean import BOOLEAN_MODES, parse_query, positive_terms
+from .retrieval import RetrievalSystem
+from .sharding import is_sharded
+
+MODELS = ("bm25", "tfidf")
+MAX_K = 1000
+# Tamaño máximo de la cabecera de una petición
+MAX_REQUEST_BYTES = 1 << 16
+
+# Sistema de recuperación de cada proceso worker (abre el mismo índice con mmap)
+_worker_system = None
+
+def _init_worker(index_path: str, backend: str):
+    """Inicializa el worker abriendo el índice una sola vez"""
+    global _worker_system
+    _worker_system = RetrievalSystem(index_path, backend=backend)
+
+def _search_batch(requests: List[Tuple[str, str, int, str, str]]) -> List[List[Tuple[str, float]]]:
+    """Worker: ejecuta un lote de (modelo, consulta, k, estrategia, modo) compartiendo postings"""
+    system = _worker_system
+    system.refresh()  # recoge los segmentos publicados por el indexado incremental
+    results = []
+    with system.segment.shared_postings():
+        for model, query, k, strategy, mode in requests:
+            if mode is not None:
+                try:
+                    results.append(system.boolean_search(query, k, mode=mode))
+                except ValueError:
+                    # Solo llega si el preprocesamiento deja la consulta sin términos positivos
+                    results.append([])
+            elif model == "tfidf":
+                results.append(system.tfidf_search(query, k))
+            else:
+                results.append(system.bm25_search(query, k, strategy=strategy))
+    return results
+
+
+class MicroBatcher:
+    """Agrupa las peticiones concurrentes en lotes antes de enviarlas al pool"""
+
+    def __init__(self, run_batch, window: float = 0.002, max_batch: int = 32):
+        """
+        Args:
+            run_batch: Corrutina que recibe una lista de peticiones y devuelve sus resultados
+            window: Segundos que se espera a más peticiones tras la primera del lote
+            max_batch: Peticiones a partir de las cuales el lote se envía sin esperar
+        """
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, request):
+        """Encola una petición y espera su resultado"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((request, future))
+        if len(self._pending) >= self.max_batch:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.batches += 1
+            self.requests += len(batch)
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            outputs = await self.run_batch([request for request, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), output in zip(batch, outputs):
+            if not future.done():
+                future.set_result(output)
+
+    def stats(self) -> Dict:
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'avg_batch_size': self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+class SearchServer:
+    """Servidor HTTP/1.1 mínimo sobre asyncio con pool de workers de scoring"""
+
+    def __init__(self, index_path: str = "data/index", workers: int = 2, backend: str = "python",
+                 batch_window: float = 0.002, max_batch: int = 32):
+        """
+        Args:
+            index_path: Ruta al directorio del índice
+            workers: Procesos de scoring (0 = un hilo en el propio proceso)
+            backend: Motor de scoring de RetrievalSystem
+            batch_window: Ventana de micro-batching en segundos
+            max_batch: Tamaño máximo de lote
+        """
+        self.index_path = index_path
+        self.workers = workers
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(index_path, backend))
+        else:
+            # Un solo hilo: RetrievalSystem no es seguro entre hilos
+            self.pool = ThreadPoolExecutor(max_workers=1, initializer=_init_worker,
+                                           initargs=(index_path, backend))
+        self.batcher = MicroBatcher(self._run_batch, batch_window, max_batch)
+        self.started = time.time()
+
+    async def _run_batch(self, requests):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, _search_batch, requests)
+
+    async def handle_search(self, params: Dict[str, List[str]]) -> Tuple[int, Dict]:
+        """Valida los parámetros de /search y encola la consulta"""
+        query = params.get('q', [''])[0].strip()
+        model = params.get('model', ['bm25'])[0]
+        strategy = params.get('strategy', ['exhaustive'])[0]
+        mode = params.get('mode', [None])[0]
+        if not query:
+            return 400, {'error': "Falta el parámetro q"}
+        if model not in MODELS:
+            return 400, {'error': f"Modelo desconocido: {model}. Opciones: {', '.join(MODELS)}"}
+        if strategy not in RetrievalSystem.STRATEGIES:
+            return 400, {'error': f"Estrategia desconocida: {strategy}"}
+        if mode is not None and (mode not in BOOLEAN_MODES or model != "bm25"):
+            return 400, {'error': f"Modo desconocido: {mode}. Opciones con model=bm25: {', '.join(BOOLEAN_MODES)}"}
+        if mode == "boolean":
+            # La sintaxis se valida aquí: un error en el worker haría fallar todo el lote
+            try:
+                tree = parse_query(query, lambda word: [word])
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            if tree is not None and not positive_terms(tree):
+                return 400, {'error': "NOT necesita un término positivo con el que combinarse"}
+        try:
+            k = int(params.get('k', ['10'])[0])
+        except ValueError:
+            return 400, {'error': "k debe ser un entero"}
+        if not 1 <= k <= MAX_K:
+            return 400, {'error': f"k debe estar entre 1 y {MAX_K}"}
+
+        start = time.perf_counter()
+        results = await self.batcher.submit((model, query, k, strategy, mode))
+        return 200, {
+            'query': query,
+            'model': model,
+            'k': k,
+            'results': [{'doc_id': doc_id, 'score': score} for doc_id, score in results],
+            'took_ms': (time.perf_counter() - start) * 1000,
+        }
+
+    async def route(self, method: str, target: str) -> Tuple[int, Dict]:
+        url = urlsplit(target)
+        if method != "GET":
+            return 405, {'error': "Solo se admite GET"}
+        if url.path == "/search":
+            return await self.handle_search(parse_qs(url.query))
+        if url.path == "/stats":
+            return 200, {'workers': self.workers, 'uptime_seconds': time.time() - self.started,
+                         'batching': self.batcher.stats()}
+        return 404, {'error': f"Ruta desconocida: {url.path}"}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Atiende las peticiones de una conexión (keep-alive de HTTP/1.1)"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 431, {'error': "Cabecera demasiado grande"}, False)
+                    break
+                lines = head.decode('latin1').split("\r\n")
+                parts = lines[0].split()
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if len(parts) != 3:
+                    await self._respond(writer, 400, {'error': "Petición mal formada"}, False)
+                    break
+                method, target, version = parts
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == "HTTP/1.1"
+                # Las peticiones GET no llevan cuerpo; se descarta si lo hubiera
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {'error': "Content-Length no válido"}, False)
+                    break
+                if length:
+                    await reader.readexactly(length)
+                try:
+                    status, body = await self.route(method, target)
+                except Exception as e:
+                    status, body = 500, {'error': str(e)}
+                await self._respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: Dict, keep_alive: bool):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                   431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+        head = (f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin1') + payload)
+        await writer.drain()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        """Arranca el servidor y atiende conexiones hasta que se interrumpa"""
+        # Arranca los workers (que abren el índice) antes de aceptar peticiones
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _search_batch, [])
+                               for _ in range(max(1, self.workers))])
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_BYTES)
+        print(f"Servidor de búsqueda en http://{host}:{port} "
+              f"({self.workers} workers, pid {os.getpid()})")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def main(argv=None):
+    """Función principal del servidor de búsqueda"""
+    parser = argparse.ArgumentParser(description="Servidor de búsqueda HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--index", default="data/index", help="directorio del índice")
+    parser.add_argument("--workers", type=int, default=2, help="procesos de scoring (0 = en proceso)")
+    parser.add_argument("--backend", default="python", choices=RetrievalSystem.BACKENDS)
+    parser.add_argument("--batch-window-ms", type=float, default=2.0, help="ventana de micro-batching")
+    parser.add_argument("--max-batch", type=int, default=32, help="tamaño máximo de lote")
+    args = parser.parse_args(argv)
+    if is_sharded(args.index):
+        # Cada worker ya sería un coordinador con un proceso por shard
+        parser.error(f"{args.index} es un índice particionado: el servidor necesita el índice sin particionar "
+                     f"(o python -m src.cli --index {args.index})")
+
+    server = SearchServer(args.index, args.workers, args.backend,
+                          args.batch_window_ms / 1000, args.max_batch)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\nServidor detenido")
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""
+Índice particionado en shards con búsqueda scatter-gather entre procesos.
+
+Los documentos se reparten round-robin por ordinal global (el documento g va
+al shard g % N con ordinal local g // N), de modo que cada shard conserva el
+orden relativo del índice completo. Cada shard es un segmento normal cuyas
+normas TF-IDF se calculan con el idf global; el coordinador calcula df,
+doc_count y longitud media globales, consulta los shards en paralelo (un
+proceso por shard) y fusiona los top-k con el mismo desempate que el índice
+sin particionar, por lo que los resultados son idénticos.
+
+Uso: python -m src.sharding split data/index data/shards --shards 4
+     python -m src.sharding verify --index data/index --shards data/shards
+"""
+import argparse
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from .cache import LRUCache
+from .docstore import DocStore
+from .instrumentation import make_metrics
+from .merge import merge_into
+from .preprocesamiento import preprocess_text
+from .scoring import VectorizedScorer
+from .segment import Segment, SegmentWriter, global_term_dfs, rebuild_doc_norms, set_fast_tokenizer, tfidf_idf
+
+SHARDS_FILE = "shards.json"
+
+
+def shard_path(index_path: str, shard: int) -> str:
+    return os.path.join(index_path, f"shard_{shard:03d}")
+
+
+def is_sharded(index_path: str) -> bool:
+    """Indica si el directorio contiene un índice particionado (con shards.json)"""
+    return os.path.exists(os.path.join(index_path, SHARDS_FILE))
+
+
+class ShardedWriter:
+    """Escritor con la interfaz de SegmentWriter que reparte los documentos en shards"""
+
+    def __init__(self, index_path: str, shards: int, positions: bool = False, term_vectors: bool = False):
+        if shards < 1:
+            raise ValueError("El número de shards debe ser al menos 1")
+        os.makedirs(index_path, exist_ok=True)
+        self.index_path = index_path
+        self.shards = shards
+        self.positions = positions
+        self.term_vectors = term_vectors
+        self.writers = [SegmentWriter(shard_path(index_path, s), positions, term_vectors)
+                        for s in range(shards)]
+        self.doc_count = 0
+        self._text_count = 0
+
+    def _split(self, start: int, values: Sequence) -> List[Sequence]:
+        """Reparte una secuencia que empieza en el ordinal global `start` entre los shards"""
+        return [values[(s - start) % self.shards::self.shards] for s in range(self.shards)]
+
+    def add_documents(self, doc_ids: Sequence[str], doc_lengths: Sequence[int],
+                      doc_texts: Optional[Sequence[str]] = None) -> None:
+        """Añade documentos; el ordinal global g va al shard g % N"""
+        ids, lengths = self._split(self.doc_count, doc_ids), self._split(self.doc_count, doc_lengths)
+        for writer, shard_ids, shard_lengths in zip(self.writers, ids, lengths):
+            writer.add_documents(shard_ids, shard_lengths)
+        self.doc_count += len(doc_ids)
+        if doc_texts is not None:
+            self.add_texts(doc_texts)
+
+    def add_texts(self, doc_texts: Sequence[str]) -> None:
+        """Añade los textos de los siguientes documentos añadidos sin texto"""
+        for writer, texts in zip(self.writers, self._split(self._text_count, doc_texts)):
+            writer.add_texts(texts)
+        self._text_count += len(doc_texts)
+
+    def add_docstore(self, store: DocStore) -> None:
+        """Reparte los textos de un almacén (se recomprimen en cada shard)"""
+        texts = []
+        for i in range(len(store)):
+            texts.append(store.get(i))
+            if len(texts) >= 10000:
+                self.add_texts(texts)
+                texts = []
+        self.add_texts(texts)
+
+    def add_postings(self, term: str, docs: Sequence[int], tfs: Sequence[int],
+                     positions: Optional[Sequence[int]] = None) -> None:
+        """Reparte la lista de postings del término (y sus posiciones) con ordinales locales"""
+        docs = np.asarray(docs, dtype=np.int64)
+        tfs = np.asarray(tfs, dtype=np.int64)
+        shards = docs % self.shards
+        order = np.argsort(shards, kind='stable')
+        bounds = np.cumsum(np.bincount(shards, minlength=self.shards))
+        if self.positions:
+            positions = np.asarray(positions, dtype=np.int64)
+            position_shards = np.repeat(shards, tfs)
+            position_order = np.argsort(position_shards, kind='stable')
+            position_bounds = np.cumsum(np.bincount(position_shards, minlength=self.shards)).tolist()
+        start = position_start = 0
+        for s, (writer, end) in enumerate(zip(self.writers, bounds.tolist())):
+            if end > start:
+                selected = order[start:end]
+                shard_positions = None
+                if self.positions:
+                    shard_positions = positions[position_order[position_start:position_bounds[s]]]
+                    position_start = position_bounds[s]
+                writer.add_postings(term, docs[selected] // self.shards, tfs[selected], shard_positions)
+            start = end
+
+    def close(self) -> None:
+        """Cierra los shards, recalcula sus normas con el idf global y escribe shards.json"""
+        for writer in self.writers:
+            writer.close()
+        paths = [shard_path(self.index_path, s) for s in range(self.shards)]
+        segments = [Segment(path) for path in paths]
+        for path, dfs in zip(paths, global_term_dfs(segments)):
+            rebuild_doc_norms(path, tfidf_idf(dfs, self.doc_count))
+        total_doc_length = sum(segment.total_doc_length for segment in segments)
+        meta = {
+            'shard_count': self.shards,
+            'doc_count': self.doc_count,
+            'total_doc_length': total_doc_length,
+            'avg_doc_length': total_doc_length / self.doc_count if self.doc_count > 0 else 0,
+        }
+        with open(os.path.join(self.index_path, SHARDS_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+
+def write_sharded(index_path: str, shards: int, postings: Dict[str, Tuple[Sequence[int], Sequence[int]]],
+                  doc_ids: Sequence[str], doc_lengths: Sequence[int],
+                  doc_texts: Optional[Sequence[str]] = None, docstore: Optional[str] = None,
+                  positions: bool = False, term_vectors: bool = False) -> None:
+    """Equivalente a write_segment que escribe un índice particionado en `shards` shards"""
+    writer = ShardedWriter(index_path, shards, positions, term_vectors)
+    writer.add_documents(doc_ids, doc_lengths, doc_texts)
+    if docstore is not None:
+        writer.add_docstore(DocStore(docstore))
+    for term in sorted(postings, key=lambda t: t.encode('utf-8')):
+        writer.add_postings(term, *postings[term])
+    writer.close()
+
+
+def split_index(index_path: str, output_path: str, shards: int) -> None:
+    """Particiona un índice ya construido sin volver a preprocesar los documentos"""
+    segment = Segment(index_path)
+    merge_into([index_path], ShardedWriter(output_path, shards, segment.has_positions, segment.has_term_vectors))
+    for s in range(shards):
+        set_fast_tokenizer(shard_path(output_path, s), segment.fast_tokenizer)
+    print(f"Índice {index_path} particionado en {shards} shards en {output_path}")
+
+
+# Shard atendido por cada proceso worker: (segmento, scorer con estadísticas globales)
+_shard = None
+
+def _init_shard(path: str, doc_count: int, avg_doc_length: float):
+    """Inicializa el worker abriendo su shard una sola vez"""
+    global _shard
+    segment = Segment(path)
+    # float64: mismas operaciones y redondeos que el motor en Python sin particionar
+    _shard = segment, VectorizedScorer(segment, np.float64, doc_count, avg_doc_length)
+
+def _search_shard(shard: int, shard_count: int, model: str, query_terms: List[str], k: int,
+                  dfs: Dict[str, int], query_vector: Dict[str, float], k1: float, b: float):
+    """
+    Worker: top-k de un shard con estadísticas globales.
+
+    Returns:
+        Lista de (score, posición del primer término de la consulta, ordinal global, doc_id)
+    """
+    segment, scorer = _shard
+    with segment.shared_postings():
+        if model == "tfidf":
+            ranked = scorer.tfidf(query_vector, query_terms, k, dfs)
+        else:
+            ranked = scorer.bm25(query_terms, k, k1, b, dfs)
+        # Primer término de la consulta que contiene a cada documento (desempate global)
+        ordinals = np.array([doc for doc, _ in ranked], dtype=np.int64)
+        first = np.full(len(ranked), len(query_terms))
+        for position, term in enumerate(query_terms):
+            docs, _ = segment.postings(term)
+            first[(first == len(query_terms)) & np.isin(ordinals, docs)] = position
+    return [(score, position, doc * shard_count + shard, segment.doc_ids[doc])
+            for (doc, score), position in zip(ranked, first.tolist())]
+
+
+class ShardedTexts:
+    """Vista tipo diccionario {doc_id: texto} sobre todos los shards"""
+
+    def __init__(self, shards: List[Segment]):
+        self.shards = shards
+
+    def get(self, doc_id: str, default: str = None) -> str:
+        for shard in self.shards:
+            if shard.doc_ordinal(doc_id) >= 0:
+                return shard.doc_text(doc_id, default)
+        return default
+
+    def snippet(self, doc_id: str, max_chars: int, default: str = None) -> str:
+        for shard in self.shards:
+            if shard.doc_ordinal(doc_id) >= 0:
+                return shard.doc_snippet(doc_id, max_chars, default)
+        return default
+
+
+class ShardedRetrievalSystem:
+    """Coordinador scatter-gather con la misma interfaz de búsqueda que RetrievalSystem"""
+
+    def __init__(self, index_path: str = "data/shards", cache_size: int = 1024, instrument: bool = False):
+        """
+        Args:
+            index_path: Directorio del índice particionado
+            cache_size: Entradas máximas de la caché de consultas preprocesadas
+            instrument: Acumula en self.metrics el tiempo de cada scatter-gather
+        """
+        meta_path = os.path.join(index_path, SHARDS_FILE)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No se encontró el índice particionado en {index_path}")
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.index_path = index_path
+        self.metrics = make_metrics(instrument)
+        self.shard_count = self.meta['shard_count']
+        self.doc_count = self.meta['doc_count']
+        self.avg_doc_length = self.meta['avg_doc_length']
+        paths = [shard_path(index_path, s) for s in range(self.shard_count)]
+        # El coordinador solo consulta los diccionarios (df) de los shards abiertos con mmap
+        self.shards = [Segment(path) for path in paths]
+        self.fast_tokenizer = self.shards[0].fast_tokenizer if self.shards else False
+        self.pools = [ProcessPoolExecutor(max_workers=1, initializer=_init_shard,
+                                          initargs=(path, self.doc_count, self.avg_doc_length))
+                      for path in paths]
+        self.terms_cache = LRUCache(cache_size)
+        self.doc_texts = ShardedTexts(self.shards)
+        print(f"Índice particionado cargado: {self.doc_count} documentos en {self.shard_count} shards")
+
+    def query_terms(self, query: str) -> List[str]:
+        """Preprocesa la consulta una sola vez"""
+        terms = self.terms_cache.get(query)
+        if terms is None:
+            terms = preprocess_text(query, self.fast_tokenizer)
+            self.terms_cache.put(query, terms)
+        return list(terms)
+
+    def _dfs(self, query_terms: List[str]) -> Dict[str, int]:
+        """df global de los términos de la consulta"""
+        return {term: sum(shard.df(term) for shard in self.shards) for term in set(query_terms)}
+
+    def _query_vector(self, query_terms: List[str], dfs: Dict[str, int]) -> Dict[str, float]:
+        """Vector TF-IDF de la consulta con el idf global"""
+        term_freq = defaultdict(int)
+        for term in query_terms:
+            term_freq[term] += 1
+        return {term: tf * math.log(self.doc_count / dfs[term]) if dfs[term] > 0 else 0
+                for term, tf in term_freq.items()}
+
+    def tfidf_search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Búsqueda TF-IDF con similitud coseno sobre todos los shards"""
+        query_terms = self.query_terms(query)
+        if not query_terms:
+            return []
+        dfs = self._dfs(query_terms)
+        return self._gather("tfidf", query_terms, k, dfs, self._query_vector(query_terms, dfs), 0, 0)
+
+    def bm25_search(self, query: str, k: int = 10, k1: float = 1.5, b: float = 0.75) -> List[Tuple[str, float]]:
+        """Búsqueda BM25 sobre todos los shards"""
+        query_terms = self.query_terms(query)
+        if not query_terms:
+            return []
+        return self._gather("bm25", query_terms, k, self._dfs(query_terms), None, k1, b)
+
+    def search_batch(self, queries: List[str], model: str = "bm25", k: int = 10, k1: float = 1.5,
+                     b: float = 0.75) -> List[List[Tuple[str, float]]]:
+        """Lote de consultas con la interfaz de RetrievalSystem.search_batch (una a una)"""
+        if model == "tfidf":
+            return [self.tfidf_search(query, k) for query in queries]
+        if model == "bm25":
+            return [self.bm25_search(query, k, k1, b) for query in queries]
+        raise ValueError(f"Modelo desconocido: {model}. Opciones: tfidf, bm25")
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Contadores de la caché de consultas preprocesadas"""
+        return {'terms': self.terms_cache.stats()}
+
+    def _gather(self, model: str, query_terms: List[str], k: int, dfs: Dict[str, int],
+                query_vector: Optional[Dict[str, float]], k1: float, b: float) -> List[Tuple[str, float]]:
+        """Envía la consulta a todos los shards en paralelo y fusiona sus top-k"""
+        with self.metrics.timer(f'{model}.gather'):
+            futures = [pool.submit(_search_shard, shard, self.shard_count, model, query_terms, k,
+                                   dfs, query_vector, k1, b)
+                       for shard, pool in enumerate(self.pools)]
+            results = list(chain.from_iterable(future.result() for future in futures))
+        # Mismo desempate que el índice completo: orden de aparición en las postings
+        ranked = sorted(results, key=lambda r: (-r[0], r[1], r[2]))[:k]
+        return [(doc_id, score) for score, _, _, doc_id in ranked]
+
+    def close(self):
+        for pool in self.pools:
+            pool.shutdown()
+
+
+def verify(index_path: str, shards_path: str, queries: List[str], k: int = 100) -> Dict:
+    """Compara los rankings del índice particionado con los del índice completo"""
+    from .retrieval import RetrievalSystem
+    single = RetrievalSystem(index_path, cache_size=0)
+    sharded = ShardedRetrievalSystem(shards_path, cache_size=0)
+    report = {'queries': len(queries), 'mismatches': 0, 'single_seconds': 0.0, 'sharded_seconds': 0.0}
+    try:
+        for query in queries:
+            for model in ("tfidf", "bm25"):
+                start = time.perf_counter()
+                expected = getattr(single, f"{model}_search")(query, k)
+                middle = time.perf_counter()
+                actual = getattr(sharded, f"{model}_search")(query, k)
+                report['single_seconds'] += middle - start
+                report['sharded_seconds'] += time.perf_counter() - middle
+                if actual != expected:
+                    report['mismatches'] += 1
+                    print(f"Diferencia en {model}: {query!r}")
+    finally:
+        sharded.close()
+    return report
+
+
+def main(argv=None):
+    """Particionado y verificación de índices en shards"""
+    parser = argparse.ArgumentParser(description="Índice particionado en shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    split = commands.add_parser("split", help="particiona un índice ya construido")
+    split.add_argument("index", nargs="?", default="data/index")
+    split.add_argument("output", nargs="?", default="data/shards")
+    split.add_argument("--shards", type=int, default=4)
+    check = commands.add_parser("verify", help="compara los resultados con el índice sin particionar")
+    check.add_argument("--index", default="data/index")
+    check.add_argument("--shards", default="data/shards")
+    check.add_argument("--dataset", default="car/v1.5/test200")
+    check.add_argument("-k", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.command == "split":
+        split_index(args.index, args.output, args.shards)
+        return
+    import ir_datasets
+    queries = [q.text for q in ir_datasets.load(args.dataset).queries_iter()]
+    report = verify(args.index, args.shards, queries, args.k)
+    print(f"Consultas: {report['queries']}, rankings distintos: {report['mismatches']}")
+    print(f"Tiempo: índice completo {report['single_seconds']:.2f}s, "
+          f"particionado {report['sharded_seconds']:.2f}s")
+
+if __name__ == "__main__":
+    main()
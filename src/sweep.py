@@ -0,0 +1,128 @@
+"""
+Barrido de parámetros de BM25 sobre estadísticas por consulta en memoria.
+
+Las postings de cada consulta se decodifican una sola vez y se reúnen en
+arreglos densos (candidatos x términos de tf, longitudes e idf); después cada
+punto de la rejilla (k1, b) se puntúa con operaciones vectorizadas y se evalúa
+(MAP, P@k, R@k, nDCG@k con trec_eval.evaluate_gains) sin volver a tocar el índice. Los scores se suman término a
+término en el orden de la consulta, como el motor en Python, por lo que cada
+punto reproduce exactamente el ranking de bm25_search(k1=..., b=...).
+"""
+import math
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from .scoring import top_k
+from .trec_eval import CUTOFFS, evaluate_gains, ideal_gains, relevant_counts
+
+# Rejilla por defecto: 10 x 10 puntos que incluyen los valores por defecto (1.5, 0.75)
+K1_GRID = (0.5, 0.7, 0.9, 1.1, 1.3, 1.5, 1.7, 1.9, 2.1, 2.3)
+B_GRID = (0.05, 0.15, 0.25, 0.35, 0.45, 0.55, 0.65, 0.75, 0.85, 0.95)
+# Documentos evaluados por consulta (como IREvaluator)
+DEPTH = max(CUTOFFS)
+# Celdas (puntos de la rejilla x candidatos) puntuadas a la vez: acota la memoria
+SWEEP_CELLS = 1 << 22
+
+
+class QueryStatistics:
+    """Postings de una consulta reunidas en arreglos densos una sola vez"""
+
+    def __init__(self, segment, query_terms: List[str], doc_count: int, avg_doc_length: float):
+        """
+        Args:
+            segment: Segment o SegmentSet abierto
+            query_terms: Términos preprocesados de la consulta (con repeticiones)
+            doc_count: Documentos de la colección (para el idf)
+            avg_doc_length: Longitud media de documento
+        """
+        self.avg_doc_length = avg_doc_length
+        postings = {}
+        with segment.shared_postings():
+            for term in query_terms:
+                if term not in postings:
+                    postings[term] = segment.postings(term)
+        terms = [term for term in postings if len(postings[term][0])]
+        # Términos con postings en el orden de la consulta, con sus repeticiones
+        self.order = [terms.index(term) for term in query_terms if term in terms]
+        self.idfs = np.array([math.log((doc_count - len(postings[term][0]) + 0.5) /
+                                       (len(postings[term][0]) + 0.5)) for term in terms], dtype=np.float64)
+        if not terms:
+            self.candidates = np.zeros(0, dtype=np.int64)
+            self.tfs = np.zeros((len(terms), 0), dtype=np.float64)
+            self.lengths = np.zeros(0, dtype=np.float64)
+            return
+        # Candidatos en orden de primera aparición (desempate del motor en Python)
+        all_docs = np.concatenate([postings[terms[j]][0] for j in dict.fromkeys(self.order)])
+        unique, first = np.unique(all_docs, return_index=True)
+        self.candidates = unique[np.argsort(first, kind='stable')]
+        position = np.empty(len(unique), dtype=np.int64)
+        position[np.argsort(first, kind='stable')] = np.arange(len(unique))
+        # tfs[j, i]: tf del término j en el candidato i (0 si no aparece)
+        self.tfs = np.zeros((len(terms), len(self.candidates)), dtype=np.float64)
+        for j, term in enumerate(terms):
+            docs, tfs = postings[term]
+            self.tfs[j, position[np.searchsorted(unique, docs)]] = tfs
+        self.lengths = np.asarray(segment.doc_lengths[self.candidates], dtype=np.float64)
+
+    def bm25(self, k1: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Scores BM25 (puntos x candidatos) para los pares (k1[g], b[g])"""
+        k1, b = k1[:, None], b[:, None]
+        norms = k1 * (1 - b + b * (self.lengths[None, :] / self.avg_doc_length))
+        scores = np.zeros((len(k1), len(self.candidates)), dtype=np.float64)
+        for j in self.order:
+            tfs = self.tfs[j][None, :]
+            scores += self.idfs[j] * ((tfs * (k1 + 1)) / (tfs + norms))
+        return scores
+
+
+def sweep_bm25(segment, queries: Sequence[Tuple[List[str], Dict[str, int]]], doc_count: int,
+               avg_doc_length: float, k1_values: Sequence[float] = K1_GRID,
+               b_values: Sequence[float] = B_GRID, depth: int = DEPTH) -> List[Dict]:
+    """
+    Evalúa BM25 en todos los puntos de la rejilla k1 x b.
+
+    Args:
+        segment: Segment o SegmentSet abierto
+        queries: (términos preprocesados, qrels {doc_id: relevancia}) de cada consulta
+        doc_count, avg_doc_length: Estadísticas de la colección
+        k1_values, b_values: Valores de la rejilla
+
+    Returns:
+        Un diccionario por punto (k1, b, map, avg_precision, avg_recall,
+        avg_ndcg), ordenados de mayor a menor MAP
+    """
+    grid = [(k1, b) for k1 in k1_values for b in b_values]
+    k1_array = np.array([k1 for k1, _ in grid], dtype=np.float64)
+    b_array = np.array([b for _, b in grid], dtype=np.float64)
+    totals = {name: np.zeros((len(grid), len(CUTOFFS))) for name in ('P', 'recall', 'ndcg_cut')}
+    totals['map'] = np.zeros(len(grid))
+
+    for query_terms, qrels in queries:
+        stats = QueryStatistics(segment, query_terms, doc_count, avg_doc_length)
+        length = min(depth, len(stats.candidates))
+        retrieved = np.zeros((len(grid), length), dtype=np.int64)
+        # Bloques de puntos de la rejilla que caben en SWEEP_CELLS celdas
+        step = max(1, SWEEP_CELLS // max(1, len(stats.candidates)))
+        for start in range(0, len(grid), step):
+            scores = stats.bm25(k1_array[start:start + step], b_array[start:start + step])
+            for g, row in enumerate(scores, start):
+                retrieved[g] = [doc for doc, _ in top_k(row, stats.candidates, depth)]
+        # Solo se traducen a doc_id los documentos recuperados en algún punto
+        unique, inverse = np.unique(retrieved, return_inverse=True)
+        relevance = np.array([qrels.get(segment.doc_ids[d], 0) for d in unique.tolist()], dtype=np.float64)
+        gains = np.maximum(relevance, 0.0)[inverse.reshape(retrieved.shape)]
+        # La misma consulta en cada fila: relevantes e ideal compartidos
+        measures = evaluate_gains(gains, np.repeat(relevant_counts([qrels]), len(grid)),
+                                  np.broadcast_to(ideal_gains([qrels]), (len(grid), max(CUTOFFS))))
+        for name, total in totals.items():
+            total += measures[name]
+
+    count = max(1, len(queries))
+    results = [{
+        'k1': k1, 'b': b,
+        'map': float(totals['map'][g] / count),
+        'avg_precision': (totals['P'][g] / count).tolist(),
+        'avg_recall': (totals['recall'][g] / count).tolist(),
+        'avg_ndcg': (totals['ndcg_cut'][g] / count).tolist(),
+    } for g, (k1, b) in enumerate(grid)]
+    results.sort(key=lambda point: point['map'], reverse=True)
+    return results
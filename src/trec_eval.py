@@ -0,0 +1,364 @@
+"""
+Métricas de evaluación vectorizadas compatibles con trec_eval.
+
+Una ejecución (el ranking de cada consulta) se convierte con los qrels en una
+matriz de ganancias consultas x posiciones (la relevancia de cada documento
+recuperado, 0 si no está juzgado) y todas las métricas se calculan a la vez
+con sumas acumuladas sobre esa matriz: AP/MAP, P@k, R@k, nDCG@k, R-Prec y
+Reciprocal Rank, con la semántica de trec_eval (P@k divide siempre entre k,
+relevante = relevancia >= 1, ganancia de nDCG = relevancia graduada). Incluye
+lectura y escritura de runs y qrels en formato TREC y tests de significancia
+pareados (t de Student y aleatorización) entre dos sistemas.
+"""
+import argparse
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Cortes de P@k, R@k y nDCG@k (como IREvaluator: 10, 20, ..., 100)
+CUTOFFS = tuple(range(10, 101, 10))
+# Relevancia mínima para que un documento cuente como relevante (-l de trec_eval)
+RELEVANCE_LEVEL = 1
+# Permutaciones del test de aleatorización y celdas (permutaciones x consultas) por bloque
+RANDOMIZATION_TRIALS = 10000
+RANDOMIZATION_CELLS = 1 << 22
+RUN_TAG = "ir-system"
+
+Run = Dict[str, List[Tuple[str, float]]]
+Qrels = Dict[str, Dict[str, int]]
+
+
+def relevance_matrix(run: Run, qrels: Qrels, query_ids: Sequence[str],
+                     depth: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Matriz de ganancias de la ejecución alineada con `query_ids`.
+
+    Args:
+        run: {query_id: [(doc_id, score), ...]} ya ordenado por ranking
+        qrels: {query_id: {doc_id: relevancia}}
+        query_ids: Consultas evaluadas (una fila cada una; sin ranking = fila vacía)
+        depth: Documentos evaluados por consulta (None = todos los recuperados)
+
+    Returns:
+        (ganancias consultas x posiciones, 0 tras el final de cada ranking;
+        documentos recuperados por consulta)
+    """
+    rankings = [run.get(query_id, []) for query_id in query_ids]
+    if depth is not None:
+        rankings = [ranking[:depth] for ranking in rankings]
+    width = max([len(ranking) for ranking in rankings] + [1])
+    gains = np.zeros((len(query_ids), width), dtype=np.float64)
+    retrieved = np.array([len(ranking) for ranking in rankings], dtype=np.int64)
+    for q, (query_id, ranking) in enumerate(zip(query_ids, rankings)):
+        judged = qrels.get(query_id, {})
+        gains[q, :len(ranking)] = [judged.get(doc_id, 0) for doc_id, _ in ranking]
+    return np.maximum(gains, 0.0), retrieved
+
+
+def ideal_gains(judgments: Sequence[Dict[str, int]], width: int = max(CUTOFFS)) -> np.ndarray:
+    """Ganancias de la ordenación ideal de los juicios de cada fila (nDCG)"""
+    ideal = np.zeros((len(judgments), width), dtype=np.float64)
+    for q, judged in enumerate(judgments):
+        values = sorted((rel for rel in judged.values() if rel > 0), reverse=True)[:width]
+        ideal[q, :len(values)] = values
+    return ideal
+
+
+def relevant_counts(judgments: Sequence[Dict[str, int]]) -> np.ndarray:
+    """Documentos relevantes juzgados de cada fila (estén o no en el índice)"""
+    return np.array([sum(1 for rel in judged.values() if rel >= RELEVANCE_LEVEL) for judged in judgments],
+                    dtype=np.int64)
+
+
+def evaluate_gains(gains: np.ndarray, relevant: np.ndarray, ideal: np.ndarray,
+                   retrieved: Optional[np.ndarray] = None,
+                   cutoffs: Sequence[int] = CUTOFFS) -> Dict[str, np.ndarray]:
+    """
+    Métricas de cada fila de una matriz de ganancias (filas = rankings).
+
+    Args:
+        gains: Relevancia de cada documento recuperado (filas x posiciones, 0 tras el final)
+        relevant: Documentos relevantes de cada fila
+        ideal: Ganancias ideales de cada fila, de mayor a menor (al menos max(cutoffs) columnas)
+        retrieved: Documentos recuperados de cada fila (None = todas las posiciones)
+        cutoffs: Cortes de P, recall y ndcg_cut
+
+    Returns:
+        {métrica: arreglo por fila}; P, recall y ndcg_cut tienen una columna por corte
+    """
+    rows, width = gains.shape
+    relevant = np.asarray(relevant, dtype=np.float64)
+    if retrieved is None:
+        retrieved = np.full(rows, width, dtype=np.int64)
+    if width == 0:
+        gains, width = np.zeros((rows, 1)), 1
+    hits = gains >= RELEVANCE_LEVEL
+    found = np.cumsum(hits, axis=1)
+    positions = np.arange(1, width + 1)
+    # Las divisiones entre 0 relevantes dan 0, como en trec_eval
+    denominator = np.where(relevant > 0, relevant, 1.0)
+    cut = np.minimum(np.asarray(cutoffs), width) - 1
+
+    measures = {
+        'map': np.sum(np.where(hits, found / positions, 0.0), axis=1) / denominator,
+        'P': found[:, cut] / np.asarray(cutoffs, dtype=np.float64),
+        'recall': found[:, cut] / denominator[:, None],
+    }
+    at_r = np.clip(relevant.astype(np.int64), 1, width) - 1
+    measures['Rprec'] = np.take_along_axis(found, at_r[:, None], axis=1)[:, 0] / denominator
+    first = np.argmax(hits, axis=1)
+    measures['recip_rank'] = np.where(hits.any(axis=1), 1.0 / (first + 1), 0.0)
+
+    # nDCG@k: descuento log2(posición + 1) sobre la ganancia graduada
+    discounts = 1.0 / np.log2(np.arange(2, max(width, ideal.shape[1]) + 2))
+    dcg = np.cumsum(gains * discounts[:width], axis=1)[:, cut]
+    ideal_cut = np.asarray(cutoffs) - 1
+    idcg = np.cumsum(ideal * discounts[:ideal.shape[1]], axis=1)[:, ideal_cut]
+    measures['ndcg_cut'] = np.where(idcg > 0, dcg / np.where(idcg > 0, idcg, 1.0), 0.0)
+
+    measures['num_ret'] = np.asarray(retrieved, dtype=np.int64)
+    measures['num_rel'] = relevant.astype(np.int64)
+    measures['num_rel_ret'] = found[:, -1]
+    return measures
+
+
+def evaluate_run(run: Run, qrels: Qrels, query_ids: Optional[Sequence[str]] = None,
+                 depth: Optional[int] = None,
+                 cutoffs: Sequence[int] = CUTOFFS) -> Tuple[List[str], Dict[str, np.ndarray]]:
+    """
+    Métricas por consulta de una ejecución.
+
+    Args:
+        query_ids: Consultas evaluadas; por defecto, como trec_eval, las de la
+            ejecución que tienen qrels
+
+    Returns:
+        (consultas, {métrica: arreglo por consulta})
+    """
+    if query_ids is None:
+        query_ids = [query_id for query_id in run if query_id in qrels]
+    query_ids = list(query_ids)
+    gains, retrieved = relevance_matrix(run, qrels, query_ids, depth)
+    judgments = [qrels.get(query_id, {}) for query_id in query_ids]
+    return query_ids, evaluate_gains(gains, relevant_counts(judgments), ideal_gains(judgments, max(cutoffs)),
+                                     retrieved, cutoffs)
+
+
+def summarize(measures: Dict[str, np.ndarray]) -> Dict:
+    """Media de cada métrica sobre las consultas (sumas para los contadores num_*)"""
+    summary = {}
+    for name, values in measures.items():
+        if name.startswith('num_'):
+            summary[name] = int(values.sum())
+        elif values.ndim == 2:
+            summary[name] = (values.mean(axis=0) if len(values) else np.zeros(values.shape[1])).tolist()
+        else:
+            summary[name] = float(values.mean()) if len(values) else 0.0
+    return summary
+
+
+def _incomplete_beta_fraction(a: float, b: float, x: float) -> float:
+    """Fracción continua de la beta incompleta (método de Lentz)"""
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 300):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1.0) < 1e-15:
+            break
+    return result
+
+
+def _regularized_beta(a: float, b: float, x: float) -> float:
+    """I_x(a, b)"""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                     a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _incomplete_beta_fraction(a, b, x) / a
+    return 1.0 - front * _incomplete_beta_fraction(b, a, 1.0 - x) / b
+
+
+def paired_t_test(a: np.ndarray, b: np.ndarray) -> Tuple[float, float]:
+    """t de Student pareado de dos colas sobre las diferencias por consulta: (t, p)"""
+    differences = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    n = len(differences)
+    if n < 2:
+        return 0.0, 1.0
+    mean = differences.mean()
+    deviation = differences.std(ddof=1)
+    if deviation == 0:
+        return (0.0, 1.0) if mean == 0 else (math.copysign(math.inf, mean), 0.0)
+    t = float(mean / (deviation / math.sqrt(n)))
+    freedom = n - 1
+    return t, _regularized_beta(freedom / 2.0, 0.5, freedom / (freedom + t * t))
+
+
+def randomization_test(a: np.ndarray, b: np.ndarray, trials: int = RANDOMIZATION_TRIALS,
+                       seed: int = 0) -> float:
+    """
+    Test de aleatorización pareado de dos colas (Fisher): intercambia al azar
+    los sistemas en cada consulta y cuenta las permutaciones con una diferencia
+    de medias al menos tan grande como la observada. Devuelve el p-valor.
+    """
+    differences = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    n = len(differences)
+    if n == 0:
+        return 1.0
+    observed = abs(differences.sum())
+    rng = np.random.default_rng(seed)
+    step = max(1, RANDOMIZATION_CELLS // n)
+    extreme = 0
+    for start in range(0, trials, step):
+        signs = rng.integers(0, 2, size=(min(step, trials - start), n)) * 2.0 - 1.0
+        # Tolerancia para que las permutaciones iguales a la observada cuenten
+        extreme += int(np.count_nonzero(np.abs(signs @ differences) >= observed - 1e-9))
+    return (extreme + 1) / (trials + 1)
+
+
+def compare(a: Dict[str, np.ndarray], b: Dict[str, np.ndarray],
+            measures: Iterable[str] = ('map', 'P@10', 'ndcg_cut@10', 'recip_rank'),
+            cutoffs: Sequence[int] = CUTOFFS, trials: int = RANDOMIZATION_TRIALS) -> Dict[str, Dict]:
+    """
+    Tests pareados entre dos sistemas evaluados sobre las mismas consultas.
+
+    Args:
+        a, b: Métricas por consulta (evaluate_run / evaluate_gains)
+        measures: Métricas escalares o "<métrica>@<corte>" para P, recall y ndcg_cut
+
+    Returns:
+        {métrica: {mean_a, mean_b, difference, t, p_t_test, p_randomization}}
+    """
+    report = {}
+    for name in measures:
+        values_a, values_b = _measure(a, name, cutoffs), _measure(b, name, cutoffs)
+        t, p = paired_t_test(values_a, values_b)
+        report[name] = {
+            'mean_a': float(values_a.mean()) if len(values_a) else 0.0,
+            'mean_b': float(values_b.mean()) if len(values_b) else 0.0,
+            'difference': float((values_a - values_b).mean()) if len(values_a) else 0.0,
+            't': t,
+            'p_t_test': p,
+            'p_randomization': randomization_test(values_a, values_b, trials),
+        }
+    return report
+
+
+def _measure(measures: Dict[str, np.ndarray], name: str, cutoffs: Sequence[int]) -> np.ndarray:
+    """Columna de una métrica por consulta: "map" o "P@10" (corte de una métrica por corte)"""
+    if '@' in name:
+        base, cutoff = name.split('@')
+        return measures[base][:, list(cutoffs).index(int(cutoff))]
+    return measures[name]
+
+
+def read_run(path: str) -> Run:
+    """
+    Lee un run TREC (`qid Q0 docid rank score tag`). Como trec_eval, ignora la
+    columna rank y ordena por score descendente (empates por docid descendente).
+    """
+    run = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) != 6:
+                raise ValueError(f"Línea de run mal formada en {path}: {line.strip()}")
+            run.setdefault(fields[0], []).append((fields[2], float(fields[4])))
+    for ranking in run.values():
+        ranking.sort(key=lambda item: item[0], reverse=True)
+        ranking.sort(key=lambda item: item[1], reverse=True)
+    return run
+
+
+def write_run(path: str, run: Run, tag: str = RUN_TAG) -> None:
+    """Escribe un run TREC con el orden de cada ranking (rank desde 1)"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for query_id, ranking in run.items():
+            for rank, (doc_id, score) in enumerate(ranking, 1):
+                f.write(f"{query_id} Q0 {doc_id} {rank} {score:.6f} {tag}\n")
+
+
+def read_qrels(path: str) -> Qrels:
+    """Lee qrels TREC (`qid iter docid relevancia`)"""
+    qrels = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) != 4:
+                raise ValueError(f"Línea de qrels mal formada en {path}: {line.strip()}")
+            qrels.setdefault(fields[0], {})[fields[2]] = int(fields[3])
+    return qrels
+
+
+def write_qrels(path: str, qrels: Qrels) -> None:
+    """Escribe qrels TREC"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for query_id, judged in qrels.items():
+            for doc_id, relevance in judged.items():
+                f.write(f"{query_id} 0 {doc_id} {relevance}\n")
+
+
+def format_summary(summary: Dict, cutoffs: Sequence[int] = CUTOFFS) -> List[str]:
+    """Líneas `métrica all valor` al estilo de la salida de trec_eval"""
+    lines = []
+    for name, value in summary.items():
+        if isinstance(value, list):
+            lines.extend(f"{name + '_' + str(cutoff):<22}\tall\t{v:.4f}" for cutoff, v in zip(cutoffs, value))
+        elif name.startswith('num_'):
+            lines.append(f"{name:<22}\tall\t{value}")
+        else:
+            lines.append(f"{name:<22}\tall\t{value:.4f}")
+    return lines
+
+
+def main(argv=None):
+    """Evalúa runs TREC externos: `python -m src.trec_eval qrels run [run2]`"""
+    parser = argparse.ArgumentParser(description="Métricas compatibles con trec_eval")
+    parser.add_argument("qrels", help="qrels en formato TREC")
+    parser.add_argument("runs", nargs="+", help="uno o dos runs en formato TREC")
+    parser.add_argument("--depth", type=int, default=None, help="documentos evaluados por consulta")
+    parser.add_argument("--trials", type=int, default=RANDOMIZATION_TRIALS,
+                        help="permutaciones del test de aleatorización")
+    args = parser.parse_args(argv)
+    if len(args.runs) > 2:
+        parser.error("se admiten como máximo dos runs")
+
+    qrels = read_qrels(args.qrels)
+    evaluated = []
+    for path in args.runs:
+        query_ids, measures = evaluate_run(read_run(path), qrels, depth=args.depth)
+        evaluated.append((query_ids, measures))
+        print(f"== {path} ({len(query_ids)} consultas)")
+        for line in format_summary(summarize(measures)):
+            print(line)
+    if len(evaluated) == 2:
+        # Los tests se hacen sobre las consultas presentes en ambos runs
+        (ids_a, a), (ids_b, b) = evaluated
+        rows_b = {query_id: row for row, query_id in enumerate(ids_b)}
+        common = [(row, rows_b[query_id]) for row, query_id in enumerate(ids_a) if query_id in rows_b]
+        rows_a = [row for row, _ in common]
+        rows_b = [row for _, row in common]
+        a = {name: values[rows_a] for name, values in a.items()}
+        b = {name: values[rows_b] for name, values in b.items()}
+        print(f"== Significancia ({len(common)} consultas comunes)")
+        for name, test in compare(a, b, trials=args.trials).items():
+            print(f"{name:<14} {test['mean_a']:.4f} vs {test['mean_b']:.4f}  "
+                  f"t={test['t']:.3f} p={test['p_t_test']:.4f} p_aleat={test['p_randomization']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,8 +20,14 @@ def save_results(results: Dict, filepath: str) -> None:
     with open(filepath, 'w') as f:
         json.dump(results, f, indent=2)
 
-def get_doc_text_by_id(doc_id, doc_texts):
+def get_doc_text_by_id(doc_id, doc_texts, max_chars: int = None):
     """
-    Devuelve el texto del documento a partir de su doc_id usando el diccionario doc_texts cargado en memoria.
+    Devuelve el texto del documento a partir de su doc_id usando doc_texts (un
+    diccionario o una vista del almacén de documentos). Con max_chars solo se
+    recuperan los primeros caracteres, sin descomprimir el documento completo.
     """
-    return doc_texts.get(doc_id, "[No se ha encontrado texto]")
\ No newline at end of file
+    if max_chars is None:
+        return doc_texts.get(doc_id, "[No se ha encontrado texto]")
+    if hasattr(doc_texts, 'snippet'):
+        return doc_texts.snippet(doc_id, max_chars, "[No se ha encontrado texto]")
+    return doc_texts.get(doc_id, "[No se ha encontrado texto]")[:max_chars]
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Normas TF-IDF del índice incremental: tras altas, reemplazos, borrados y
+mezclas deben coincidir con las de un índice construido de una vez con los
+documentos vivos, sin recalcularlas a mano.
+"""
+import os
+import random
+import numpy as np
+import pytest
+
+pytest.importorskip("ir_datasets")
+
+from src.incremental import IndexWriter, TieredMergePolicy
+from src.retrieval import RetrievalSystem
+from src.segment import Segment
+from src.segment_set import SegmentSet
+
+WORDS = ["river", "bridge", "castle", "engine", "forest", "garden", "harbor", "island",
+         "lantern", "meadow", "mountain", "orchard", "palace", "signal", "tower", "valley"]
+QUERIES = ["river bridge", "castle tower garden", "engine signal", "forest meadow valley river"]
+
+
+def _corpus(n: int, seed: int):
+    rng = random.Random(seed)
+    return [(f"doc{seed}_{i}", " ".join(rng.choice(WORDS[:rng.randint(4, len(WORDS))])
+                                        for _ in range(rng.randint(3, 30))))
+            for i in range(n)]
+
+
+def _norms_by_doc(segment_set) -> dict:
+    return {segment_set.doc_ids[o]: float(segment_set.doc_norms[o])
+            for o in range(len(segment_set.doc_norms)) if not segment_set.deleted_mask[o]}
+
+
+def _assert_same_tfidf(index_path: str, live: dict, reference_path: str):
+    reference = IndexWriter(reference_path, fast_tokenizer=True)
+    reference.add_documents(live.items())
+    single = Segment(os.path.join(reference_path, reference.manifest['segments'][0]))
+    expected = {single.doc_ids[o]: float(single.doc_norms[o]) for o in range(single.doc_count)}
+
+    norms = _norms_by_doc(SegmentSet(index_path))
+    assert sorted(norms) == sorted(expected)
+    for doc_id, norm in expected.items():
+        assert norms[doc_id] == pytest.approx(norm, rel=1e-5, abs=1e-6)
+
+    system = RetrievalSystem(index_path)
+    single_system = RetrievalSystem(os.path.join(reference_path, reference.manifest['segments'][0]))
+    for query in QUERIES:
+        results = dict(system.tfidf_search(query, k=len(live)))
+        expected_results = dict(single_system.tfidf_search(query, k=len(live)))
+        assert sorted(results) == sorted(expected_results)
+        for doc_id, score in expected_results.items():
+            assert results[doc_id] == pytest.approx(score, rel=1e-5, abs=1e-6)
+
+
+@pytest.mark.parametrize("term_vectors", [False, True])
+def test_tfidf_matches_single_index_after_updates(tmp_path, term_vectors):
+    index_path = str(tmp_path / "index")
+    writer = IndexWriter(index_path, TieredMergePolicy(merge_factor=3), fast_tokenizer=True,
+                         term_vectors=term_vectors)
+    rng = random.Random(7)
+    live = {}
+    for batch_no in range(6):
+        batch = _corpus(60, batch_no)
+        # Reemplazos de documentos ya indexados
+        batch += [(doc_id, "river bridge " + live[doc_id]) for doc_id in rng.sample(sorted(live), min(5, len(live)))]
+        writer.add_documents(batch)
+        live.update(batch)
+        deleted = rng.sample(sorted(live), 10)
+        assert writer.delete_documents(deleted) == 10
+        for doc_id in deleted:
+            del live[doc_id]
+        writer.maybe_merge()
+    _assert_same_tfidf(index_path, live, str(tmp_path / "reference"))
+
+    writer.force_merge()
+    _assert_same_tfidf(index_path, live, str(tmp_path / "reference_merged"))
+
+
+def test_each_commit_publishes_norms(tmp_path):
+    index_path = str(tmp_path / "index")
+    writer = IndexWriter(index_path, fast_tokenizer=True)
+    writer.add_documents(_corpus(50, 0))
+    system = RetrievalSystem(index_path)
+    before = system.tfidf_search("castle tower", k=5)
+
+    # Un lote nuevo cambia el idf de todos los términos: la nueva generación ya lo refleja
+    writer.add_documents([(f"extra{i}", "castle castle tower") for i in range(20)])
+    assert system.refresh()
+    live = dict(_corpus(50, 0))
+    live.update((f"extra{i}", "castle castle tower") for i in range(20))
+    assert system.tfidf_search("castle tower", k=5) != before
+    _assert_same_tfidf(index_path, live, str(tmp_path / "reference"))
+    assert np.all(np.isfinite(SegmentSet(index_path).doc_norms))
+
+
+def test_uncommitted_deletes_are_invisible(tmp_path):
+    index_path = str(tmp_path / "index")
+    writer = IndexWriter(index_path, fast_tokenizer=True)
+    docs = _corpus(50, 0)
+    writer.add_documents(docs)
+    before = SegmentSet(index_path)
+
+    # Borrados escritos pero sin publicar (como tras una caída antes del commit)
+    deleted, _ = writer._delete([doc_id for doc_id, _ in docs[:10]])
+    assert deleted
+    after = SegmentSet(index_path)
+    assert after.generation == before.generation
+    assert after.doc_count == before.doc_count
+    assert np.array_equal(after.doc_norms, before.doc_norms)
+
+    # Un escritor nuevo parte del manifiesto publicado y repite los borrados
+    writer = IndexWriter(index_path, fast_tokenizer=True)
+    assert writer.delete_documents([doc_id for doc_id, _ in docs[:10]]) == 10
+    live = dict(docs[10:])
+    _assert_same_tfidf(index_path, live, str(tmp_path / "reference"))